@@ -3,7 +3,10 @@ import memnotify
 
 
 def index(request):
-    notifications = []
-    if request.user.is_authenticated:
+    if hasattr(request, 'memnotify'):
+        notifications = request.memnotify.messages
+    elif request.user.is_authenticated:
         notifications = memnotify.get_messages(request.user)
+    else:
+        notifications = []
     return render(request, 'index.html', {'notifications': notifications})
@@ -3,9 +3,16 @@ Tools for sending in-memory notifications.
 """
 from __future__ import unicode_literals
 
+import contextvars
+import os
+import threading
+
 from django.conf import settings
 from django.utils.module_loading import import_string
 
+from memnotify.buffer import SendBuffer
+from memnotify.instrumentation import instrumented
+
 
 __VERSION__ = 0.1
 
@@ -22,11 +29,15 @@ CRITICAL = 50
 
 """
 memnotify backend configuration
+
+The notifier is built on first use instead of at import time, and again in
+child processes after a fork so they never share the parent's connections.
 """
 _DEFAULT_BACKEND = 'memnotify.backends.redis_backend.RedisBackend'
-_backend_str = getattr(settings, 'MEMNOTIFY_BACKEND', _DEFAULT_BACKEND)
-_backend = import_string(_backend_str or _DEFAULT_BACKEND)
-_notifier = _backend()
+_backend_str = None
+_backend = None
+_notifier = None
+_notifier_lock = threading.Lock()
 
 def reload_config(backend=None):
     global _backend_str
@@ -40,38 +51,288 @@ def reload_config(backend=None):
         _backend = import_string(_backend_str or _DEFAULT_BACKEND)
         _notifier = _backend()
 
+def _get_notifier():
+    global _notifier
+    if _notifier is None:
+        # Concurrent first calls would build several notifiers, each one with
+        # its own connection pool
+        with _notifier_lock:
+            if _notifier is None:
+                if _backend is None:
+                    reload_config()
+                else:
+                    _notifier = _backend()
+    return _notifier
+
+def _reset_notifier():
+    global _notifier
+    global _notifier_lock
+    global _buffer
+    _notifier = None
+    # Another thread of the parent may have been holding the lock
+    _notifier_lock = threading.Lock()
+    _buffer = None
+
+os.register_at_fork(after_in_child=_reset_notifier)
+
+
+"""
+Buffered sends
+
+If MEMNOTIFY_BUFFERED is True the send shortcuts queue the messages and return
+at once; a background thread sends them in batches (see memnotify.buffer).
+"""
+_buffer = None
+
+def _get_buffer():
+    global _buffer
+    if _buffer is None and getattr(settings, 'MEMNOTIFY_BUFFERED', False):
+        _buffer = SendBuffer(
+            _get_notifier,
+            max_size=getattr(settings, 'MEMNOTIFY_BUFFER_MAX_SIZE', 10000),
+            batch_size=getattr(settings, 'MEMNOTIFY_BUFFER_BATCH_SIZE', 500),
+            flush_interval=getattr(settings, 'MEMNOTIFY_BUFFER_FLUSH_INTERVAL', 0.1),
+            put_timeout=getattr(settings, 'MEMNOTIFY_BUFFER_PUT_TIMEOUT', 0),
+            max_retries=getattr(settings, 'MEMNOTIFY_BUFFER_MAX_RETRIES', 3),
+            shutdown_timeout=getattr(settings, 'MEMNOTIFY_BUFFER_SHUTDOWN_TIMEOUT', 5),
+        )
+    return _buffer
+
+def flush(timeout=None):
+    """
+    Waits until the buffered messages have been sent. Returns False if timeout
+    seconds passed first.
+    """
+    buffer = _buffer
+    return True if buffer is None else buffer.flush(timeout)
+
+def buffer_stats():
+    """
+    Returns the counters of the buffered sends, or None if they are disabled.
+    """
+    buffer = _buffer
+    return None if buffer is None else buffer.stats()
+
+
+"""
+Notifications cached for the current request by memnotify.middleware
+"""
+_request_notifications = contextvars.ContextVar('memnotify_request_notifications', default=None)
+
+def _invalidate_request_cache(user=None, buffered=False):
+    cache = _request_notifications.get()
+    if cache is not None:
+        cache.invalidate(user, buffered)
+
 
 """
 Shortcut for memnotify methods
 """
+@instrumented
 def send(user, content, level=INFO, sender=None, expired_at=None, one_time=False):
-    with _notifier as connection:
-        return _notifier.send(user, content, level, sender, expired_at, one_time)
+    buffer = _get_buffer()
+    if buffer is not None:
+        buffer.put([user], content, level, sender, expired_at, one_time)
+        _invalidate_request_cache(user, buffered=True)
+        return None
+    notifier = _get_notifier()
+    with notifier as connection:
+        result = notifier.send(user, content, level, sender, expired_at, one_time)
+    _invalidate_request_cache(user)
+    return result
+
+@instrumented
+def send_many(users, content, level=INFO, sender=None, expired_at=None, one_time=False):
+    buffer = _get_buffer()
+    if buffer is not None:
+        buffer.put(list(users), content, level, sender, expired_at, one_time)
+        _invalidate_request_cache(buffered=True)
+        return None
+    notifier = _get_notifier()
+    with notifier as connection:
+        result = notifier.send_many(users, content, level, sender, expired_at, one_time)
+    _invalidate_request_cache()
+    return result
 
+@instrumented
 def num_unread(user):
-    with _notifier as connection:
-        return _notifier.num_unread(user)
+    notifier = _get_notifier()
+    with notifier as connection:
+        return notifier.num_unread(user)
 
-def get_messages(user):
-    with _notifier as connection:
-        return _notifier.get_messages(user)
+@instrumented
+def get_messages(user, limit=None, cursor=None, min_level=None):
+    notifier = _get_notifier()
+    with notifier as connection:
+        return notifier.get_messages(user, limit, cursor, min_level)
 
+@instrumented
+def num_unread_many(users):
+    notifier = _get_notifier()
+    with notifier as connection:
+        return notifier.num_unread_many(users)
+
+@instrumented
+def get_messages_many(users, limit=None):
+    notifier = _get_notifier()
+    with notifier as connection:
+        return notifier.get_messages_many(users, limit)
+
+@instrumented
 def get_last_and_read(user):
-    with _notifier as connection:
-        return _notifier.get_last_and_read(user)
+    notifier = _get_notifier()
+    with notifier as connection:
+        result = notifier.get_last_and_read(user)
+    _invalidate_request_cache(user)
+    return result
+
+@instrumented
+def get_and_read(user, n=None):
+    notifier = _get_notifier()
+    with notifier as connection:
+        result = notifier.get_and_read(user, n)
+    _invalidate_request_cache(user)
+    return result
 
+@instrumented
 def mark_all_as_read(user):
-    with _notifier as connection:
-        return _notifier.mark_all_as_read(user)
+    notifier = _get_notifier()
+    with notifier as connection:
+        result = notifier.mark_all_as_read(user)
+    _invalidate_request_cache(user)
+    return result
+
+@instrumented
+def reap(batch_size=1000, rate_limit=None):
+    notifier = _get_notifier()
+    with notifier as connection:
+        return notifier.reap(batch_size, rate_limit)
+
+def dump(batch_size=1000):
+    # Not instrumented, the messages are read while the caller iterates
+    notifier = _get_notifier()
+    with notifier as connection:
+        yield from notifier.dump(batch_size)
+
+@instrumented
+def load(records, batch_size=1000):
+    notifier = _get_notifier()
+    with notifier as connection:
+        count = notifier.load(records, batch_size)
+    _invalidate_request_cache()
+    return count
 
+@instrumented
 def global_send(content, level=INFO, sender=None, expired_at=None):
-    with _notifier as connection:
-        return _notifier.global_send(content, level, sender, expired_at)
+    notifier = _get_notifier()
+    with notifier as connection:
+        return notifier.global_send(content, level, sender, expired_at)
+
+@instrumented
+def global_num_unread(user=None):
+    notifier = _get_notifier()
+    with notifier as connection:
+        return notifier.global_num_unread(user)
+
+@instrumented
+def global_get_messages(user=None):
+    notifier = _get_notifier()
+    with notifier as connection:
+        return notifier.global_get_messages(user)
+
+
+"""
+Async shortcuts for memnotify methods
+"""
+@instrumented
+async def asend(user, content, level=INFO, sender=None, expired_at=None, one_time=False):
+    buffer = _get_buffer()
+    if buffer is not None:
+        # Never waits for room in the queue, it would block the event loop
+        buffer.put([user], content, level, sender, expired_at, one_time, block=False)
+        _invalidate_request_cache(user, buffered=True)
+        return None
+    notifier = _get_notifier()
+    async with notifier as connection:
+        result = await notifier.asend(user, content, level, sender, expired_at, one_time)
+    _invalidate_request_cache(user)
+    return result
+
+@instrumented
+async def asend_many(users, content, level=INFO, sender=None, expired_at=None, one_time=False):
+    buffer = _get_buffer()
+    if buffer is not None:
+        buffer.put(list(users), content, level, sender, expired_at, one_time, block=False)
+        _invalidate_request_cache(buffered=True)
+        return None
+    notifier = _get_notifier()
+    async with notifier as connection:
+        result = await notifier.asend_many(users, content, level, sender, expired_at, one_time)
+    _invalidate_request_cache()
+    return result
+
+@instrumented
+async def anum_unread(user):
+    notifier = _get_notifier()
+    async with notifier as connection:
+        return await notifier.anum_unread(user)
+
+@instrumented
+async def aget_messages(user, limit=None, cursor=None, min_level=None):
+    notifier = _get_notifier()
+    async with notifier as connection:
+        return await notifier.aget_messages(user, limit, cursor, min_level)
+
+@instrumented
+async def anum_unread_many(users):
+    notifier = _get_notifier()
+    async with notifier as connection:
+        return await notifier.anum_unread_many(users)
+
+@instrumented
+async def aget_messages_many(users, limit=None):
+    notifier = _get_notifier()
+    async with notifier as connection:
+        return await notifier.aget_messages_many(users, limit)
+
+@instrumented
+async def aget_last_and_read(user):
+    notifier = _get_notifier()
+    async with notifier as connection:
+        result = await notifier.aget_last_and_read(user)
+    _invalidate_request_cache(user)
+    return result
+
+@instrumented
+async def aget_and_read(user, n=None):
+    notifier = _get_notifier()
+    async with notifier as connection:
+        result = await notifier.aget_and_read(user, n)
+    _invalidate_request_cache(user)
+    return result
+
+@instrumented
+async def amark_all_as_read(user):
+    notifier = _get_notifier()
+    async with notifier as connection:
+        result = await notifier.amark_all_as_read(user)
+    _invalidate_request_cache(user)
+    return result
+
+@instrumented
+async def aglobal_send(content, level=INFO, sender=None, expired_at=None):
+    notifier = _get_notifier()
+    async with notifier as connection:
+        return await notifier.aglobal_send(content, level, sender, expired_at)
 
-def global_num_unread():
-    with _notifier as connection:
-        return _notifier.global_num_unread()
+@instrumented
+async def aglobal_num_unread(user=None):
+    notifier = _get_notifier()
+    async with notifier as connection:
+        return await notifier.aglobal_num_unread(user)
 
-def global_get_messages():
-    with _notifier as connection:
-        return _notifier.global_get_messages()
+@instrumented
+async def aglobal_get_messages(user=None):
+    notifier = _get_notifier()
+    async with notifier as connection:
+        return await notifier.aglobal_get_messages(user)
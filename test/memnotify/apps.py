@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class MemnotifyConfig(AppConfig):
+    name = 'memnotify'
+
+    def ready(self):
+        from memnotify import instrumentation
+        instrumentation.load_settings()
@@ -1,5 +1,21 @@
 """Base memnotify backend class."""
 
+import datetime
+
+from asgiref.sync import sync_to_async
+
+
+class MessageList(list):
+    """
+    List of messages returned by get_messages().
+
+    cursor is the value to pass to get_messages() to get the next page of
+    messages, or None if there are no more messages.
+    """
+    def __init__(self, messages=(), cursor=None):
+        super(MessageList, self).__init__(messages)
+        self.cursor = cursor
+
 
 class BaseMemnotifyBackend(object):
     """
@@ -13,6 +29,11 @@ class BaseMemnotifyBackend(object):
        with backend as connection:
            # do something with connection
            pass
+
+    Every method has an async version prefixed with "a" (asend(), anum_unread(),
+    ...) that can be used with "async with backend as connection". By default
+    they run the sync method in a thread; backends with an asyncio client should
+    overwrite them.
     """
     def open(self):
         """Open a new network connection with the backend server.
@@ -35,30 +56,115 @@ class BaseMemnotifyBackend(object):
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
 
+    async def aopen(self):
+        """Async version of open()."""
+        return await sync_to_async(self.open)()
+
+    async def aclose(self):
+        """Async version of close()."""
+        return await sync_to_async(self.close)()
+
+    async def __aenter__(self):
+        await self.aopen()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    def _generate_msg(self, content, level, sender, expired_at, one_time=False):
+        """
+        Returns the dict of a new message, as returned by get_messages().
+        """
+        msg = {
+            'content': content,
+            'level': level,
+            'created_at': datetime.datetime.now(),
+            'sender': sender,
+            'expired_at': expired_at,
+        }
+        if one_time:
+            msg['one_time'] = True
+        return msg
+
     def send(self, user, content, level, sender=None, expired_at=None, one_time=False):
         """
         Sends a message to a user using the memory storage backend.
         """
         raise NotImplementedError('subclasses of BaseMemNotifyBackend must override send() method')
 
+    def send_many(self, users, content, level, sender=None, expired_at=None, one_time=False):
+        """
+        Sends the same message to several users.
+
+        The default implementation calls send() for each user. Backends should
+        overwrite it to send all messages in bulk.
+        """
+        for user in users:
+            self.send(user, content, level, sender, expired_at, one_time)
+
+    def send_batch(self, messages):
+        """
+        Sends several messages, given as (users, content, level, sender,
+        expired_at, one_time) tuples.
+
+        The default implementation calls send_many() for each message. Backends
+        should overwrite it to send all messages in bulk.
+        """
+        for users, content, level, sender, expired_at, one_time in messages:
+            self.send_many(users, content, level, sender, expired_at, one_time)
+
     def num_unread(self, user):
         """
         Gets the number of unread messages for an user.
         """
         raise NotImplementedError('subclasses of BaseMemNotifyBackend must override num_unread() method')
 
-    def get_messages(self, user):
+    def get_messages(self, user, limit=None, cursor=None, min_level=None):
         """
         Gets all messages to an user.
+
+        If limit is given only the first limit messages are returned, starting
+        at cursor (the cursor attribute of the previous page). If min_level is
+        given only messages with at least that level are returned.
         """
         raise NotImplementedError('subclasses of BaseMemNotifyBackend must override get_messages() method')
 
+    def num_unread_many(self, users):
+        """
+        Gets the number of unread messages for several users, as a dict keyed
+        by user id.
+
+        The default implementation calls num_unread() for each user. Backends
+        should overwrite it to read all counts in a constant number of round
+        trips.
+        """
+        return dict((user.pk, self.num_unread(user)) for user in users)
+
+    def get_messages_many(self, users, limit=None):
+        """
+        Gets the messages to several users, as a dict of MessageList keyed by
+        user id. If limit is given at most the first limit messages of each
+        user are returned.
+
+        The default implementation calls get_messages() for each user.
+        Backends should overwrite it to read all messages in a constant number
+        of round trips.
+        """
+        return dict((user.pk, self.get_messages(user, limit)) for user in users)
+
     def get_last_and_read(self, user):
         """
         Gets the last message to an user an mark it as read.
         """
         raise NotImplementedError('subclasses of BaseMemNotifyBackend must override get_last_and_read() method')
 
+    def get_and_read(self, user, n=None):
+        """
+        Gets the first n messages to an user (all if n is None) and marks them
+        as read in a single atomic step, so messages sent meanwhile are kept.
+        """
+        raise NotImplementedError('subclasses of BaseMemNotifyBackend must override get_and_read() method')
+
     def mark_all_as_read(self, user):
         """
         Marks all messages to an user as read.
@@ -71,14 +177,117 @@ class BaseMemnotifyBackend(object):
         """
         raise NotImplementedError('subclasses of BaseMemNotifyBackend must override global_send() method')
 
-    def global_num_unread(self):
+    def global_num_unread(self, user=None):
         """
-        Gets the number of global messages.
+        Gets the number of global messages not read by an user (all global
+        messages if user is None).
         """
         raise NotImplementedError('subclasses of BaseMemNotifyBackend must override global_num_unread() method')
 
-    def global_get_messages(self):
+    def global_get_messages(self, user=None):
+        """
+        Gets the global messages not read by an user and marks them as read for
+        that user (all global messages, without marking them, if user is None).
+        """
+        raise NotImplementedError('subclasses of BaseMemNotifyBackend must override global_get_messages() method')
+
+    def reap(self, batch_size=1000, rate_limit=None):
+        """
+        Removes the expired messages of all users, including users that never
+        read their messages again. Keys are walked in batches of batch_size,
+        at most rate_limit keys per second if given.
+
+        Returns a dict with the number of keys checked, and the number and size
+        in bytes of the messages removed, or None if the backend does not need
+        it (the default).
+        """
+        return None
+
+    def dump(self, batch_size=1000):
         """
-        Gets all global messages.
+        Yields (user id, messages) pairs with the messages of every user that
+        have not expired, and a (None, messages) pair with the global messages.
+        Messages are not marked as read. Keys are read in batches of
+        batch_size, so memory use does not grow with the number of users.
+        """
+        raise NotImplementedError('%s can not dump messages' % self.__class__.__name__)
+
+    def load(self, records, batch_size=1000):
+        """
+        Stores the messages of records, (user id, messages) pairs as yielded by
+        dump(), in batches of batch_size messages. Messages already stored are
+        kept, and global messages are unread again for every user. Loaded
+        messages are not pushed to the listeners as new messages.
+
+        Returns the number of messages stored.
+        """
+        raise NotImplementedError('%s can not load messages' % self.__class__.__name__)
+
+    def subscribe_global_changes(self, callback, seen_callback=None):
+        """
+        Calls callback whenever global messages are sent by any process, and
+        seen_callback, if given, with the id of the user whenever an user reads
+        global messages through any process.
+
+        Returns the thread that listens for changes, or None if the backend
+        can not notify them (the default).
         """
-        raise NotImplementedError('subclasses of BaseMemNotifyBackend must override global_get_messages() method')
\ No newline at end of file
+        return None
+
+    def alisten(self, user, timeout=None):
+        """
+        Async iterator of ('message', msg) and ('global', msg) pairs with the
+        messages sent to an user and the global messages, as they are sent. If
+        timeout is given it yields None after timeout seconds without messages.
+
+        Backends that can not push messages do not overwrite it.
+        """
+        raise NotImplementedError('%s can not push messages' % self.__class__.__name__)
+
+    async def asend(self, user, content, level, sender=None, expired_at=None, one_time=False):
+        """Async version of send()."""
+        return await sync_to_async(self.send)(user, content, level, sender, expired_at, one_time)
+
+    async def asend_many(self, users, content, level, sender=None, expired_at=None, one_time=False):
+        """Async version of send_many()."""
+        return await sync_to_async(self.send_many)(users, content, level, sender, expired_at, one_time)
+
+    async def anum_unread(self, user):
+        """Async version of num_unread()."""
+        return await sync_to_async(self.num_unread)(user)
+
+    async def aget_messages(self, user, limit=None, cursor=None, min_level=None):
+        """Async version of get_messages()."""
+        return await sync_to_async(self.get_messages)(user, limit, cursor, min_level)
+
+    async def anum_unread_many(self, users):
+        """Async version of num_unread_many()."""
+        return await sync_to_async(self.num_unread_many)(users)
+
+    async def aget_messages_many(self, users, limit=None):
+        """Async version of get_messages_many()."""
+        return await sync_to_async(self.get_messages_many)(users, limit)
+
+    async def aget_last_and_read(self, user):
+        """Async version of get_last_and_read()."""
+        return await sync_to_async(self.get_last_and_read)(user)
+
+    async def aget_and_read(self, user, n=None):
+        """Async version of get_and_read()."""
+        return await sync_to_async(self.get_and_read)(user, n)
+
+    async def amark_all_as_read(self, user):
+        """Async version of mark_all_as_read()."""
+        return await sync_to_async(self.mark_all_as_read)(user)
+
+    async def aglobal_send(self, content, level, sender=None, expired_at=None):
+        """Async version of global_send()."""
+        return await sync_to_async(self.global_send)(content, level, sender, expired_at)
+
+    async def aglobal_num_unread(self, user=None):
+        """Async version of global_num_unread()."""
+        return await sync_to_async(self.global_num_unread)(user)
+
+    async def aglobal_get_messages(self, user=None):
+        """Async version of global_get_messages()."""
+        return await sync_to_async(self.global_get_messages)(user)
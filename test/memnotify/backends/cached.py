@@ -0,0 +1,283 @@
+"""Backend for memnotify that caches global messages of another backend in memory."""
+
+from collections import OrderedDict
+
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from memnotify.backends.base import BaseMemnotifyBackend
+
+
+_DEFAULT_BACKEND = 'memnotify.backends.redis_backend.RedisBackend'
+
+
+class CachedBackend(BaseMemnotifyBackend):
+    """
+    Wraps another backend and keeps the global messages and the number of
+    unread global messages in a process local LRU cache for a few seconds.
+
+    Global messages sent through this backend invalidate the cache at once.
+    Global messages sent by other processes invalidate it as soon as the
+    wrapped backend notifies them (see subscribe_global_changes()), or when
+    the cache timeout expires if it can not. The number of unread global
+    messages of an user is also discarded when that user reads them through
+    this backend or, if the wrapped backend notifies it, through any other
+    process.
+
+    Any other argument is passed to the wrapped backend.
+    """
+    def __init__(self, *args, **kwargs):
+        if 'backend' in kwargs:
+            backend = kwargs.pop('backend')
+        else:
+            backend = getattr(settings, 'MEMNOTIFY_CACHED_BACKEND', _DEFAULT_BACKEND)
+        if 'timeout' in kwargs:
+            self._timeout = kwargs.pop('timeout')
+        else:
+            self._timeout = getattr(settings, 'MEMNOTIFY_CACHE_TIMEOUT', 60)
+        if 'max_entries' in kwargs:
+            self._max_entries = kwargs.pop('max_entries')
+        else:
+            self._max_entries = getattr(settings, 'MEMNOTIFY_CACHE_MAX_ENTRIES', 10000)
+        if 'subscribe' in kwargs:
+            self._subscribe = kwargs.pop('subscribe')
+        else:
+            self._subscribe = getattr(settings, 'MEMNOTIFY_CACHE_SUBSCRIBE', True)
+        self.backend = import_string(backend)(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = 0
+        # Entries discarded one by one: key -> value of _discards when it was
+        # discarded, for up to max_entries keys. Older keys are taken as
+        # discarded at _discard_floor.
+        self._discards = 0
+        self._discarded = OrderedDict()
+        self._discard_floor = 0
+        self._subscription = None
+        self._subscription_lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, version, value = entry
+            if version != self._version or expires <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _get_version(self):
+        """
+        Returns the version to pass to _set() for a value about to be read.
+        """
+        with self._lock:
+            return self._version, self._discards
+
+    def _set(self, key, value, version, expires=None):
+        timeout = time.time() + self._timeout
+        expires = timeout if expires is None else min(expires, timeout)
+        version, discards = version
+        with self._lock:
+            if version != self._version or self._discarded.get(key, self._discard_floor) > discards:
+                return # The cache or the key was invalidated while reading the value
+            self._entries[key] = (expires, version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def _delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._discards += 1
+            self._discarded[key] = self._discards
+            self._discarded.move_to_end(key)
+            while len(self._discarded) > self._max_entries:
+                self._discard_floor = self._discarded.popitem(last=False)[1]
+
+    def _get_next_expiry(self, messages):
+        expirations = [msg['expired_at'].timestamp() for msg in messages if msg['expired_at'] is not None]
+        return min(expirations) if expirations else None
+
+    def _get_user_key(self, user):
+        return ('global_num_unread', None if user is None else str(user.pk))
+
+    def _discard_user(self, user_id):
+        self._delete(('global_num_unread', user_id))
+
+    def invalidate(self):
+        """
+        Discards all cached values.
+        """
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+            self._discarded.clear()
+            self._discard_floor = self._discards
+
+    def _is_subscribed(self):
+        return not self._subscribe or (self._subscription is not None and self._subscription.is_alive())
+
+    def _check_subscription(self):
+        with self._subscription_lock:
+            if self._is_subscribed():
+                return
+            # Messages sent while not subscribed may have been missed
+            self.invalidate()
+            self._subscription = self.backend.subscribe_global_changes(self.invalidate, self._discard_user)
+            if self._subscription is None:
+                self._subscribe = False
+
+    def open(self):
+        opened = self.backend.open()
+        self._check_subscription()
+        return opened
+
+    def close(self):
+        return self.backend.close()
+
+    async def aopen(self):
+        opened = await self.backend.aopen()
+        if not self._is_subscribed():
+            # Subscriptions use the sync client of the wrapped backend
+            await sync_to_async(self.open)()
+        return opened
+
+    async def aclose(self):
+        return await self.backend.aclose()
+
+    def send(self, user, content, level, sender=None, expired_at=None, one_time=False):
+        return self.backend.send(user, content, level, sender, expired_at, one_time)
+
+    def send_many(self, users, content, level, sender=None, expired_at=None, one_time=False):
+        return self.backend.send_many(users, content, level, sender, expired_at, one_time)
+
+    def send_batch(self, messages):
+        return self.backend.send_batch(messages)
+
+    def num_unread(self, user):
+        return self.backend.num_unread(user)
+
+    def get_messages(self, user, limit=None, cursor=None, min_level=None):
+        return self.backend.get_messages(user, limit, cursor, min_level)
+
+    def num_unread_many(self, users):
+        return self.backend.num_unread_many(users)
+
+    def get_messages_many(self, users, limit=None):
+        return self.backend.get_messages_many(users, limit)
+
+    def get_last_and_read(self, user):
+        return self.backend.get_last_and_read(user)
+
+    def get_and_read(self, user, n=None):
+        return self.backend.get_and_read(user, n)
+
+    def mark_all_as_read(self, user):
+        return self.backend.mark_all_as_read(user)
+
+    def global_send(self, content, level, sender=None, expired_at=None):
+        try:
+            return self.backend.global_send(content, level, sender, expired_at)
+        finally:
+            self.invalidate()
+
+    def global_num_unread(self, user=None):
+        key = self._get_user_key(user)
+        count = self._get(key)
+        if count is None:
+            version = self._get_version()
+            count = self.backend.global_num_unread(user)
+            # The count changes when the first global message expires
+            expires = self._get_next_expiry(self.global_get_messages()) if count else None
+            self._set(key, count, version, expires)
+        return count
+
+    def global_get_messages(self, user=None):
+        if user is not None:
+            # Marks the messages as read for the user
+            try:
+                return self.backend.global_get_messages(user)
+            finally:
+                self._delete(self._get_user_key(user))
+        messages = self._get(('global_get_messages',))
+        if messages is None:
+            version = self._get_version()
+            messages = self.backend.global_get_messages()
+            self._set(('global_get_messages',), messages, version, self._get_next_expiry(messages))
+        return list(messages)
+
+    def reap(self, batch_size=1000, rate_limit=None):
+        return self.backend.reap(batch_size, rate_limit)
+
+    def dump(self, batch_size=1000):
+        return self.backend.dump(batch_size)
+
+    def load(self, records, batch_size=1000):
+        count = self.backend.load(records, batch_size)
+        self.invalidate()
+        return count
+
+    def alisten(self, user, timeout=None):
+        return self.backend.alisten(user, timeout)
+
+    async def asend(self, user, content, level, sender=None, expired_at=None, one_time=False):
+        return await self.backend.asend(user, content, level, sender, expired_at, one_time)
+
+    async def asend_many(self, users, content, level, sender=None, expired_at=None, one_time=False):
+        return await self.backend.asend_many(users, content, level, sender, expired_at, one_time)
+
+    async def anum_unread(self, user):
+        return await self.backend.anum_unread(user)
+
+    async def aget_messages(self, user, limit=None, cursor=None, min_level=None):
+        return await self.backend.aget_messages(user, limit, cursor, min_level)
+
+    async def anum_unread_many(self, users):
+        return await self.backend.anum_unread_many(users)
+
+    async def aget_messages_many(self, users, limit=None):
+        return await self.backend.aget_messages_many(users, limit)
+
+    async def aget_last_and_read(self, user):
+        return await self.backend.aget_last_and_read(user)
+
+    async def aget_and_read(self, user, n=None):
+        return await self.backend.aget_and_read(user, n)
+
+    async def amark_all_as_read(self, user):
+        return await self.backend.amark_all_as_read(user)
+
+    async def aglobal_send(self, content, level, sender=None, expired_at=None):
+        try:
+            return await self.backend.aglobal_send(content, level, sender, expired_at)
+        finally:
+            self.invalidate()
+
+    async def aglobal_num_unread(self, user=None):
+        key = self._get_user_key(user)
+        count = self._get(key)
+        if count is None:
+            version = self._get_version()
+            count = await self.backend.aglobal_num_unread(user)
+            expires = self._get_next_expiry(await self.aglobal_get_messages()) if count else None
+            self._set(key, count, version, expires)
+        return count
+
+    async def aglobal_get_messages(self, user=None):
+        if user is not None:
+            try:
+                return await self.backend.aglobal_get_messages(user)
+            finally:
+                self._delete(self._get_user_key(user))
+        messages = self._get(('global_get_messages',))
+        if messages is None:
+            version = self._get_version()
+            messages = await self.backend.aglobal_get_messages()
+            self._set(('global_get_messages',), messages, version, self._get_next_expiry(messages))
+        return list(messages)
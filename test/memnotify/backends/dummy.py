@@ -8,23 +8,44 @@ class DummyBackend(BaseMemnotifyBackend):
     def send(self, user, content, level, sender=None, expired_at=None, one_time=False):
         pass
 
+    def send_many(self, users, content, level, sender=None, expired_at=None, one_time=False):
+        pass
+
+    def send_batch(self, messages):
+        pass
+
     def num_unread(self, user):
         return 0
 
-    def get_messages(self, user):
+    def get_messages(self, user, limit=None, cursor=None, min_level=None):
         return []
 
+    def num_unread_many(self, users):
+        return dict((user.pk, 0) for user in users)
+
+    def get_messages_many(self, users, limit=None):
+        return dict((user.pk, []) for user in users)
+
     def get_last_and_read(self, user):
         return None
 
+    def get_and_read(self, user, n=None):
+        return []
+
     def mark_all_as_read(self, user):
         pass
 
     def global_send(self, content, level, sender=None, expired_at=None):
         pass
 
-    def global_num_unread(self):
+    def global_num_unread(self, user=None):
         return 0
 
-    def global_get_messages(self):
+    def global_get_messages(self, user=None):
         return []
+
+    def dump(self, batch_size=1000):
+        return iter(())
+
+    def load(self, records, batch_size=1000):
+        return 0
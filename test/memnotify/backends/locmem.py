@@ -0,0 +1,273 @@
+"""Backend for memnotify that keeps the messages in the memory of the process."""
+
+from collections import deque
+
+import bisect
+import heapq
+import itertools
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from memnotify import instrumentation
+from memnotify.backends.base import BaseMemnotifyBackend, MessageList
+
+
+# Key of the global messages
+_GLOBAL = object()
+
+
+class LocMemBackend(BaseMemnotifyBackend):
+    """
+    Stores the messages in the memory of the process, so they are only visible
+    to that process (and lost when it exits). Useful for single process
+    deployments and tests.
+
+    The messages of each user are kept in a deque of message ids, and the
+    expiration times in a heap, so expired messages are removed in O(log n)
+    without scanning the messages. At most MEMNOTIFY_LOCMEM_MAX_MESSAGES
+    messages are kept, the oldest ones are discarded first.
+    """
+    def __init__(self, *args, **kwargs):
+        if 'max_entries' in kwargs:
+            self._max_entries = kwargs.pop('max_entries')
+        else:
+            self._max_entries = getattr(settings, 'MEMNOTIFY_LOCMEM_MAX_MESSAGES', 100000)
+        if 'max_messages' in kwargs:
+            self._max_messages = kwargs.pop('max_messages')
+        else:
+            self._max_messages = getattr(settings, 'MEMNOTIFY_MAX_MESSAGES_PER_USER', None)
+        if self._max_messages is not None and self._max_messages < 1:
+            raise ImproperlyConfigured('the maximum number of messages per user must be at least 1')
+        super(LocMemBackend, self).__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._messages = {}         # id -> (key, msg)
+        self._users = {}            # key -> deque of ids, may contain removed ids
+        self._counts = {}           # key -> number of messages
+        self._order = deque()       # ids by age, may contain removed ids
+        self._expirations = []      # heap of (expiration timestamp, id), may contain removed ids
+        self._global_ids = []
+        self._global_seen = {}      # user key -> last global id read
+        self._global_seen_limit = 16
+        self._last_global_id = 0
+
+    def _get_key(self, user):
+        return user.pk
+
+    def _compact(self, ids):
+        return deque(msg_id for msg_id in ids if msg_id in self._messages)
+
+    def _compact_expirations(self):
+        self._expirations = [entry for entry in self._expirations if entry[1] in self._messages]
+        heapq.heapify(self._expirations)
+
+    def _compact_global_seen(self):
+        # A marker older than every stored global message is the same as no
+        # marker at all, since newer messages get greater ids anyway
+        first_id = self._global_ids[0] if self._global_ids else self._last_global_id + 1
+        self._global_seen = {key: seen for key, seen in self._global_seen.items() if seen >= first_id}
+        self._global_seen_limit = 2 * len(self._global_seen) + 16
+
+    def _add(self, key, msg):
+        msg_id = next(self._ids)
+        self._messages[msg_id] = (key, msg)
+        self._order.append(msg_id)
+        if msg['expired_at'] is not None:
+            heapq.heappush(self._expirations, (msg['expired_at'].timestamp(), msg_id))
+        if key is _GLOBAL:
+            self._global_ids.append(msg_id)
+            self._last_global_id = msg_id
+        else:
+            ids = self._users.setdefault(key, deque())
+            ids.append(msg_id)
+            self._counts[key] = self._counts.get(key, 0) + 1
+            if self._max_messages is not None:
+                while self._counts[key] > self._max_messages:
+                    self._remove(ids.popleft())
+            if len(ids) > 2 * self._counts[key] + 16:
+                self._users[key] = self._compact(ids)
+        while len(self._messages) > self._max_entries:
+            self._remove(self._order.popleft())
+        if len(self._order) > 2 * len(self._messages) + 16:
+            self._order = self._compact(self._order)
+        if len(self._expirations) > 2 * len(self._messages) + 16:
+            self._compact_expirations()
+        return msg_id
+
+    def _remove(self, msg_id):
+        key, msg = self._messages.pop(msg_id, (None, None))
+        if msg is None:
+            return
+        if key is _GLOBAL:
+            index = bisect.bisect_left(self._global_ids, msg_id)
+            del self._global_ids[index]
+            if not self._global_ids:
+                # Without global messages every marker is the same as none
+                self._global_seen.clear()
+        else:
+            self._counts[key] -= 1
+            if not self._counts[key]:
+                del self._counts[key]
+                del self._users[key]
+
+    def _expire(self):
+        now = time.time()
+        while self._expirations and self._expirations[0][0] <= now:
+            msg_id = heapq.heappop(self._expirations)[1]
+            if msg_id in self._messages:
+                self._remove(msg_id)
+                instrumentation.record('expired')
+
+    def _read(self, key, limit=None, cursor=None, min_level=None):
+        self._expire()
+        ids = self._users.get(key)
+        if ids is None:
+            return MessageList()
+        last_id = int(cursor or 0)
+        messages = []
+        removed = []
+        next_cursor = None
+        for msg_id in ids:
+            if msg_id <= last_id or msg_id not in self._messages:
+                continue
+            if limit is not None and len(messages) >= limit:
+                next_cursor = last_id
+                break
+            msg = self._messages[msg_id][1]
+            last_id = msg_id
+            if min_level is None or msg['level'] >= min_level:
+                if 'one_time' in msg:
+                    removed.append(msg_id)
+                messages.append(dict(msg))
+        for msg_id in removed:
+            self._remove(msg_id)
+        if key in self._users:
+            self._users[key] = self._compact(self._users[key])
+        return MessageList(messages, next_cursor)
+
+    def send(self, user, content, level, sender=None, expired_at=None, one_time=False):
+        msg = self._generate_msg(content, level, sender, expired_at, one_time=one_time)
+        with self._lock:
+            self._add(self._get_key(user), msg)
+
+    def send_many(self, users, content, level, sender=None, expired_at=None, one_time=False):
+        msg = self._generate_msg(content, level, sender, expired_at, one_time=one_time)
+        with self._lock:
+            for user in users:
+                self._add(self._get_key(user), dict(msg))
+
+    def num_unread(self, user):
+        with self._lock:
+            self._expire()
+            return self._counts.get(self._get_key(user), 0)
+
+    def get_messages(self, user, limit=None, cursor=None, min_level=None):
+        with self._lock:
+            return self._read(self._get_key(user), limit, cursor, min_level)
+
+    def num_unread_many(self, users):
+        with self._lock:
+            self._expire()
+            return dict((user.pk, self._counts.get(self._get_key(user), 0)) for user in users)
+
+    def get_messages_many(self, users, limit=None):
+        with self._lock:
+            return dict((user.pk, self._read(self._get_key(user), limit)) for user in users)
+
+    def get_last_and_read(self, user):
+        key = self._get_key(user)
+        with self._lock:
+            self._expire()
+            ids = self._users.get(key)
+            while ids:
+                msg_id = ids.pop()
+                if msg_id in self._messages:
+                    msg = self._messages[msg_id][1]
+                    self._remove(msg_id)
+                    return dict(msg)
+            return None
+
+    def get_and_read(self, user, n=None):
+        key = self._get_key(user)
+        messages = []
+        with self._lock:
+            self._expire()
+            ids = self._users.get(key)
+            while ids and (n is None or len(messages) < n):
+                msg_id = ids.popleft()
+                if msg_id in self._messages:
+                    messages.append(dict(self._messages[msg_id][1]))
+                    self._remove(msg_id)
+        return messages
+
+    def mark_all_as_read(self, user):
+        with self._lock:
+            for msg_id in list(self._users.get(self._get_key(user), ())):
+                self._remove(msg_id)
+
+    def global_send(self, content, level, sender=None, expired_at=None):
+        msg = self._generate_msg(content, level, sender, expired_at)
+        with self._lock:
+            self._add(_GLOBAL, msg)
+
+    def global_num_unread(self, user=None):
+        with self._lock:
+            self._expire()
+            seen = 0 if user is None else self._global_seen.get(self._get_key(user), 0)
+            return len(self._global_ids) - bisect.bisect_right(self._global_ids, seen)
+
+    def global_get_messages(self, user=None):
+        with self._lock:
+            self._expire()
+            seen = 0 if user is None else self._global_seen.get(self._get_key(user), 0)
+            ids = self._global_ids[bisect.bisect_right(self._global_ids, seen):]
+            if user is not None and ids:
+                self._global_seen[self._get_key(user)] = self._last_global_id
+                if len(self._global_seen) > self._global_seen_limit:
+                    self._compact_global_seen()
+            return [dict(self._messages[msg_id][1]) for msg_id in ids]
+
+    async def aopen(self):
+        return self.open()
+
+    async def aclose(self):
+        return self.close()
+
+    async def asend(self, user, content, level, sender=None, expired_at=None, one_time=False):
+        return self.send(user, content, level, sender, expired_at, one_time)
+
+    async def asend_many(self, users, content, level, sender=None, expired_at=None, one_time=False):
+        return self.send_many(users, content, level, sender, expired_at, one_time)
+
+    async def anum_unread(self, user):
+        return self.num_unread(user)
+
+    async def aget_messages(self, user, limit=None, cursor=None, min_level=None):
+        return self.get_messages(user, limit, cursor, min_level)
+
+    async def anum_unread_many(self, users):
+        return self.num_unread_many(users)
+
+    async def aget_messages_many(self, users, limit=None):
+        return self.get_messages_many(users, limit)
+
+    async def aget_last_and_read(self, user):
+        return self.get_last_and_read(user)
+
+    async def aget_and_read(self, user, n=None):
+        return self.get_and_read(user, n)
+
+    async def amark_all_as_read(self, user):
+        return self.mark_all_as_read(user)
+
+    async def aglobal_send(self, content, level, sender=None, expired_at=None):
+        return self.global_send(content, level, sender, expired_at)
+
+    async def aglobal_num_unread(self, user=None):
+        return self.global_num_unread(user)
+
+    async def aglobal_get_messages(self, user=None):
+        return self.global_get_messages(user)
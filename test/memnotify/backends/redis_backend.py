@@ -1,18 +1,540 @@
 """Backend for memnotify that uses Redis."""
 
-from redis import Redis
+from redis import BlockingConnectionPool, ConnectionPool, Redis, UnixDomainSocketConnection
+from redis import asyncio as asyncio_redis
+from redis.asyncio import cluster as asyncio_cluster, sentinel as asyncio_sentinel
+from redis.cluster import ClusterNode, RedisCluster
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from redis.sentinel import Sentinel
 
-import datetime
-import pickle
+import asyncio
+import math
+import threading
+import time
+import weakref
 
 from django.conf import settings
+from django.utils.module_loading import import_string
 
-from memnotify.backends.base import BaseMemnotifyBackend
+from memnotify import instrumentation
+from memnotify.backends.base import BaseMemnotifyBackend, MessageList
+from memnotify.serializers import PickleSerializer
+
+
+_DEFAULT_SERIALIZER = 'memnotify.serializers.PickleSerializer'
+
+# Previous versions always pickled the messages
+_LEGACY_SERIALIZER = PickleSerializer()
+
+
+# Extends the expiration of all KEYS of an user to deadline, or removes it if
+# deadline is empty (a message that never expires). The current deadline is
+# kept in the metadata hash of the user so it is never shortened.
+_KEEP_UNTIL = """
+local function keep_until(meta, deadline)
+    local current = redis.call('HGET', meta, 'deadline')
+    if deadline == '' or current == 'inf' then
+        redis.call('HSET', meta, 'deadline', 'inf')
+        for i = 1, #KEYS do
+            redis.call('PERSIST', KEYS[i])
+        end
+    else
+        if current and tonumber(current) > tonumber(deadline) then
+            deadline = current
+        end
+        redis.call('HSET', meta, 'deadline', deadline)
+        for i = 1, #KEYS do
+            redis.call('EXPIREAT', KEYS[i], deadline)
+        end
+    end
+end
+"""
+
+
+# List layout scripts. Every script receives the list of messages, its
+# metadata hash, which keeps the timestamp of the next message to expire so
+# expired messages can be detected without reading the whole list, a sorted
+# set of the messages that expire scored by expiration time and a set of the
+# one time messages. The payloads can not be decoded server side, so the
+# messages are their own members in the sorted set and the set.
+_LIST_EXPIRE = """
+local function forget(raw_msgs)
+    for i = 1, #raw_msgs, 1000 do
+        local chunk = {unpack(raw_msgs, i, math.min(i + 999, #raw_msgs))}
+        redis.call('ZREM', KEYS[3], unpack(chunk))
+        redis.call('SREM', KEYS[4], unpack(chunk))
+    end
+end
+
+local function remove(raw_msgs)
+    for i = 1, #raw_msgs do
+        redis.call('LREM', KEYS[1], 0, raw_msgs[i])
+    end
+    forget(raw_msgs)
+end
+
+-- Stores the next expiration timestamp, or deletes the keys if the list is empty
+local function update_meta()
+    if redis.call('LLEN', KEYS[1]) == 0 then
+        redis.call('DEL', KEYS[2], KEYS[3], KEYS[4])
+        return
+    end
+    local next_expiry = redis.call('ZRANGE', KEYS[3], 0, 0, 'WITHSCORES')[2]
+    if next_expiry then
+        redis.call('HSET', KEYS[2], 'next_expiry', next_expiry)
+    else
+        redis.call('HDEL', KEYS[2], 'next_expiry')
+    end
+end
+
+-- Removes the messages expired at now and returns their number. Lists without
+-- expired messages are not modified.
+local function expire(now)
+    local next_expiry = redis.call('HGET', KEYS[2], 'next_expiry')
+    if not next_expiry or tonumber(next_expiry) > tonumber(now) then
+        return 0
+    end
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now)
+    remove(expired)
+    update_meta()
+    return #expired
+end
+"""
+
+# The send script keeps only the last ARGV[4] messages (all if empty), extends
+# the expiration of the keys to ARGV[3] and publishes the message in the
+# channel ARGV[5] (if not empty). ARGV[6] is 1 for one time messages.
+_SEND_SCRIPT = _LIST_EXPIRE + _KEEP_UNTIL + """
+if ARGV[2] ~= '' then
+    local next_expiry = redis.call('HGET', KEYS[2], 'next_expiry')
+    if not next_expiry or tonumber(ARGV[2]) < tonumber(next_expiry) then
+        redis.call('HSET', KEYS[2], 'next_expiry', ARGV[2])
+    end
+    redis.call('ZADD', KEYS[3], ARGV[2], ARGV[1])
+end
+if ARGV[6] == '1' then
+    redis.call('SADD', KEYS[4], ARGV[1])
+end
+local length = redis.call('RPUSH', KEYS[1], ARGV[1])
+if ARGV[4] ~= '' and length > tonumber(ARGV[4]) then
+    forget(redis.call('LRANGE', KEYS[1], 0, length - tonumber(ARGV[4]) - 1))
+    redis.call('LTRIM', KEYS[1], -tonumber(ARGV[4]), -1)
+    length = tonumber(ARGV[4])
+end
+keep_until(KEYS[2], ARGV[3])
+if ARGV[5] ~= '' then
+    redis.call('PUBLISH', ARGV[5], ARGV[1])
+end
+return length
+"""
+
+_NUM_UNREAD_SCRIPT = """
+local next_expiry = redis.call('HGET', KEYS[2], 'next_expiry')
+if next_expiry and tonumber(next_expiry) <= tonumber(ARGV[1]) then
+    return -1
+end
+return redis.call('LLEN', KEYS[1])
+"""
+
+# Removes the messages expired at ARGV[1] and returns their number and the
+# remaining messages. If ARGV[2] is 1 the one time messages are removed after
+# being read.
+_GET_MESSAGES_SCRIPT = _LIST_EXPIRE + """
+local expired = expire(ARGV[1])
+local messages = redis.call('LRANGE', KEYS[1], 0, -1)
+if ARGV[2] == '1' and redis.call('SCARD', KEYS[4]) > 0 then
+    remove(redis.call('SMEMBERS', KEYS[4]))
+    update_meta()
+end
+return {expired, messages}
+"""
+
+# Removes the messages expired at ARGV[1] and returns their number and up to
+# ARGV[3] messages (all if 0) from the position ARGV[2].
+_GET_PAGE_SCRIPT = _LIST_EXPIRE + """
+local expired = expire(ARGV[1])
+local start = tonumber(ARGV[2])
+local stop = -1
+if ARGV[3] ~= '0' then
+    stop = start + tonumber(ARGV[3]) - 1
+end
+return {expired, redis.call('LRANGE', KEYS[1], start, stop)}
+"""
+
+# Removes the given raw messages from a list in a single atomic step and
+# stores the new next expiration timestamp. If only a part of the list was
+# read (ARGV[1] is empty) the next expiration timestamp is kept.
+_SWEEP_SCRIPT = _LIST_EXPIRE + """
+local removed = 0
+local raw_msgs = {}
+for i = 3, #ARGV do
+    removed = removed + redis.call('LREM', KEYS[1], 1, ARGV[i])
+    raw_msgs[#raw_msgs + 1] = ARGV[i]
+end
+forget(raw_msgs)
+local length = redis.call('LLEN', KEYS[1])
+if length == 0 then
+    redis.call('DEL', KEYS[2], KEYS[3], KEYS[4])
+elseif ARGV[1] == '' then
+    return removed
+elseif length ~= tonumber(ARGV[1]) - removed then
+    -- The list changed after being read, check it again on the next read
+    redis.call('HSET', KEYS[2], 'next_expiry', 0)
+elseif ARGV[2] == '' then
+    redis.call('HDEL', KEYS[2], 'next_expiry')
+else
+    redis.call('HSET', KEYS[2], 'next_expiry', ARGV[2])
+end
+return removed
+"""
+
+# Removes the messages expired at ARGV[1], then removes and returns the first
+# ARGV[2] messages (all if 0), along with the number of expired messages.
+_GET_AND_READ_SCRIPT = _LIST_EXPIRE + """
+local expired = expire(ARGV[1])
+local count = tonumber(ARGV[2])
+local messages = redis.call('LRANGE', KEYS[1], 0, count - 1)
+if #messages > 0 then
+    redis.call('LTRIM', KEYS[1], #messages, -1)
+    forget(messages)
+    update_meta()
+end
+return {expired, messages}
+"""
+
+# Removes the messages expired at ARGV[1], then removes and returns the last
+# message, if any, after the number of expired messages.
+_GET_LAST_SCRIPT = _LIST_EXPIRE + """
+local expired = expire(ARGV[1])
+local raw_msg = redis.call('RPOP', KEYS[1])
+if not raw_msg then
+    return {expired}
+end
+forget({raw_msg})
+update_meta()
+return {expired, raw_msg}
+"""
+
+
+# Sorted set layout scripts. Every script receives the index (ZSET of message
+# ids scored by expiration time), payloads (HASH of message id to payload),
+# one time (SET of message ids), sequence, metadata and order (ZSET of message
+# ids scored by id) keys, in that order.
+_ZSET_EXPIRE = """
+local function delete_ids(ids)
+    for i = 1, #ids, 1000 do
+        local chunk = {unpack(ids, i, math.min(i + 999, #ids))}
+        redis.call('ZREM', KEYS[1], unpack(chunk))
+        redis.call('HDEL', KEYS[2], unpack(chunk))
+        redis.call('SREM', KEYS[3], unpack(chunk))
+        redis.call('ZREM', KEYS[6], unpack(chunk))
+    end
+end
+
+-- Rebuilds the order of the messages stored without it by previous versions
+local function check_order()
+    if redis.call('ZCARD', KEYS[6]) ~= redis.call('HLEN', KEYS[2]) then
+        redis.call('DEL', KEYS[6])
+        local ids = redis.call('HKEYS', KEYS[2])
+        for i = 1, #ids, 1000 do
+            local args = {}
+            for j = i, math.min(i + 999, #ids) do
+                args[#args + 1] = ids[j]
+                args[#args + 1] = ids[j]
+            end
+            redis.call('ZADD', KEYS[6], unpack(args))
+        end
+    end
+end
+
+local function expire(now)
+    delete_ids(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now))
+end
+"""
+
+# Keeps only the last ARGV[5] messages (all if empty), extends the expiration
+# of the keys to ARGV[4] and publishes the message in the channel ARGV[6] (if
+# not empty).
+_ZSET_SEND_SCRIPT = _ZSET_EXPIRE + _KEEP_UNTIL + """
+check_order()
+local id = redis.call('INCR', KEYS[4])
+redis.call('HSET', KEYS[2], id, ARGV[2])
+redis.call('ZADD', KEYS[1], ARGV[1], id)
+redis.call('ZADD', KEYS[6], id, id)
+if ARGV[3] == '1' then
+    redis.call('SADD', KEYS[3], id)
+end
+if ARGV[5] ~= '' then
+    local excess = redis.call('HLEN', KEYS[2]) - tonumber(ARGV[5])
+    if excess > 0 then
+        delete_ids(redis.call('ZRANGE', KEYS[6], 0, excess - 1))
+    end
+end
+keep_until(KEYS[5], ARGV[4])
+if ARGV[6] ~= '' then
+    redis.call('PUBLISH', ARGV[6], ARGV[2])
+end
+return id
+"""
+
+_ZSET_NUM_UNREAD_SCRIPT = _ZSET_EXPIRE + """
+expire(ARGV[1])
+return redis.call('ZCARD', KEYS[1])
+"""
+
+_ZSET_GET_MESSAGES_SCRIPT = _ZSET_EXPIRE + """
+expire(ARGV[1])
+local messages = redis.call('HGETALL', KEYS[2])
+if ARGV[2] == '1' then
+    delete_ids(redis.call('SMEMBERS', KEYS[3]))
+end
+return messages
+"""
+
+_ZSET_GET_LAST_SCRIPT = _ZSET_EXPIRE + """
+expire(ARGV[1])
+check_order()
+local last = redis.call('ZREVRANGE', KEYS[6], 0, 0)[1]
+if last == nil then
+    return nil
+end
+local raw_msg = redis.call('HGET', KEYS[2], last)
+delete_ids({last})
+return raw_msg
+"""
+# Returns the id and payload of up to ARGV[3] messages (all if 0) with an id
+# greater than ARGV[2], in order.
+_ZSET_GET_PAGE_SCRIPT = _ZSET_EXPIRE + """
+expire(ARGV[1])
+check_order()
+local ids
+if ARGV[3] == '0' then
+    ids = redis.call('ZRANGEBYSCORE', KEYS[6], '(' .. ARGV[2], '+inf')
+else
+    ids = redis.call('ZRANGEBYSCORE', KEYS[6], '(' .. ARGV[2], '+inf', 'LIMIT', 0, ARGV[3])
+end
+local page = {}
+for i = 1, #ids do
+    page[#page + 1] = ids[i]
+    page[#page + 1] = redis.call('HGET', KEYS[2], ids[i])
+end
+return page
+"""
+
+# Removes and returns the payloads of the first ARGV[2] messages (all if 0)
+# that have not expired, in order.
+_ZSET_GET_AND_READ_SCRIPT = _ZSET_EXPIRE + """
+expire(ARGV[1])
+check_order()
+local ids = redis.call('ZRANGE', KEYS[6], 0, tonumber(ARGV[2]) - 1)
+local messages = {}
+for i = 1, #ids, 1000 do
+    local chunk = redis.call('HMGET', KEYS[2], unpack(ids, i, math.min(i + 999, #ids)))
+    for j = 1, #chunk do
+        messages[#messages + 1] = chunk[j]
+    end
+end
+delete_ids(ids)
+return messages
+"""
+
+# Removes the expired messages and returns their number and total size.
+_ZSET_REAP_SCRIPT = _ZSET_EXPIRE + """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local size = 0
+for i = 1, #ids, 1000 do
+    local chunk = redis.call('HMGET', KEYS[2], unpack(ids, i, math.min(i + 999, #ids)))
+    for j = 1, #chunk do
+        if chunk[j] then
+            size = size + string.len(chunk[j])
+        end
+    end
+end
+delete_ids(ids)
+return {#ids, size}
+"""
+
+_ZSET_DELETE_SCRIPT = _ZSET_EXPIRE + """
+delete_ids(ARGV)
+return #ARGV
+"""
+
+
+# Global messages are stored once for all users. KEYS are a hash of payloads by
+# id, a sorted set of ids scored by id, a sorted set of the ids that expire
+# scored by expiration time, the id counter and a hash with the read marker of
+# each user (the last id the user has read), all of them in the same cluster
+# slot. The id of the user reading messages, if any, is ARGV[2]. global_send
+# publishes the new message in the channel ARGV[3], unless it is empty, so
+# other processes can invalidate their caches and push it to their clients.
+# global_get_messages publishes the id of the user in the channel ARGV[3],
+# unless it is empty, when it moves the read marker of the user.
+_GLOBAL_EXPIRE = """
+local function expire(now)
+    local ids = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now)
+    for i = 1, #ids, 1000 do
+        local chunk = {unpack(ids, i, math.min(i + 999, #ids))}
+        redis.call('HDEL', KEYS[1], unpack(chunk))
+        redis.call('ZREM', KEYS[2], unpack(chunk))
+        redis.call('ZREM', KEYS[3], unpack(chunk))
+    end
+end
+
+local function get_seen()
+    if ARGV[2] ~= '' then
+        return redis.call('HGET', KEYS[5], ARGV[2]) or 0
+    end
+    return 0
+end
+"""
+
+_GLOBAL_SEND_SCRIPT = """
+local id = redis.call('INCR', KEYS[4])
+redis.call('HSET', KEYS[1], id, ARGV[1])
+redis.call('ZADD', KEYS[2], id, id)
+if ARGV[2] ~= '' then
+    redis.call('ZADD', KEYS[3], ARGV[2], id)
+end
+if ARGV[3] ~= '' then
+    redis.call('PUBLISH', ARGV[3], ARGV[1])
+end
+return id
+"""
+
+_GLOBAL_NUM_UNREAD_SCRIPT = _GLOBAL_EXPIRE + """
+expire(ARGV[1])
+return redis.call('ZCOUNT', KEYS[2], '(' .. get_seen(), '+inf')
+"""
+
+_GLOBAL_GET_MESSAGES_SCRIPT = _GLOBAL_EXPIRE + """
+expire(ARGV[1])
+local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '(' .. get_seen(), '+inf')
+if ARGV[2] ~= '' then
+    redis.call('HSET', KEYS[5], ARGV[2], redis.call('GET', KEYS[4]) or 0)
+    if #ids > 0 and ARGV[3] ~= '' then
+        redis.call('PUBLISH', ARGV[3], ARGV[2])
+    end
+end
+local messages = {}
+for i = 1, #ids, 1000 do
+    local chunk = redis.call('HMGET', KEYS[1], unpack(ids, i, math.min(i + 999, #ids)))
+    for j = 1, #chunk do
+        messages[#messages + 1] = chunk[j]
+    end
+end
+return messages
+"""
+
+_GLOBAL_REAP_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])
+local size = 0
+for i = 1, #ids, 1000 do
+    local chunk = {unpack(ids, i, math.min(i + 999, #ids))}
+    local raw_msgs = redis.call('HMGET', KEYS[1], unpack(chunk))
+    for j = 1, #raw_msgs do
+        if raw_msgs[j] then
+            size = size + string.len(raw_msgs[j])
+        end
+    end
+    redis.call('HDEL', KEYS[1], unpack(chunk))
+    redis.call('ZREM', KEYS[2], unpack(chunk))
+    redis.call('ZREM', KEYS[3], unpack(chunk))
+end
+return {#ids, size}
+"""
+
+_GLOBAL_SCRIPTS = {
+    'global_send': _GLOBAL_SEND_SCRIPT,
+    'global_num_unread': _GLOBAL_NUM_UNREAD_SCRIPT,
+    'global_get_messages': _GLOBAL_GET_MESSAGES_SCRIPT,
+    'global_reap': _GLOBAL_REAP_SCRIPT,
+}
+
+
+class _Subscriptions(object):
+    """
+    Shares one pub/sub connection of an event loop among all listeners. Each
+    listener receives (channel, data) pairs of its channels in a queue.
+    """
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+        self._queues = {}
+        self._task = None
+
+    async def add(self, channels, queue):
+        new_channels = [channel for channel in channels if channel not in self._queues]
+        for channel in channels:
+            self._queues.setdefault(channel, set()).add(queue)
+        if new_channels:
+            await self._pubsub.subscribe(*new_channels)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._read())
+
+    async def remove(self, channels, queue):
+        old_channels = []
+        for channel in channels:
+            queues = self._queues.get(channel, set())
+            queues.discard(queue)
+            if not queues:
+                self._queues.pop(channel, None)
+                old_channels.append(channel)
+        if old_channels:
+            await self._pubsub.unsubscribe(*old_channels)
+        if not self._queues and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _read(self):
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=None)
+            except (RedisConnectionError, RedisTimeoutError, OSError):
+                # The connection subscribes again to all channels on reconnect
+                await asyncio.sleep(1)
+                continue
+            if message is None:
+                continue
+            for queue in list(self._queues.get(message['channel'], ())):
+                try:
+                    queue.put_nowait((message['channel'], message['data']))
+                except asyncio.QueueFull:
+                    pass # Slow listeners lose messages instead of blocking the others
 
 
 class RedisBackend(BaseMemnotifyBackend):
+    """
+    Redis backend that stores the messages of each user in a list. The
+    messages that expire and the one time ones are also kept in a sorted set
+    and a set, so they are removed server side without reading the list.
+
+    Global messages are stored once and shared by all users, each user only
+    keeps the id of the last global message it has read.
+
+    Every method has a native async version built on redis.asyncio, which
+    keeps its own connection pool for each event loop.
+
+    It can use a Redis Cluster (MEMNOTIFY_REDIS_CLUSTER_NODES) or the master of
+    a Sentinel service (MEMNOTIFY_REDIS_SENTINELS) instead of a single server.
+    All keys of an user are stored in the same cluster slot, and operations on
+    several users send the commands of each node in a single batch.
+    """
+    scripts = dict(
+        _GLOBAL_SCRIPTS,
+        send=_SEND_SCRIPT,
+        num_unread=_NUM_UNREAD_SCRIPT,
+        get_messages=_GET_MESSAGES_SCRIPT,
+        get_page=_GET_PAGE_SCRIPT,
+        get_last=_GET_LAST_SCRIPT,
+        sweep=_SWEEP_SCRIPT,
+        get_and_read=_GET_AND_READ_SCRIPT,
+    )
+
     def __init__(self, *args, **kwargs):
         self.redis = None
+        self._lock = threading.Lock()
+        self._scripts = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._subscriptions = weakref.WeakKeyDictionary()
         if 'redis_host' in kwargs:
             self._redis_host = kwargs.pop('redis_host')
         else:
@@ -29,99 +551,1184 @@ class RedisBackend(BaseMemnotifyBackend):
             self._redis_passwd = kwargs.pop('redis_passwd')
         else:
             self._redis_passwd = getattr(settings, 'MEMNOTIFY_REDIS_PASSWORD', None)
+        if 'redis_unix_socket_path' in kwargs:
+            self._redis_unix_socket_path = kwargs.pop('redis_unix_socket_path')
+        else:
+            self._redis_unix_socket_path = getattr(settings, 'MEMNOTIFY_REDIS_UNIX_SOCKET_PATH', None)
+        if 'redis_max_connections' in kwargs:
+            self._redis_max_connections = kwargs.pop('redis_max_connections')
+        else:
+            self._redis_max_connections = getattr(settings, 'MEMNOTIFY_REDIS_MAX_CONNECTIONS', None)
+        if 'redis_pool_timeout' in kwargs:
+            self._redis_pool_timeout = kwargs.pop('redis_pool_timeout')
+        else:
+            self._redis_pool_timeout = getattr(settings, 'MEMNOTIFY_REDIS_POOL_TIMEOUT', None)
+        if 'redis_socket_timeout' in kwargs:
+            self._redis_socket_timeout = kwargs.pop('redis_socket_timeout')
+        else:
+            self._redis_socket_timeout = getattr(settings, 'MEMNOTIFY_REDIS_SOCKET_TIMEOUT', None)
+        if 'redis_socket_connect_timeout' in kwargs:
+            self._redis_socket_connect_timeout = kwargs.pop('redis_socket_connect_timeout')
+        else:
+            self._redis_socket_connect_timeout = getattr(settings, 'MEMNOTIFY_REDIS_SOCKET_CONNECT_TIMEOUT', None)
+        if 'redis_health_check_interval' in kwargs:
+            self._redis_health_check_interval = kwargs.pop('redis_health_check_interval')
+        else:
+            self._redis_health_check_interval = getattr(settings, 'MEMNOTIFY_REDIS_HEALTH_CHECK_INTERVAL', 0)
+        if 'redis_cluster_nodes' in kwargs:
+            self._redis_cluster_nodes = kwargs.pop('redis_cluster_nodes')
+        else:
+            self._redis_cluster_nodes = getattr(settings, 'MEMNOTIFY_REDIS_CLUSTER_NODES', None)
+        if 'redis_sentinels' in kwargs:
+            self._redis_sentinels = kwargs.pop('redis_sentinels')
+        else:
+            self._redis_sentinels = getattr(settings, 'MEMNOTIFY_REDIS_SENTINELS', None)
+        if 'redis_sentinel_service' in kwargs:
+            self._redis_sentinel_service = kwargs.pop('redis_sentinel_service')
+        else:
+            self._redis_sentinel_service = getattr(settings, 'MEMNOTIFY_REDIS_SENTINEL_SERVICE', 'mymaster')
+        if 'redis_sentinel_passwd' in kwargs:
+            self._redis_sentinel_passwd = kwargs.pop('redis_sentinel_passwd')
+        else:
+            self._redis_sentinel_passwd = getattr(settings, 'MEMNOTIFY_REDIS_SENTINEL_PASSWORD', None)
         if 'global_key' in kwargs:
             self._global_key = kwargs.pop('global_key')
         else:
             self._global_key = getattr(settings, 'MEMNOTIFY_REDIS_GLOBAL_KEY', 'GLOBAL_MSG')
+        if 'key_prefix' in kwargs:
+            self._key_prefix = kwargs.pop('key_prefix')
+        else:
+            self._key_prefix = getattr(settings, 'MEMNOTIFY_REDIS_KEY_PREFIX', 'memnotify')
+        if 'serializer' in kwargs:
+            serializer = kwargs.pop('serializer')
+        else:
+            serializer = getattr(settings, 'MEMNOTIFY_SERIALIZER', None) or _DEFAULT_SERIALIZER
+        self._serializer = import_string(serializer)()
+        if 'pipeline_size' in kwargs:
+            self._pipeline_size = kwargs.pop('pipeline_size')
+        else:
+            self._pipeline_size = getattr(settings, 'MEMNOTIFY_REDIS_PIPELINE_SIZE', 1000)
+        if 'max_messages' in kwargs:
+            self._max_messages = kwargs.pop('max_messages')
+        else:
+            self._max_messages = getattr(settings, 'MEMNOTIFY_MAX_MESSAGES_PER_USER', None)
+        if 'publish' in kwargs:
+            self._publish = kwargs.pop('publish')
+        else:
+            self._publish = getattr(settings, 'MEMNOTIFY_REDIS_PUBLISH', True)
+        if 'retention' in kwargs:
+            self._retention = kwargs.pop('retention')
+        else:
+            self._retention = getattr(settings, 'MEMNOTIFY_RETENTION', None)
         super(RedisBackend, self).__init__(*args, **kwargs)
 
+    def _make_key(self, name):
+        """
+        Returns the key of name in the memnotify namespace. name is used as a
+        hash tag, so all keys derived from it are stored in the same cluster
+        slot and can be used together in scripts and pipelines.
+        """
+        return '%s:{%s}' % (self._key_prefix, name)
+
     def _get_key(self, user):
-        return user.id
+        return self._make_key(user.id)
 
     def _codify(self, decod_msg):
-        return pickle.dumps(decod_msg)
+        cod_msg = self._serializer.dumps(decod_msg)
+        instrumentation.record('bytes_serialized', len(cod_msg))
+        return cod_msg
 
     def _decodify(self, cod_msg):
-        return pickle.loads(cod_msg)
-
-    def _generate_msg(self, content, level, sender, expired_at, one_time=False):
-        msg = {
-            'content': content,
-            'level': level,
-            'created_at': datetime.datetime.now(),
-            'sender': sender,
-            'expired_at': expired_at,
-        }
-        if one_time:
-            msg['one_time'] = True
-        return msg
+        instrumentation.record('bytes_deserialized', len(cod_msg))
+        return self._serializer.loads(cod_msg)
+
+    def _get_meta_key(self, key):
+        return '%s:meta' % key
+
+    def _get_all_keys(self, key):
+        return [key, self._get_meta_key(key), '%s:expiries' % key, '%s:one_time' % key]
+
+    def _get_global_keys(self):
+        key = self._make_key(self._global_key)
+        return ['%s:%s' % (key, name) for name in ('msgs', 'ids', 'expiry', 'last_id', 'seen')]
+
+    def _get_global_args(self, user):
+        return [time.time(), '' if user is None else user.id]
+
+    def _get_global_channel(self):
+        return '%s:changes' % self._make_key(self._global_key)
+
+    def _get_global_push_channel(self):
+        return self._get_global_channel() if self._publish else ''
 
-    def _check_expiration(self, key, msg, raw_msg):
-        expired = False
+    def _get_seen_channel(self):
+        return '%s:seen' % self._make_key(self._global_key)
+
+    def _get_global_read_args(self, user):
+        channel = self._get_seen_channel() if self._publish and user is not None else ''
+        return self._get_global_args(user) + [channel]
+
+    def _get_channel(self, key):
+        return '%s:changes' % key
+
+    def _get_push_channel(self, key):
+        return self._get_channel(key) if self._publish else ''
+
+    def _get_expiry(self, expired_at):
+        if expired_at is None:
+            return ''
+        return repr(expired_at.timestamp())
+
+    def _get_deadline(self, expired_at):
+        """
+        Returns the timestamp until the keys of an user must be kept to store a
+        message that expires at expired_at, or '' to keep them forever.
+        """
+        if expired_at is not None:
+            return int(math.ceil(expired_at.timestamp()))
+        if self._retention is not None:
+            return int(time.time() + self._retention)
+        return ''
+
+    def _get_max_messages(self):
+        return '' if self._max_messages is None else self._max_messages
+
+    def _is_expired(self, msg, now):
         exp_date = msg['expired_at']
-        if exp_date is not None and exp_date <= datetime.datetime.now():
-            expired = True
-        if 'one_time' in msg:
-            expired = True
-        if expired:
-            self.redis.lrem(key, raw_msg)
-        return expired
+        return exp_date is not None and exp_date.timestamp() <= now
 
-    def open(self):
-        if self.redis is None:
-            self.redis = Redis(
-                host=self._redis_host,
-                port=self._redis_port,
-                db=self._redis_db,
-                password=self._redis_passwd
+    def _get_push_call(self, key, raw_msg, msg, publish=True):
+        """
+        Returns the name, keys and args of the script that stores raw_msg. If
+        publish is False the message is not published to the listeners.
+        """
+        args = [
+            raw_msg,
+            self._get_expiry(msg['expired_at']),
+            self._get_deadline(msg['expired_at']),
+            self._get_max_messages(),
+            self._get_push_channel(key) if publish else '',
+            int('one_time' in msg),
+        ]
+        return 'send', self._get_all_keys(key), args
+
+    def _push(self, key, raw_msg, msg, client=None, publish=True):
+        name, keys, args = self._get_push_call(key, raw_msg, msg, publish)
+        self._scripts[name](keys=keys, args=args, client=client)
+
+    async def _apush(self, key, raw_msg, msg, client=None, publish=True):
+        name, keys, args = self._get_push_call(key, raw_msg, msg, publish)
+        scripts = self._get_async_client()[1]
+        await scripts[name](keys=keys, args=args, client=client)
+
+    def _parse_messages(self, raw_msgs, next_expiry, consume):
+        """
+        Decodes raw_msgs leaving out the expired ones. Returns the messages and
+        the args of the sweep script, or None if nothing has to be swept.
+        """
+        now = time.time()
+        messages = []
+        removed = []
+        expirations = []
+        for raw_msg in raw_msgs:
+            msg = self._decodify(raw_msg)
+            if self._is_expired(msg, now):
+                instrumentation.record('expired')
+                removed.append(raw_msg)
+                continue
+            if consume and 'one_time' in msg:
+                removed.append(raw_msg)
+            elif msg['expired_at'] is not None:
+                expirations.append(msg['expired_at'])
+            messages.append(msg)
+
+        new_next_expiry = self._get_expiry(min(expirations)) if expirations else ''
+        # The scripts store the timestamps formatted by Redis, so they are compared as numbers
+        if removed or float(new_next_expiry or 'inf') != float(next_expiry or 'inf'):
+            return messages, [len(raw_msgs), new_next_expiry] + removed
+        return messages, None
+
+    def _parse_read(self, reply):
+        """
+        Decodes the reply of the get_messages and get_and_read scripts, the
+        number of expired messages removed and the messages read.
+        """
+        expired, raw_msgs = reply
+        instrumentation.record('expired', expired)
+        return [self._decodify(raw_msg) for raw_msg in raw_msgs]
+
+    def _read_and_sweep(self, key, consume=True):
+        """
+        Reads the messages stored in key and removes the expired ones and, if
+        consume is True, the one time ones, in a single atomic step. Expired
+        messages are not returned.
+        """
+        args = [time.time(), int(consume)]
+        return self._parse_read(self._scripts['get_messages'](keys=self._get_all_keys(key), args=args))
+
+    async def _aread_and_sweep(self, key, consume=True):
+        client, scripts = self._get_async_client()
+        args = [time.time(), int(consume)]
+        return self._parse_read(await scripts['get_messages'](keys=self._get_all_keys(key), args=args))
+
+    def _filter_page(self, entries, limit, min_level, consume, messages):
+        """
+        Decodes entries, a list of (id, raw message) pairs, and appends the
+        valid ones with a level of at least min_level to messages until it has
+        limit messages.
+
+        Returns the ids of the entries that have to be removed and the number
+        of entries processed.
+        """
+        now = time.time()
+        removed = []
+        for i, (entry_id, raw_msg) in enumerate(entries):
+            if limit is not None and len(messages) >= limit:
+                return removed, i
+            msg = self._decodify(raw_msg)
+            if self._is_expired(msg, now):
+                instrumentation.record('expired')
+                removed.append(entry_id)
+            elif min_level is None or msg['level'] >= min_level:
+                if consume and 'one_time' in msg:
+                    removed.append(entry_id)
+                messages.append(msg)
+        return removed, len(entries)
+
+    def _parse_page(self, reply):
+        """
+        Returns the messages of a reply of the get_page script as the (id, raw
+        message) entries of _filter_page(). The id is the message itself.
+        """
+        expired, raw_msgs = reply
+        instrumentation.record('expired', expired)
+        return [(raw_msg, raw_msg) for raw_msg in raw_msgs]
+
+    def _read_page(self, key, limit, cursor, min_level, consume=True):
+        """
+        Reads up to limit messages with a level of at least min_level starting
+        at cursor, fetching windows of limit messages. The cursor is the
+        position of the next message in the list. The script that reads each
+        window removes the expired messages, the one time messages read are
+        removed once at the end.
+
+        Returns the messages and the cursor of the next page, None if there
+        are no more messages.
+        """
+        position = int(cursor or 0)
+        count = limit or 0
+        messages = []
+        removed = []
+        while True:
+            entries = self._parse_page(self._scripts['get_page'](keys=self._get_all_keys(key), args=[time.time(), position, count]))
+            window_removed, processed = self._filter_page(entries, limit, min_level, consume, messages)
+            removed.extend(window_removed)
+            position += processed
+            if processed == len(entries) and (limit is None or len(entries) < count):
+                position = None
+                break
+            if len(messages) >= limit:
+                break
+        if removed:
+            self._scripts['sweep'](keys=self._get_all_keys(key), args=['', ''] + removed)
+        return messages, None if position is None else position - len(removed)
+
+    async def _aread_page(self, key, limit, cursor, min_level, consume=True):
+        client, scripts = self._get_async_client()
+        position = int(cursor or 0)
+        count = limit or 0
+        messages = []
+        removed = []
+        while True:
+            entries = self._parse_page(await scripts['get_page'](keys=self._get_all_keys(key), args=[time.time(), position, count]))
+            window_removed, processed = self._filter_page(entries, limit, min_level, consume, messages)
+            removed.extend(window_removed)
+            position += processed
+            if processed == len(entries) and (limit is None or len(entries) < count):
+                position = None
+                break
+            if len(messages) >= limit:
+                break
+        if removed:
+            await scripts['sweep'](keys=self._get_all_keys(key), args=['', ''] + removed)
+        return messages, None if position is None else position - len(removed)
+
+    def _count(self, key):
+        count = self._scripts['num_unread'](keys=self._get_all_keys(key), args=[time.time()])
+        if count < 0:
+            count = len(self._read_and_sweep(key, consume=False))
+        return count
+
+    async def _acount(self, key):
+        client, scripts = self._get_async_client()
+        count = await scripts['num_unread'](keys=self._get_all_keys(key), args=[time.time()])
+        if count < 0:
+            count = len(await self._aread_and_sweep(key, consume=False))
+        return count
+
+    def _run_scripts(self, calls):
+        """
+        Runs calls, a list of (name, keys, args) script calls, in a single
+        pipeline and returns their results. Cluster pipelines send the calls
+        of each node in one round trip.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for name, keys, args in calls:
+            self._scripts[name](keys=keys, args=args, client=pipe)
+        return pipe.execute()
+
+    async def _arun_scripts(self, calls):
+        client, scripts = self._get_async_client()
+        if self._redis_cluster_nodes:
+            # The cluster client sends concurrent commands through one
+            # connection per node
+            return await asyncio.gather(*[scripts[name](keys=keys, args=args) for name, keys, args in calls])
+        pipe = client.pipeline(transaction=False)
+        for name, keys, args in calls:
+            await scripts[name](keys=keys, args=args, client=pipe)
+        return await pipe.execute()
+
+    def _parse_many(self, keys, replies, limit, consume):
+        """
+        Decodes the lists read from keys, as (raw messages, next expiry)
+        pairs, leaving out the expired messages. If limit is given only the
+        first limit messages of each list were read.
+
+        Returns a MessageList for each key and the script calls that sweep the
+        removed messages.
+        """
+        results = []
+        calls = []
+        for key, (raw_msgs, next_expiry) in zip(keys, replies):
+            cursor = None
+            if limit is None:
+                messages, sweep_args = self._parse_messages(raw_msgs, next_expiry, consume)
+            else:
+                messages = []
+                removed, processed = self._filter_page([(raw_msg, raw_msg) for raw_msg in raw_msgs], limit, None, consume, messages)
+                sweep_args = ['', ''] + removed if removed else None
+                if len(raw_msgs) == limit:
+                    cursor = processed - len(removed)
+            if sweep_args is not None:
+                calls.append(('sweep', self._get_all_keys(key), sweep_args))
+            results.append(MessageList(messages, cursor))
+        return results, calls
+
+    def _read_many(self, keys, limit=None, consume=True):
+        """
+        Reads the messages stored in several keys, or the first limit messages
+        of each one. Costs at most two round trips regardless of the number of
+        keys.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.lrange(key, 0, -1 if limit is None else limit - 1)
+            pipe.hget(self._get_meta_key(key), 'next_expiry')
+        replies = pipe.execute()
+        results, calls = self._parse_many(keys, zip(replies[::2], replies[1::2]), limit, consume)
+        if calls:
+            self._run_scripts(calls)
+        return results
+
+    async def _aread_many(self, keys, limit=None, consume=True):
+        client, scripts = self._get_async_client()
+        commands = client if self._redis_cluster_nodes else client.pipeline(transaction=False)
+        replies = []
+        for key in keys:
+            replies.append(commands.lrange(key, 0, -1 if limit is None else limit - 1))
+            replies.append(commands.hget(self._get_meta_key(key), 'next_expiry'))
+        if self._redis_cluster_nodes:
+            replies = await asyncio.gather(*replies)
+        else:
+            replies = await commands.execute()
+        results, calls = self._parse_many(keys, zip(replies[::2], replies[1::2]), limit, consume)
+        if calls:
+            await self._arun_scripts(calls)
+        return results
+
+    def _count_many(self, keys):
+        """
+        Counts the messages stored in several keys. Costs one round trip, or
+        three if the count of some keys has to be rebuilt.
+        """
+        now = time.time()
+        counts = self._run_scripts([('num_unread', self._get_all_keys(key), [now]) for key in keys])
+        stale = [key for key, count in zip(keys, counts) if count < 0]
+        if stale:
+            recounts = dict(zip(stale, [len(messages) for messages in self._read_many(stale, consume=False)]))
+            counts = [recounts.get(key, count) for key, count in zip(keys, counts)]
+        return counts
+
+    async def _acount_many(self, keys):
+        now = time.time()
+        counts = await self._arun_scripts([('num_unread', self._get_all_keys(key), [now]) for key in keys])
+        stale = [key for key, count in zip(keys, counts) if count < 0]
+        if stale:
+            recounts = dict(zip(stale, [len(messages) for messages in await self._aread_many(stale, consume=False)]))
+            counts = [recounts.get(key, count) for key, count in zip(keys, counts)]
+        return counts
+
+    def _parse_last(self, reply):
+        instrumentation.record('expired', reply[0])
+        return self._decodify(reply[1]) if len(reply) > 1 else None
+
+    def _pop_last(self, key):
+        return self._parse_last(self._scripts['get_last'](keys=self._get_all_keys(key), args=[time.time()]))
+
+    async def _apop_last(self, key):
+        client, scripts = self._get_async_client()
+        return self._parse_last(await scripts['get_last'](keys=self._get_all_keys(key), args=[time.time()]))
+
+    def _pop_first(self, key, n):
+        """
+        Removes and returns the first n valid messages (all if n is None) in a
+        single atomic step.
+        """
+        if n == 0:
+            return []
+        args = [time.time(), n or 0]
+        return self._parse_read(self._scripts['get_and_read'](keys=self._get_all_keys(key), args=args))
+
+    async def _apop_first(self, key, n):
+        if n == 0:
+            return []
+        client, scripts = self._get_async_client()
+        args = [time.time(), n or 0]
+        return self._parse_read(await scripts['get_and_read'](keys=self._get_all_keys(key), args=args))
+
+    def _get_reap_pattern(self):
+        return '%s:{*}' % self._key_prefix
+
+    def _reap_keys(self, keys, stats):
+        """
+        Removes the expired messages of the lists in keys, checking first which
+        ones have expired messages. Costs at most three round trips.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.hget(self._get_meta_key(key), 'next_expiry')
+        now = time.time()
+        candidates = [(key, next_expiry) for key, next_expiry in zip(keys, pipe.execute())
+                      if next_expiry is not None and float(next_expiry) <= now]
+        if not candidates:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for key, next_expiry in candidates:
+            pipe.lrange(key, 0, -1)
+        raw_lists = pipe.execute()
+        pipe = self.redis.pipeline(transaction=False)
+        swept = []
+        for (key, next_expiry), raw_msgs in zip(candidates, raw_lists):
+            messages, sweep_args = self._parse_messages(raw_msgs, next_expiry, consume=False)
+            if sweep_args is not None:
+                self._scripts['sweep'](keys=self._get_all_keys(key), args=sweep_args, client=pipe)
+                swept.append(sweep_args[2:])
+        for removed, raw_msgs in zip(pipe.execute(), swept):
+            # Messages removed by other clients meanwhile are not counted
+            stats['messages'] += removed
+            stats['bytes'] += sum(len(raw_msg) for raw_msg in raw_msgs[:removed])
+
+    def _get_user_id(self, key):
+        """
+        Returns the user id of the key of an user.
+        """
+        return key[len(self._key_prefix) + 2:-1]
+
+    def _dump_keys(self, keys):
+        """
+        Yields the user id and the valid messages of each list in keys,
+        reading all of them in one round trip.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.lrange(key, 0, -1)
+        now = time.time()
+        for key, raw_msgs in zip(keys, pipe.execute()):
+            messages = [msg for msg in map(self._decodify, raw_msgs) if not self._is_expired(msg, now)]
+            if messages:
+                yield self._get_user_id(key), messages
+
+    def _get_connection_pool(self, is_async=False):
+        """
+        Builds the pool of connections shared by all threads using this
+        backend. If a pool timeout is configured, threads wait up to that many
+        seconds for a free connection instead of failing when the pool is full.
+
+        If is_async is True, the pool is built for redis.asyncio clients.
+        """
+        if is_async:
+            pool_class = asyncio_redis.ConnectionPool
+            blocking_pool_class = asyncio_redis.BlockingConnectionPool
+            unix_connection_class = asyncio_redis.UnixDomainSocketConnection
+        else:
+            pool_class = ConnectionPool
+            blocking_pool_class = BlockingConnectionPool
+            unix_connection_class = UnixDomainSocketConnection
+        kwargs = {
+            'db': self._redis_db,
+            'password': self._redis_passwd,
+            'socket_timeout': self._redis_socket_timeout,
+            'health_check_interval': self._redis_health_check_interval,
+        }
+        if self._redis_unix_socket_path:
+            kwargs['connection_class'] = unix_connection_class
+            kwargs['path'] = self._redis_unix_socket_path
+        else:
+            kwargs['host'] = self._redis_host
+            kwargs['port'] = self._redis_port
+            kwargs['socket_connect_timeout'] = self._redis_socket_connect_timeout
+        if self._redis_pool_timeout is not None:
+            return blocking_pool_class(
+                max_connections=self._redis_max_connections or 50,
+                timeout=self._redis_pool_timeout,
+                **kwargs
+            )
+        return pool_class(max_connections=self._redis_max_connections, **kwargs)
+
+    def _get_addresses(self, nodes):
+        """
+        Returns (host, port) pairs from a list of "host:port" strings or pairs.
+        """
+        addresses = []
+        for node in nodes:
+            if isinstance(node, str):
+                host, port = node.rsplit(':', 1)
+                node = (host, int(port))
+            addresses.append(tuple(node))
+        return addresses
+
+    def _create_client(self, is_async=False):
+        """
+        Creates a client of a Redis Cluster if MEMNOTIFY_REDIS_CLUSTER_NODES is
+        set, of the master of a Sentinel service if MEMNOTIFY_REDIS_SENTINELS
+        is set or of a single Redis server otherwise.
+        """
+        kwargs = {
+            'password': self._redis_passwd,
+            'socket_timeout': self._redis_socket_timeout,
+            'socket_connect_timeout': self._redis_socket_connect_timeout,
+            'health_check_interval': self._redis_health_check_interval,
+        }
+        if self._redis_max_connections is not None:
+            kwargs['max_connections'] = self._redis_max_connections
+        if self._redis_cluster_nodes:
+            cluster_class, node_class = (asyncio_cluster.RedisCluster, asyncio_cluster.ClusterNode) if is_async else (RedisCluster, ClusterNode)
+            startup_nodes = [node_class(host, port) for host, port in self._get_addresses(self._redis_cluster_nodes)]
+            return cluster_class(startup_nodes=startup_nodes, **kwargs)
+        if self._redis_sentinels:
+            sentinel_class = asyncio_sentinel.Sentinel if is_async else Sentinel
+            sentinel = sentinel_class(
+                self._get_addresses(self._redis_sentinels),
+                sentinel_kwargs={
+                    'password': self._redis_sentinel_passwd,
+                    'socket_timeout': self._redis_socket_timeout,
+                    'socket_connect_timeout': self._redis_socket_connect_timeout,
+                },
             )
+            return sentinel.master_for(self._redis_sentinel_service, db=self._redis_db, **kwargs)
+        client_class = asyncio_redis.Redis if is_async else Redis
+        return client_class(connection_pool=self._get_connection_pool(is_async=is_async))
+
+    def _instrument(self, client):
+        """
+        Counts the commands sent by client for memnotify.instrumentation,
+        including every command of its pipelines.
+        """
+        client.execute_command = instrumentation.counting(client.execute_command, 'commands')
+        create_pipeline = client.pipeline
+
+        def pipeline(*args, **kwargs):
+            pipe = create_pipeline(*args, **kwargs)
+            pipe.execute = instrumentation.counting(pipe.execute, 'commands', pipe.__len__)
+            return pipe
+
+        client.pipeline = pipeline
+        return client
+
+    def _register_scripts(self, client, is_async=False):
+        scripts = dict((name, client.register_script(script)) for name, script in self.scripts.items())
+        if self._redis_cluster_nodes and not is_async:
+            # Scripts can not be loaded on demand inside cluster pipelines, so
+            # they are loaded on all primaries beforehand
+            for script in self.scripts.values():
+                client.script_load(script)
+        return scripts
+
+    def _get_async_client(self):
+        """
+        Returns the redis.asyncio client of the running event loop and its
+        scripts, creating them on first use.
+        """
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_clients:
+            client = self._instrument(self._create_client(is_async=True))
+            self._async_clients[loop] = (client, self._register_scripts(client, is_async=True))
+        return self._async_clients[loop]
+
+    def open(self):
+        """
+        Creates the Redis client. It is safe to call it from several threads,
+        only the first call creates the client.
+        """
+        if self.redis is not None:
+            return False
+        with self._lock:
+            if self.redis is not None:
+                return False
+            client = self._instrument(self._create_client())
+            self._scripts = self._register_scripts(client)
+            self.redis = client
             return True
-        return False
 
     def close(self):
-        pass # Persistent connection
+        pass # Persistent connections, returned to the pool after each command
+
+    async def aopen(self):
+        loop = asyncio.get_running_loop()
+        if loop in self._async_clients:
+            return False
+        self._get_async_client()
+        return True
+
+    async def aclose(self):
+        pass # Persistent connections, returned to the pool after each command
 
     def send(self, user, content, level, sender=None, expired_at=None, one_time=False):
-        key = self._get_key(user)
         msg = self._generate_msg(content, level, sender, expired_at, one_time=one_time)
-        self.redis.rpush(key, self._codify(msg))
+        self._push(self._get_key(user), self._codify(msg), msg)
+
+    def send_many(self, users, content, level, sender=None, expired_at=None, one_time=False):
+        self.send_batch([(users, content, level, sender, expired_at, one_time)])
+
+    def send_batch(self, messages):
+        pipe = self.redis.pipeline(transaction=False)
+        queued = 0
+        for users, content, level, sender, expired_at, one_time in messages:
+            msg = self._generate_msg(content, level, sender, expired_at, one_time=one_time)
+            raw_msg = self._codify(msg)
+            for user in users:
+                self._push(self._get_key(user), raw_msg, msg, client=pipe)
+                queued += 1
+                if queued % self._pipeline_size == 0:
+                    pipe.execute()
+        pipe.execute()
 
     def num_unread(self, user):
-        key = self._get_key(user)
-        return self.redis.llen(key)
+        return self._count(self._get_key(user))
 
-    def get_messages(self, user):
+    def get_messages(self, user, limit=None, cursor=None, min_level=None):
         key = self._get_key(user)
-        messages = []
-        for raw_msg in self.redis.lrange(key, 0, -1):
-            msg = self._decodify(raw_msg)
-            self._check_expiration(key, msg, raw_msg)
-            messages.append(msg)
-        return messages
+        if limit is None and cursor is None and min_level is None:
+            return MessageList(self._read_and_sweep(key))
+        return MessageList(*self._read_page(key, limit, cursor, min_level))
+
+    def num_unread_many(self, users):
+        users = list(users)
+        counts = self._count_many([self._get_key(user) for user in users])
+        return dict((user.pk, count) for user, count in zip(users, counts))
+
+    def get_messages_many(self, users, limit=None):
+        users = list(users)
+        results = self._read_many([self._get_key(user) for user in users], limit)
+        return dict((user.pk, messages) for user, messages in zip(users, results))
 
     def get_last_and_read(self, user):
+        return self._pop_last(self._get_key(user))
+
+    def get_and_read(self, user, n=None):
+        return self._pop_first(self._get_key(user), n)
+
+    def mark_all_as_read(self, user):
+        self.redis.delete(*self._get_all_keys(self._get_key(user)))
+
+    def global_send(self, content, level, sender=None, expired_at=None):
+        msg = self._generate_msg(content, level, sender, expired_at)
+        args = [self._codify(msg), self._get_expiry(expired_at), self._get_global_push_channel()]
+        self._scripts['global_send'](keys=self._get_global_keys(), args=args)
+
+    def global_num_unread(self, user=None):
+        return self._scripts['global_num_unread'](keys=self._get_global_keys(), args=self._get_global_args(user))
+
+    def global_get_messages(self, user=None):
+        raw_msgs = self._scripts['global_get_messages'](keys=self._get_global_keys(), args=self._get_global_read_args(user))
+        return [self._decodify(raw_msg) for raw_msg in raw_msgs]
+
+    def reap(self, batch_size=1000, rate_limit=None):
+        count, size = self._scripts['global_reap'](keys=self._get_global_keys(), args=[time.time()])
+        stats = {'keys': 0, 'messages': count, 'bytes': size}
+        start = time.time()
+        keys = []
+        for key in self.redis.scan_iter(match=self._get_reap_pattern(), count=batch_size):
+            keys.append(key.decode())
+            if len(keys) < batch_size:
+                continue
+            self._reap_keys(keys, stats)
+            stats['keys'] += len(keys)
+            keys = []
+            if rate_limit:
+                # Waits until the average rate is below rate_limit keys per second
+                time.sleep(max(0, start + stats['keys'] / float(rate_limit) - time.time()))
+        if keys:
+            self._reap_keys(keys, stats)
+            stats['keys'] += len(keys)
+        instrumentation.record('expired', stats['messages'])
+        return stats
+
+    def dump(self, batch_size=1000):
+        messages = self.global_get_messages()
+        if messages:
+            yield None, messages
+        keys = []
+        for key in self.redis.scan_iter(match=self._get_reap_pattern(), count=batch_size):
+            keys.append(key.decode())
+            if len(keys) >= batch_size:
+                yield from self._dump_keys(keys)
+                keys = []
+        if keys:
+            yield from self._dump_keys(keys)
+
+    def load(self, records, batch_size=1000):
+        pipe = self.redis.pipeline(transaction=False)
+        count = 0
+        for user_id, messages in records:
+            for msg in messages:
+                raw_msg = self._codify(msg)
+                # Loaded messages are not new, so they are not published
+                if user_id is None:
+                    args = [raw_msg, self._get_expiry(msg['expired_at']), '']
+                    self._scripts['global_send'](keys=self._get_global_keys(), args=args, client=pipe)
+                else:
+                    self._push(self._make_key(user_id), raw_msg, msg, client=pipe, publish=False)
+                count += 1
+                if count % batch_size == 0:
+                    pipe.execute()
+        pipe.execute()
+        return count
+
+    def subscribe_global_changes(self, callback, seen_callback=None):
+        """
+        Calls callback from a background thread whenever a global message is
+        sent by any process, and seen_callback, if given, with the id of the
+        user (as a string) whenever an user reads global messages through any
+        process. If the subscription is lost callback is called once more and
+        the thread stops.
+        """
+        def handle_error(exc, pubsub, thread):
+            thread.stop()
+            pubsub.close()
+            callback()
+
+        def handle_seen(message):
+            seen_callback(message['data'].decode())
+
+        channels = {self._get_global_channel(): lambda message: callback()}
+        if seen_callback is not None:
+            channels[self._get_seen_channel()] = handle_seen
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**channels)
+        return pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=handle_error)
+
+    def _get_subscriptions(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._subscriptions:
+            if self._redis_cluster_nodes:
+                # Messages published in a cluster are received by every node
+                host, port = self._get_addresses(self._redis_cluster_nodes)[0]
+                client = asyncio_redis.Redis(
+                    host=host,
+                    port=port,
+                    password=self._redis_passwd,
+                    socket_connect_timeout=self._redis_socket_connect_timeout,
+                )
+            else:
+                client, scripts = self._get_async_client()
+            self._subscriptions[loop] = _Subscriptions(client.pubsub())
+        return self._subscriptions[loop]
+
+    async def alisten(self, user, timeout=None):
+        """
+        Yields ('message', msg) for every message sent to user and ('global',
+        msg) for every global message, as they are sent. If timeout is given,
+        yields None after waiting timeout seconds without messages.
+
+        All listeners of an event loop share a single Redis connection.
+        """
+        subscriptions = self._get_subscriptions()
+        channel = self._get_channel(self._get_key(user)).encode()
+        global_channel = self._get_global_channel().encode()
+        queue = asyncio.Queue(maxsize=100)
+        await subscriptions.add([channel, global_channel], queue)
+        try:
+            while True:
+                try:
+                    msg_channel, raw_msg = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield ('global' if msg_channel == global_channel else 'message'), self._decodify(raw_msg)
+        finally:
+            await subscriptions.remove([channel, global_channel], queue)
+
+    def _migrate_legacy_keys(self, keys):
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.lrange(key, 0, -1)
+        lists = pipe.execute(raise_on_error=False)
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        count = 0
+        for key, raw_msgs in zip(keys, lists):
+            if isinstance(raw_msgs, Exception):
+                continue # Not a list of messages
+            for raw_msg in raw_msgs:
+                msg = _LEGACY_SERIALIZER.loads(raw_msg)
+                if not self._is_expired(msg, now):
+                    self._push(self._make_key(key), self._codify(msg), msg, client=pipe, publish=False)
+            # Messages pushed meanwhile by processes not upgraded yet are kept
+            pipe.ltrim(key, len(raw_msgs), -1)
+            count += len(raw_msgs)
+        pipe.execute()
+        return count
+
+    def migrate_legacy_keys(self, users=None, batch_size=1000):
+        """
+        Moves the messages stored by previous versions in lists named after
+        the user ids, without prefix, to the keys used by this backend. The
+        keys of users are migrated if given, otherwise all keys made of digits
+        are, so users must be given if their ids are not numbers. Global
+        messages are moved by migrate_global_list().
+
+        Returns the number of migrated messages.
+        """
+        if users is None:
+            keys = (key.decode() for key in self.redis.scan_iter(match='[0-9]*', count=batch_size))
+            keys = (key for key in keys if key.isdigit())
+        else:
+            keys = (str(user.id) for user in users)
+        count = 0
+        batch = []
+        for key in keys:
+            batch.append(key)
+            if len(batch) >= batch_size:
+                count += self._migrate_legacy_keys(batch)
+                batch = []
+        if batch:
+            count += self._migrate_legacy_keys(batch)
+        return count
+
+    def migrate_global_list(self):
+        """
+        Moves the global messages stored in a list by previous versions to the
+        shared global store.
+
+        Returns the number of migrated messages.
+        """
+        raw_msgs = self.redis.lrange(self._global_key, 0, -1)
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        for raw_msg in raw_msgs:
+            msg = _LEGACY_SERIALIZER.loads(raw_msg)
+            if not self._is_expired(msg, now):
+                # Migrated messages are not new, so they are not published
+                args = [self._codify(msg), self._get_expiry(msg['expired_at']), '']
+                self._scripts['global_send'](keys=self._get_global_keys(), args=args, client=pipe)
+        pipe.ltrim(self._global_key, len(raw_msgs), -1)
+        pipe.delete(self._get_meta_key(self._global_key))
+        pipe.execute()
+        return len(raw_msgs)
+
+    async def asend(self, user, content, level, sender=None, expired_at=None, one_time=False):
+        msg = self._generate_msg(content, level, sender, expired_at, one_time=one_time)
+        await self._apush(self._get_key(user), self._codify(msg), msg)
+
+    async def asend_many(self, users, content, level, sender=None, expired_at=None, one_time=False):
+        msg = self._generate_msg(content, level, sender, expired_at, one_time=one_time)
+        raw_msg = self._codify(msg)
+        client, scripts = self._get_async_client()
+        if self._redis_cluster_nodes:
+            # The cluster client sends concurrent commands through one
+            # connection per node
+            calls = []
+            for i, user in enumerate(users, 1):
+                calls.append(self._apush(self._get_key(user), raw_msg, msg))
+                if i % self._pipeline_size == 0:
+                    await asyncio.gather(*calls)
+                    calls = []
+            await asyncio.gather(*calls)
+            return
+        pipe = client.pipeline(transaction=False)
+        for i, user in enumerate(users, 1):
+            await self._apush(self._get_key(user), raw_msg, msg, client=pipe)
+            if i % self._pipeline_size == 0:
+                await pipe.execute()
+        await pipe.execute()
+
+    async def anum_unread(self, user):
+        return await self._acount(self._get_key(user))
+
+    async def aget_messages(self, user, limit=None, cursor=None, min_level=None):
         key = self._get_key(user)
-        raw_msg = self.redis.rpop(key)
+        if limit is None and cursor is None and min_level is None:
+            return MessageList(await self._aread_and_sweep(key))
+        return MessageList(*await self._aread_page(key, limit, cursor, min_level))
+
+    async def anum_unread_many(self, users):
+        users = list(users)
+        counts = await self._acount_many([self._get_key(user) for user in users])
+        return dict((user.pk, count) for user, count in zip(users, counts))
+
+    async def aget_messages_many(self, users, limit=None):
+        users = list(users)
+        results = await self._aread_many([self._get_key(user) for user in users], limit)
+        return dict((user.pk, messages) for user, messages in zip(users, results))
+
+    async def aget_last_and_read(self, user):
+        return await self._apop_last(self._get_key(user))
+
+    async def aget_and_read(self, user, n=None):
+        return await self._apop_first(self._get_key(user), n)
+
+    async def amark_all_as_read(self, user):
+        client, scripts = self._get_async_client()
+        await client.delete(*self._get_all_keys(self._get_key(user)))
+
+    async def aglobal_send(self, content, level, sender=None, expired_at=None):
+        msg = self._generate_msg(content, level, sender, expired_at)
+        args = [self._codify(msg), self._get_expiry(expired_at), self._get_global_push_channel()]
+        client, scripts = self._get_async_client()
+        await scripts['global_send'](keys=self._get_global_keys(), args=args)
+
+    async def aglobal_num_unread(self, user=None):
+        client, scripts = self._get_async_client()
+        return await scripts['global_num_unread'](keys=self._get_global_keys(), args=self._get_global_args(user))
+
+    async def aglobal_get_messages(self, user=None):
+        client, scripts = self._get_async_client()
+        raw_msgs = await scripts['global_get_messages'](keys=self._get_global_keys(), args=self._get_global_read_args(user))
+        return [self._decodify(raw_msg) for raw_msg in raw_msgs]
+
+
+class RedisSortedSetBackend(RedisBackend):
+    """
+    Redis backend that stores the messages of each user in a sorted set of
+    message ids scored by expiration time plus a hash of payloads. Another
+    sorted set keeps the ids in order, so pages are read with ZRANGEBYSCORE
+    without sorting all the messages.
+
+    Expired messages are dropped server side with ZREMRANGEBYSCORE, without
+    fetching or deserializing them. Messages stored by RedisBackend can be
+    moved to this layout with migrate_list().
+    """
+    scripts = dict(
+        _GLOBAL_SCRIPTS,
+        send=_ZSET_SEND_SCRIPT,
+        num_unread=_ZSET_NUM_UNREAD_SCRIPT,
+        get_messages=_ZSET_GET_MESSAGES_SCRIPT,
+        get_last=_ZSET_GET_LAST_SCRIPT,
+        get_page=_ZSET_GET_PAGE_SCRIPT,
+        get_and_read=_ZSET_GET_AND_READ_SCRIPT,
+        reap=_ZSET_REAP_SCRIPT,
+        delete=_ZSET_DELETE_SCRIPT,
+    )
+
+    def _get_subkeys(self, key):
+        return ['%s:%s' % (key, name) for name in ('index', 'payloads', 'once', 'seq', 'meta', 'order')]
+
+    def _get_all_keys(self, key):
+        subkeys = self._get_subkeys(key)
+        return subkeys[:3] + subkeys[4:]
+
+    def _get_score(self, expired_at):
+        return self._get_expiry(expired_at) or '+inf'
+
+    def _get_push_call(self, key, raw_msg, msg, publish=True):
+        args = [
+            self._get_score(msg['expired_at']),
+            raw_msg,
+            int('one_time' in msg),
+            self._get_deadline(msg['expired_at']),
+            self._get_max_messages(),
+            self._get_push_channel(key) if publish else '',
+        ]
+        return 'send', self._get_subkeys(key), args
+
+    def _parse_messages(self, raw_msgs):
+        pairs = sorted(zip(raw_msgs[::2], raw_msgs[1::2]), key=lambda pair: int(pair[0]))
+        return [self._decodify(raw_msg) for msg_id, raw_msg in pairs]
+
+    def _read_and_sweep(self, key, consume=True):
+        args = [time.time(), int(consume)]
+        return self._parse_messages(self._scripts['get_messages'](keys=self._get_subkeys(key), args=args))
+
+    async def _aread_and_sweep(self, key, consume=True):
+        client, scripts = self._get_async_client()
+        args = [time.time(), int(consume)]
+        return self._parse_messages(await scripts['get_messages'](keys=self._get_subkeys(key), args=args))
+
+    def _read_page(self, key, limit, cursor, min_level, consume=True):
+        """
+        Same as RedisBackend._read_page() but the cursor is the id of the last
+        message read, so it is not affected by messages removed in between.
+        """
+        last_id = int(cursor or 0)
+        count = limit or 0
+        messages = []
+        while True:
+            page = self._scripts['get_page'](keys=self._get_subkeys(key), args=[time.time(), last_id, count])
+            entries = list(zip(page[::2], page[1::2]))
+            removed, processed = self._filter_page(entries, limit, min_level, consume, messages)
+            if removed:
+                self._scripts['delete'](keys=self._get_subkeys(key), args=removed)
+            if processed:
+                last_id = int(entries[processed - 1][0])
+            if processed == len(entries) and (limit is None or len(entries) < count):
+                return messages, None
+            if len(messages) >= limit:
+                return messages, last_id
+
+    async def _aread_page(self, key, limit, cursor, min_level, consume=True):
+        client, scripts = self._get_async_client()
+        last_id = int(cursor or 0)
+        count = limit or 0
+        messages = []
+        while True:
+            page = await scripts['get_page'](keys=self._get_subkeys(key), args=[time.time(), last_id, count])
+            entries = list(zip(page[::2], page[1::2]))
+            removed, processed = self._filter_page(entries, limit, min_level, consume, messages)
+            if removed:
+                await scripts['delete'](keys=self._get_subkeys(key), args=removed)
+            if processed:
+                last_id = int(entries[processed - 1][0])
+            if processed == len(entries) and (limit is None or len(entries) < count):
+                return messages, None
+            if len(messages) >= limit:
+                return messages, last_id
+
+    def _count(self, key):
+        return self._scripts['num_unread'](keys=self._get_subkeys(key), args=[time.time()])
+
+    async def _acount(self, key):
+        client, scripts = self._get_async_client()
+        return await scripts['num_unread'](keys=self._get_subkeys(key), args=[time.time()])
+
+    def _get_read_calls(self, keys, limit, consume):
+        now = time.time()
+        if limit is None:
+            return [('get_messages', self._get_subkeys(key), [now, int(consume)]) for key in keys]
+        return [('get_page', self._get_subkeys(key), [now, 0, limit]) for key in keys]
+
+    def _parse_many(self, keys, replies, limit, consume):
+        """
+        Decodes the replies of the calls of _get_read_calls(). Returns a
+        MessageList for each key and the script calls that delete the one
+        time messages read.
+        """
+        if limit is None:
+            return [MessageList(self._parse_messages(reply)) for reply in replies], []
+        results = []
+        calls = []
+        for key, page in zip(keys, replies):
+            entries = list(zip(page[::2], page[1::2]))
+            messages = []
+            removed, processed = self._filter_page(entries, limit, None, consume, messages)
+            if removed:
+                calls.append(('delete', self._get_subkeys(key), removed))
+            cursor = int(entries[processed - 1][0]) if processed and len(entries) == limit else None
+            results.append(MessageList(messages, cursor))
+        return results, calls
+
+    def _read_many(self, keys, limit=None, consume=True):
+        replies = self._run_scripts(self._get_read_calls(keys, limit, consume))
+        results, calls = self._parse_many(keys, replies, limit, consume)
+        if calls:
+            self._run_scripts(calls)
+        return results
+
+    async def _aread_many(self, keys, limit=None, consume=True):
+        replies = await self._arun_scripts(self._get_read_calls(keys, limit, consume))
+        results, calls = self._parse_many(keys, replies, limit, consume)
+        if calls:
+            await self._arun_scripts(calls)
+        return results
+
+    def _count_many(self, keys):
+        now = time.time()
+        return self._run_scripts([('num_unread', self._get_subkeys(key), [now]) for key in keys])
+
+    async def _acount_many(self, keys):
+        now = time.time()
+        return await self._arun_scripts([('num_unread', self._get_subkeys(key), [now]) for key in keys])
+
+    def _pop_last(self, key):
+        raw_msg = self._scripts['get_last'](keys=self._get_subkeys(key), args=[time.time()])
         if raw_msg is not None:
             return self._decodify(raw_msg)
         else:
             return None
 
-    def mark_all_as_read(self, user):
-        key = self._get_key(user)
-        self.redis.delete(key)
+    async def _apop_last(self, key):
+        client, scripts = self._get_async_client()
+        raw_msg = await scripts['get_last'](keys=self._get_subkeys(key), args=[time.time()])
+        if raw_msg is not None:
+            return self._decodify(raw_msg)
+        else:
+            return None
 
-    def global_send(self, content, level, sender=None, expired_at=None):
-        msg = self._generate_msg(content, level, sender, expired_at)
-        self.redis.rpush(self._global_key, self._codify(msg))
+    def _pop_first(self, key, n):
+        if n == 0:
+            return []
+        args = [time.time(), n or 0]
+        raw_msgs = self._scripts['get_and_read'](keys=self._get_subkeys(key), args=args)
+        return [self._decodify(raw_msg) for raw_msg in raw_msgs]
 
-    def global_num_unread(self):
-        return self.redis.llen(self._global_key)
+    async def _apop_first(self, key, n):
+        if n == 0:
+            return []
+        client, scripts = self._get_async_client()
+        raw_msgs = await scripts['get_and_read'](keys=self._get_subkeys(key), args=[time.time(), n or 0])
+        return [self._decodify(raw_msg) for raw_msg in raw_msgs]
 
-    def global_get_messages(self):
-        messages = []
-        for raw_msg in self.redis.lrange(self._global_key, 0, -1):
+    def _get_reap_pattern(self):
+        return '%s:{*}:index' % self._key_prefix
+
+    def _reap_keys(self, keys, stats):
+        pipe = self.redis.pipeline(transaction=False)
+        now = time.time()
+        for index_key in keys:
+            self._scripts['reap'](keys=self._get_subkeys(index_key[:-len(':index')]), args=[now], client=pipe)
+        for removed, size in pipe.execute():
+            stats['messages'] += removed
+            stats['bytes'] += size
+
+    def _dump_keys(self, keys):
+        pipe = self.redis.pipeline(transaction=False)
+        for index_key in keys:
+            pipe.hgetall(self._get_subkeys(index_key[:-len(':index')])[1])
+        now = time.time()
+        for index_key, payloads in zip(keys, pipe.execute()):
+            raw_msgs = [payloads[msg_id] for msg_id in sorted(payloads, key=int)]
+            messages = [msg for msg in map(self._decodify, raw_msgs) if not self._is_expired(msg, now)]
+            if messages:
+                yield self._get_user_id(index_key[:-len(':index')]), messages
+
+    def migrate_list(self, user):
+        """
+        Moves the messages stored by RedisBackend in the list of an user to the
+        sorted set layout.
+
+        Returns the number of migrated messages.
+        """
+        key = self._get_key(user)
+        raw_msgs = self.redis.lrange(key, 0, -1)
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        for raw_msg in raw_msgs:
             msg = self._decodify(raw_msg)
-            self._check_expiration(self._global_key, msg, raw_msg)
-            messages.append(msg)
-        return messages
+            if not self._is_expired(msg, now):
+                self._push(key, raw_msg, msg, client=pipe, publish=False)
+        pipe.ltrim(key, len(raw_msgs), -1)
+        # The metadata hash is shared with this layout, only the deadline is kept
+        pipe.hdel(self._get_meta_key(key), 'next_expiry')
+        pipe.delete(*RedisBackend._get_all_keys(self, key)[2:])
+        pipe.execute()
+        return len(raw_msgs)
@@ -0,0 +1,322 @@
+"""Backend for memnotify that keeps the messages in a memory mapped file shared by the processes of a host."""
+
+from contextlib import contextmanager
+
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from memnotify import instrumentation
+from memnotify.backends.base import BaseMemnotifyBackend, MessageList
+
+
+_DEFAULT_SERIALIZER = 'memnotify.serializers.PickleSerializer'
+
+_MAGIC = b'MEMNOTI1'
+
+# magic, users, user slots, global slots, slot size, last message id, last global message id
+_HEADER = struct.Struct('<8sIIIIqq')
+# user id (0 if the bucket is free), last global message id read
+_USER = struct.Struct('<qq')
+# message id (0 if the slot is free), expiration timestamp (0 if never), level, one time flag, payload size
+_SLOT = struct.Struct('<qdiBI')
+_SLOT_ID = struct.Struct('<q')
+
+# Number of buckets where the messages of an user can be stored
+_PROBES = 8
+
+
+class SharedMemoryBackend(BaseMemnotifyBackend):
+    """
+    Stores the messages in a memory mapped file, so every process of the host
+    that uses the same file (MEMNOTIFY_SHM_PATH) sees the same messages without
+    a network round trip. Writes are serialized with a lock on the file.
+
+    The file has a fixed size: a bucket for each of MEMNOTIFY_SHM_USERS users,
+    with MEMNOTIFY_SHM_USER_SLOTS message slots each, and MEMNOTIFY_SHM_GLOBAL_SLOTS
+    slots for global messages. Every slot holds a serialized message of up to
+    MEMNOTIFY_SHM_SLOT_SIZE bytes. When the slots of an user are full, new
+    messages replace the oldest ones; when there is no free bucket for an user,
+    the bucket of the least recently notified user is reused (losing its
+    messages and its read marker of global messages). Read markers of global
+    messages are only stored in free buckets, they never evict another user.
+
+    User primary keys must be integers.
+    """
+    def __init__(self, *args, **kwargs):
+        if 'path' in kwargs:
+            self._path = kwargs.pop('path')
+        else:
+            self._path = getattr(settings, 'MEMNOTIFY_SHM_PATH', None) or os.path.join(tempfile.gettempdir(), 'memnotify.shm')
+        if 'users' in kwargs:
+            self._users = kwargs.pop('users')
+        else:
+            self._users = getattr(settings, 'MEMNOTIFY_SHM_USERS', 4096)
+        if 'user_slots' in kwargs:
+            self._user_slots = kwargs.pop('user_slots')
+        else:
+            self._user_slots = getattr(settings, 'MEMNOTIFY_SHM_USER_SLOTS', None) or \
+                getattr(settings, 'MEMNOTIFY_MAX_MESSAGES_PER_USER', None) or 16
+        if 'global_slots' in kwargs:
+            self._global_slots = kwargs.pop('global_slots')
+        else:
+            self._global_slots = getattr(settings, 'MEMNOTIFY_SHM_GLOBAL_SLOTS', 64)
+        if 'slot_size' in kwargs:
+            self._slot_size = kwargs.pop('slot_size')
+        else:
+            self._slot_size = getattr(settings, 'MEMNOTIFY_SHM_SLOT_SIZE', 1024)
+        if 'serializer' in kwargs:
+            serializer = kwargs.pop('serializer')
+        else:
+            serializer = getattr(settings, 'MEMNOTIFY_SERIALIZER', None) or _DEFAULT_SERIALIZER
+        self._serializer = import_string(serializer)()
+        super(SharedMemoryBackend, self).__init__(*args, **kwargs)
+        self._slot_len = _SLOT.size + self._slot_size
+        self._bucket_len = _USER.size + self._user_slots * self._slot_len
+        self._global_offset = _HEADER.size + self._users * self._bucket_len
+        self._size = self._global_offset + self._global_slots * self._slot_len
+        self._lock = threading.Lock()
+        self._fd = None
+        self._map = None
+        self._pid = None
+
+    def _encode(self, decod_msg):
+        cod_msg = self._serializer.dumps(decod_msg)
+        instrumentation.record('bytes_serialized', len(cod_msg))
+        return cod_msg
+
+    def _decode(self, cod_msg):
+        instrumentation.record('bytes_deserialized', len(cod_msg))
+        return self._serializer.loads(cod_msg)
+
+    def _get_key(self, user):
+        return int(user.pk)
+
+    def _generate_raw_msg(self, content, level, sender, expired_at, one_time=False):
+        msg = self._generate_msg(content, level, sender, expired_at, one_time)
+        raw = self._encode(msg)
+        if len(raw) > self._slot_size:
+            raise ValueError('message of %d bytes does not fit in a slot of %d bytes' % (len(raw), self._slot_size))
+        return msg, raw
+
+    def _map_file(self):
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                layout = (self._users, self._user_slots, self._global_slots, self._slot_size)
+                if os.fstat(fd).st_size < _HEADER.size:
+                    os.ftruncate(fd, self._size)
+                    os.pwrite(fd, _HEADER.pack(_MAGIC, *(layout + (0, 0))), 0)
+                header = _HEADER.unpack(os.pread(fd, _HEADER.size, 0))
+                if header[0] != _MAGIC or header[1:5] != layout:
+                    raise ImproperlyConfigured('%s was created with another layout, remove it to change the layout' % self._path)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            return fd, mmap.mmap(fd, self._size)
+        except Exception:
+            os.close(fd)
+            raise
+
+    def open(self):
+        """
+        Maps the file, creating it if it does not exist. It is safe to call it
+        from several threads, only the first call of each process maps it.
+        """
+        if self._pid == os.getpid():
+            return False
+        with self._lock:
+            if self._pid == os.getpid():
+                return False
+            # A file lock inherited from the parent process does not exclude it
+            self._fd, self._map = self._map_file()
+            self._pid = os.getpid()
+            return True
+
+    def close(self):
+        pass # The file stays mapped until the process exits
+
+    @contextmanager
+    def _locked(self):
+        self.open()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield self._map
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _next_id(self, buf, global_msg=False):
+        fields = list(_HEADER.unpack_from(buf, 0))
+        fields[5] += 1
+        if global_msg:
+            fields[6] = fields[5]
+        _HEADER.pack_into(buf, 0, *fields)
+        return fields[5]
+
+    def _read_slots(self, buf, offset, count, now):
+        """
+        Returns (id, offset, level, one_time, size) of the messages stored in
+        count slots from offset, sorted by id. Expired messages are removed.
+        """
+        slots = []
+        for i in range(count):
+            slot_offset = offset + i * self._slot_len
+            msg_id, expires, level, one_time, size = _SLOT.unpack_from(buf, slot_offset)
+            if not msg_id:
+                continue
+            if expires and expires <= now:
+                _SLOT_ID.pack_into(buf, slot_offset, 0)
+                instrumentation.record('expired')
+                continue
+            slots.append((msg_id, slot_offset, level, one_time, size))
+        slots.sort()
+        return slots
+
+    def _load(self, buf, slot):
+        start = slot[1] + _SLOT.size
+        return self._decode(buf[start:start + slot[4]])
+
+    def _write(self, buf, offset, count, msg_id, msg, raw):
+        """
+        Stores a message in a free slot, or in the slot of the oldest message.
+        """
+        slots = []
+        for i in range(count):
+            slot_offset = offset + i * self._slot_len
+            slots.append((_SLOT_ID.unpack_from(buf, slot_offset)[0], slot_offset))
+        slot_offset = min(slots)[1]
+        expires = msg['expired_at'].timestamp() if msg['expired_at'] is not None else 0
+        _SLOT.pack_into(buf, slot_offset, msg_id, expires, msg['level'], 'one_time' in msg, len(raw))
+        buf[slot_offset + _SLOT.size:slot_offset + _SLOT.size + len(raw)] = raw
+
+    def _get_buckets(self, key):
+        first = hash(key) % self._users
+        return [_HEADER.size + (first + i) % self._users * self._bucket_len for i in range(min(_PROBES, self._users))]
+
+    def _find_bucket(self, buf, key, create=False, evict=True):
+        """
+        Returns the offset of the bucket of an user, or None if it does not
+        exist and create is false. When evict is false, only a free bucket is
+        used to create it.
+        """
+        buckets = self._get_buckets(key)
+        for offset in buckets:
+            if _USER.unpack_from(buf, offset)[0] == key:
+                return offset
+        if not create:
+            return None
+        now = time.time()
+        candidates = []
+        for offset in buckets:
+            user_id = _USER.unpack_from(buf, offset)[0]
+            if user_id and not evict:
+                continue
+            slots = self._read_slots(buf, offset + _USER.size, self._user_slots, now) if user_id else []
+            candidates.append((bool(user_id), bool(slots), slots[-1][0] if slots else 0, offset))
+        if not candidates:
+            return None
+        offset = min(candidates)[3]
+        _USER.pack_into(buf, offset, key, 0)
+        for i in range(self._user_slots):
+            _SLOT_ID.pack_into(buf, offset + _USER.size + i * self._slot_len, 0)
+        return offset
+
+    def _get_user_slots(self, buf, user):
+        offset = self._find_bucket(buf, self._get_key(user))
+        if offset is None:
+            return []
+        return self._read_slots(buf, offset + _USER.size, self._user_slots, time.time())
+
+    def _get_global_seen(self, buf, user):
+        if user is None:
+            return 0
+        offset = self._find_bucket(buf, self._get_key(user))
+        return 0 if offset is None else _USER.unpack_from(buf, offset)[1]
+
+    def send(self, user, content, level, sender=None, expired_at=None, one_time=False):
+        msg, raw = self._generate_raw_msg(content, level, sender, expired_at, one_time=one_time)
+        with self._locked() as buf:
+            offset = self._find_bucket(buf, self._get_key(user), create=True)
+            self._write(buf, offset + _USER.size, self._user_slots, self._next_id(buf), msg, raw)
+
+    def send_many(self, users, content, level, sender=None, expired_at=None, one_time=False):
+        msg, raw = self._generate_raw_msg(content, level, sender, expired_at, one_time=one_time)
+        with self._locked() as buf:
+            for user in users:
+                offset = self._find_bucket(buf, self._get_key(user), create=True)
+                self._write(buf, offset + _USER.size, self._user_slots, self._next_id(buf), msg, raw)
+
+    def num_unread(self, user):
+        with self._locked() as buf:
+            return len(self._get_user_slots(buf, user))
+
+    def get_messages(self, user, limit=None, cursor=None, min_level=None):
+        last_id = int(cursor or 0)
+        messages = []
+        next_cursor = None
+        with self._locked() as buf:
+            for slot in self._get_user_slots(buf, user):
+                msg_id, offset, level, one_time = slot[:4]
+                if msg_id <= last_id:
+                    continue
+                if limit is not None and len(messages) >= limit:
+                    next_cursor = last_id
+                    break
+                last_id = msg_id
+                if min_level is None or level >= min_level:
+                    messages.append(self._load(buf, slot))
+                    if one_time:
+                        _SLOT_ID.pack_into(buf, offset, 0)
+        return MessageList(messages, next_cursor)
+
+    def get_last_and_read(self, user):
+        with self._locked() as buf:
+            slots = self._get_user_slots(buf, user)
+            if not slots:
+                return None
+            _SLOT_ID.pack_into(buf, slots[-1][1], 0)
+            return self._load(buf, slots[-1])
+
+    def get_and_read(self, user, n=None):
+        with self._locked() as buf:
+            slots = self._get_user_slots(buf, user)[:n]
+            for slot in slots:
+                _SLOT_ID.pack_into(buf, slot[1], 0)
+            return [self._load(buf, slot) for slot in slots]
+
+    def mark_all_as_read(self, user):
+        with self._locked() as buf:
+            for slot in self._get_user_slots(buf, user):
+                _SLOT_ID.pack_into(buf, slot[1], 0)
+
+    def global_send(self, content, level, sender=None, expired_at=None):
+        msg, raw = self._generate_raw_msg(content, level, sender, expired_at)
+        with self._locked() as buf:
+            self._write(buf, self._global_offset, self._global_slots, self._next_id(buf, global_msg=True), msg, raw)
+
+    def global_num_unread(self, user=None):
+        with self._locked() as buf:
+            seen = self._get_global_seen(buf, user)
+            slots = self._read_slots(buf, self._global_offset, self._global_slots, time.time())
+            return len([slot for slot in slots if slot[0] > seen])
+
+    def global_get_messages(self, user=None):
+        with self._locked() as buf:
+            seen = self._get_global_seen(buf, user)
+            slots = self._read_slots(buf, self._global_offset, self._global_slots, time.time())
+            messages = [self._load(buf, slot) for slot in slots if slot[0] > seen]
+            if user is not None:
+                # Storing a read marker must not evict the messages of other users
+                offset = self._find_bucket(buf, self._get_key(user), create=True, evict=False)
+                if offset is not None:
+                    _USER.pack_into(buf, offset, self._get_key(user), _HEADER.unpack_from(buf, 0)[6])
+            return messages
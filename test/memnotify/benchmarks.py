@@ -0,0 +1,330 @@
+"""
+Benchmarks for memnotify.
+
+Run them from the test project directory:
+
+    DJANGO_SETTINGS_MODULE=webtest.settings python -m memnotify.benchmarks
+
+The backend operations are measured with the memnotify_benchmark command:
+
+    python manage.py memnotify_benchmark --json
+
+Both run against an isolated instance of the configured backend (see
+get_isolated_backend()), so they never touch the messages of the site.
+"""
+import datetime
+import os
+import tempfile
+import threading
+import time
+import timeit
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from redis.exceptions import RedisError
+
+from memnotify.backends import cached, dummy, locmem, redis_backend, shared_memory
+
+
+OPERATIONS = ['get_messages', 'num_unread', 'global_get_messages', 'send']
+
+# Prefix of the Redis keys and shared memory files used by the benchmarks
+KEY_PREFIX = 'memnotify-benchmark'
+
+SERIALIZERS = [
+    'memnotify.serializers.PickleSerializer',
+    'memnotify.serializers.JSONSerializer',
+    'memnotify.serializers.MsgpackSerializer',
+]
+
+
+def _sample_messages(count, content_size):
+    user_model = get_user_model()
+    now = datetime.datetime.now()
+    messages = []
+    for i in range(count):
+        messages.append({
+            'content': ('Message %d ' % i).ljust(content_size, 'x'),
+            'level': 20,
+            'created_at': now,
+            'sender': user_model(pk=i + 1, username='user%d' % i),
+            'expired_at': now + datetime.timedelta(days=1),
+        })
+    return messages
+
+
+def bench_serializers(serializers=SERIALIZERS, count=1000, content_size=100, repeat=5):
+    """
+    Measures the payload size and decode throughput of each serializer.
+
+    Serializers whose dependencies are not installed are skipped.
+    """
+    messages = _sample_messages(count, content_size)
+    results = []
+    for path in serializers:
+        try:
+            serializer = import_string(path)()
+        except ImproperlyConfigured:
+            continue
+        raw_msgs = [serializer.dumps(msg) for msg in messages]
+        encode = min(timeit.repeat(lambda: [serializer.dumps(msg) for msg in messages], number=1, repeat=repeat))
+        decode = min(timeit.repeat(lambda: [serializer.loads(raw) for raw in raw_msgs], number=1, repeat=repeat))
+        results.append({
+            'serializer': path,
+            'bytes_per_msg': sum(len(raw) for raw in raw_msgs) / float(count),
+            'encode_per_sec': count / encode,
+            'decode_per_sec': count / decode,
+        })
+    return results
+
+
+def bench_send_many(notifier, count=5000):
+    """
+    Compares the throughput of send_many against calling send for each user.
+    """
+    user_model = get_user_model()
+    users = [user_model(pk=1000000000 + i, username='bench%d' % i) for i in range(count)]
+    results = []
+    with notifier:
+        start = time.time()
+        for user in users:
+            notifier.send(user, 'Benchmark', 20)
+        results.append({'method': 'send', 'msgs_per_sec': count / (time.time() - start)})
+
+        start = time.time()
+        notifier.send_many(users, 'Benchmark', 20)
+        results.append({'method': 'send_many', 'msgs_per_sec': count / (time.time() - start)})
+
+        for user in users:
+            notifier.mark_all_as_read(user)
+    return results
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def _get_redis(notifier):
+    backend = getattr(notifier, 'backend', notifier) # Unwraps CachedBackend
+    return backend, getattr(backend, 'redis', None)
+
+
+class _RoundTripCounter(object):
+    """
+    Counts the connections taken from the pool of a Redis backend, one for
+    each command or pipeline sent. Other backends (and Redis Cluster clients)
+    are not counted.
+    """
+    def __init__(self, notifier):
+        backend, client = _get_redis(notifier)
+        self.pool = getattr(client, 'connection_pool', None)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _wrap(self, get_connection):
+        def counted(*args, **kwargs):
+            with self._lock:
+                self.count += 1
+            return get_connection(*args, **kwargs)
+        return counted
+
+    def __enter__(self):
+        if self.pool is not None:
+            self._get_connection = self.pool.get_connection
+            self.pool.get_connection = self._wrap(self._get_connection)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.pool is not None:
+            self.pool.get_connection = self._get_connection
+
+    def per_call(self, calls):
+        return None if self.pool is None else self.count / float(calls)
+
+
+def _stored_bytes(notifier, user):
+    """
+    Returns the memory used by the keys of an user as reported by Redis, or
+    None if it can not be measured.
+    """
+    backend, client = _get_redis(notifier)
+    if client is None:
+        return None
+    try:
+        return sum(client.memory_usage(key) or 0 for key in backend._get_all_keys(backend._get_key(user)))
+    except RedisError:
+        return None
+
+
+def _run_operation(notifier, operation, users, content, iterations):
+    expired_at = datetime.datetime.now() + datetime.timedelta(minutes=10)
+    calls = {
+        'send': lambda user: notifier.send(user, content, 20, expired_at=expired_at),
+        'get_messages': lambda user: notifier.get_messages(user),
+        'num_unread': lambda user: notifier.num_unread(user),
+        'global_get_messages': lambda user: notifier.global_get_messages(),
+    }
+    call = calls[operation]
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(user):
+        times = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            call(user)
+            times.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(times)
+
+    with _RoundTripCounter(notifier) as counter:
+        threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    return {
+        'ops_per_sec': len(latencies) / elapsed,
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p99_ms': _percentile(latencies, 99) * 1000,
+        'round_trips': counter.per_call(len(latencies)),
+    }
+
+
+def get_isolated_backend(path, key_prefix=KEY_PREFIX):
+    """
+    Returns an instance of the backend path that does not share its messages
+    with the one the site uses, or None if the backend can not be isolated.
+
+    Redis backends (wrapped by CachedBackend or not) store their keys under
+    key_prefix and publish nothing, SharedMemoryBackend maps a temporary file
+    and LocMemBackend is local to the process anyway. Call remove_data() when
+    done.
+    """
+    backend_class = wrapped_class = import_string(path)
+    kwargs = {}
+    if issubclass(backend_class, cached.CachedBackend):
+        wrapped_class = import_string(getattr(settings, 'MEMNOTIFY_CACHED_BACKEND', cached._DEFAULT_BACKEND))
+        kwargs['subscribe'] = False
+    if issubclass(wrapped_class, redis_backend.RedisBackend):
+        return backend_class(key_prefix=key_prefix, publish=False, **kwargs)
+    if issubclass(wrapped_class, shared_memory.SharedMemoryBackend):
+        fd, shm_path = tempfile.mkstemp(prefix=key_prefix, suffix='.shm')
+        os.close(fd)
+        return backend_class(path=shm_path, **kwargs)
+    if issubclass(wrapped_class, (locmem.LocMemBackend, dummy.DummyBackend)):
+        return backend_class(**kwargs)
+    return None
+
+
+def remove_data(notifier, batch_size=1000):
+    """
+    Removes the data of a backend returned by get_isolated_backend(), such as
+    the global messages sent by bench_operations(): every key under the prefix
+    of a Redis backend, or the file of a SharedMemoryBackend. Other backends
+    are left as they are.
+    """
+    backend = getattr(notifier, 'backend', notifier) # Unwraps CachedBackend
+    if isinstance(backend, shared_memory.SharedMemoryBackend):
+        if backend._map is not None:
+            backend._map.close()
+            os.close(backend._fd)
+            backend._fd = backend._map = backend._pid = None
+        if os.path.exists(backend._path):
+            os.remove(backend._path)
+        return
+    with notifier:
+        backend, client = _get_redis(notifier)
+        if client is None:
+            return
+        pipe = client.pipeline(transaction=False)
+        for i, key in enumerate(client.scan_iter(match='%s:*' % backend._key_prefix, count=batch_size), 1):
+            pipe.delete(key)
+            if i % batch_size == 0:
+                pipe.execute()
+        pipe.execute()
+
+
+def bench_operations(notifier, operations=OPERATIONS, message_counts=(10, 100), content_sizes=(100,),
+                     concurrency=(1, 4), iterations=200):
+    """
+    Measures the throughput, latency and round trips per call of backend
+    operations for every combination of number of stored messages per user,
+    message content size and number of concurrent threads (one user each).
+
+    Run it against an isolated backend (see get_isolated_backend()): the
+    messages sent are removed afterwards, but the global messages only expire
+    after 10 minutes, so global_messages is the number of global messages
+    actually stored, and every user of the backend would see them until
+    remove_data() is called.
+    """
+    user_model = get_user_model()
+    # Sends last, so the other operations see the given number of messages
+    operations = sorted(operations, key=lambda operation: operation == 'send')
+    results = []
+    with notifier:
+        for count in message_counts:
+            for size in content_sizes:
+                content = 'x' * size
+                expired_at = datetime.datetime.now() + datetime.timedelta(minutes=10)
+                for threads in concurrency:
+                    users = [user_model(pk=2000000000 + i, username='bench%d' % i) for i in range(threads)]
+                    for user in users:
+                        notifier.mark_all_as_read(user)
+                    for i in range(count):
+                        notifier.send_many(users, content, 20, expired_at=expired_at)
+                    if 'global_get_messages' in operations:
+                        for i in range(count):
+                            notifier.global_send(content, 20, expired_at=expired_at)
+                    stored = _stored_bytes(notifier, users[0])
+                    scenario = {
+                        'messages': count,
+                        'content_size': size,
+                        'concurrency': threads,
+                        'bytes_per_msg': None if stored is None or not count else stored / float(count),
+                        'global_messages': len(notifier.global_get_messages()),
+                    }
+                    for operation in operations:
+                        result = dict(scenario, operation=operation)
+                        result.update(_run_operation(notifier, operation, users, content, iterations))
+                        results.append(result)
+                    for user in users:
+                        notifier.mark_all_as_read(user)
+    return results
+
+
+def main():
+    django.setup()
+    import memnotify
+
+    print('%-40s %12s %14s %14s' % ('serializer', 'bytes/msg', 'encode msg/s', 'decode msg/s'))
+    for result in bench_serializers():
+        print('%-40s %12.1f %14.0f %14.0f' % (
+            result['serializer'],
+            result['bytes_per_msg'],
+            result['encode_per_sec'],
+            result['decode_per_sec'],
+        ))
+
+    print('')
+    backend = getattr(settings, 'MEMNOTIFY_BACKEND', None) or memnotify._DEFAULT_BACKEND
+    notifier = get_isolated_backend(backend)
+    if notifier is None:
+        print('%s can not be isolated, send_many is not measured' % backend)
+        return
+    print('%-40s %12s' % ('method', 'msg/s'))
+    try:
+        for result in bench_send_many(notifier):
+            print('%-40s %12.0f' % (result['method'], result['msgs_per_sec']))
+    finally:
+        remove_data(notifier)
+
+
+if __name__ == '__main__':
+    main()
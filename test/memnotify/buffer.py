@@ -0,0 +1,164 @@
+"""Buffer that sends memnotify messages from a background thread."""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from memnotify.instrumentation import instrumented
+
+
+logger = logging.getLogger(__name__)
+
+# Queued to stop the background thread
+_STOP = object()
+# Queued to send the current batch without waiting for it to fill up
+_FLUSH = object()
+
+
+@instrumented
+def send_batch(notifier, messages):
+    with notifier as connection:
+        notifier.send_batch(messages)
+
+
+class SendBuffer(object):
+    """
+    Queues messages in memory and sends them from a background thread in
+    batches of up to batch_size messages, waiting at most flush_interval
+    seconds for a batch to fill up. Batches are sent with the send_batch()
+    method of the backend returned by get_notifier.
+
+    At most max_size messages are queued. When the queue is full, put() waits
+    up to put_timeout seconds (forever if None) for room and drops the message
+    if there is none. Batches that fail are retried up to max_retries times,
+    so a message may be sent twice if a batch fails half way; batches that
+    keep failing are dropped.
+
+    The pending messages are sent when the process exits.
+    """
+    def __init__(self, get_notifier, max_size=10000, batch_size=500, flush_interval=0.1,
+                 put_timeout=0, max_retries=3, retry_delay=0.5, shutdown_timeout=5):
+        self._get_notifier = get_notifier
+        self._queue = queue.Queue(max_size)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._put_timeout = put_timeout
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._thread = None
+        self._counters = {'queued': 0, 'sent': 0, 'dropped': 0, 'retried': 0}
+        atexit.register(self.close, shutdown_timeout)
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='memnotify-buffer', daemon=True)
+                self._thread.start()
+
+    def put(self, users, content, level, sender=None, expired_at=None, one_time=False, block=True):
+        """
+        Queues a message to users. Returns False if it was dropped because the
+        queue is full. If block is False it never waits for room.
+        """
+        self._start()
+        block = block and self._put_timeout != 0
+        try:
+            self._queue.put((users, content, level, sender, expired_at, one_time), block, self._put_timeout if block else None)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('queued')
+        return True
+
+    def _get_batch(self):
+        """
+        Waits for the next batch of messages. Returns the batch and whether
+        the thread has to stop after sending it.
+        """
+        item = self._queue.get()
+        batch = []
+        deadline = time.time() + self._flush_interval
+        while True:
+            if item is _STOP or item is _FLUSH:
+                self._queue.task_done()
+                return batch, item is _STOP
+            batch.append(item)
+            if len(batch) >= self._batch_size:
+                return batch, False
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                return batch, False
+
+    def _send(self, batch):
+        for attempt in range(self._max_retries + 1):
+            try:
+                send_batch(self._get_notifier(), batch)
+            except Exception:
+                if attempt == self._max_retries:
+                    logger.exception('Dropping %d memnotify messages', len(batch))
+                    self._count('dropped', len(batch))
+                    return
+                self._count('retried', len(batch))
+                time.sleep(self._retry_delay * (attempt + 1))
+            else:
+                self._count('sent', len(batch))
+                return
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._get_batch()
+            if batch:
+                self._send(batch)
+            for item in batch:
+                self._queue.task_done()
+
+    def flush(self, timeout=None):
+        """
+        Waits until all queued messages have been sent (or dropped). Returns
+        False if timeout seconds passed first.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._queue.put_nowait(_FLUSH)
+            except queue.Full:
+                pass # The batch is sent as soon as it fills up
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """
+        Sends the queued messages and stops the background thread, waiting up
+        to timeout seconds. Messages queued later start it again.
+        """
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def stats(self):
+        """
+        Returns the number of messages queued, sent, dropped and retried so
+        far, and the number of messages waiting to be sent.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        stats['pending'] = self._queue.qsize()
+        return stats
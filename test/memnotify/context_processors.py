@@ -0,0 +1,14 @@
+"""Context processors for memnotify."""
+
+from memnotify.middleware import RequestNotifications
+
+
+def notifications(request):
+    """
+    Adds memnotify, the notifications of the current user, to the context.
+
+    It uses the cache set by MemnotifyMiddleware if it is installed.
+    """
+    if not hasattr(request, 'memnotify'):
+        request.memnotify = RequestNotifications(request)
+    return {'memnotify': request.memnotify}
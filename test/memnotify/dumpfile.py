@@ -0,0 +1,73 @@
+"""
+File format of the memnotify_dump and memnotify_load commands.
+
+A dump is a gzip compressed file with one JSON object per message:
+
+    {"user": "42", "msg": [content, level, created_at, expired_at, sender, flags]}
+
+where user is null for global messages and msg is the array stored by
+memnotify.serializers.JSONSerializer, so dumps do not depend on the serializer
+of the backend. The messages of each user are written in consecutive lines, in
+order. Files are read and written line by line, in constant memory.
+"""
+import gzip
+import itertools
+import json
+import sys
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from memnotify.serializers import JSONSerializer
+
+
+class _Serializer(JSONSerializer):
+    """
+    Serializer that resolves each sender once, instead of once per message.
+    """
+    max_senders = 10000
+
+    def __init__(self):
+        self._senders = {}
+
+    def _resolve_sender(self, pk):
+        if pk not in self._senders:
+            if len(self._senders) >= self.max_senders:
+                self._senders.clear()
+            self._senders[pk] = super(_Serializer, self)._resolve_sender(pk)
+        return self._senders[pk]
+
+
+def open_dump(path, mode='rb'):
+    """
+    Opens a dump for reading ('rb') or writing ('wb'). The path '-' is the
+    standard input or output.
+    """
+    if path == '-':
+        return gzip.GzipFile(fileobj=sys.stdin.buffer if mode == 'rb' else sys.stdout.buffer, mode=mode)
+    return gzip.open(path, mode)
+
+
+def write_records(records, fileobj):
+    """
+    Writes records, (user id, messages) pairs as yielded by the dump() method
+    of the backends, to fileobj. Returns the number of messages written.
+    """
+    serializer = JSONSerializer()
+    count = 0
+    for user_id, messages in records:
+        for msg in messages:
+            line = json.dumps({'user': user_id, 'msg': serializer.pack(msg)}, cls=DjangoJSONEncoder, separators=(',', ':'))
+            fileobj.write(line.encode('utf-8') + b'\n')
+            count += 1
+    return count
+
+
+def read_records(fileobj):
+    """
+    Yields (user id, messages) pairs from fileobj for the load() method of the
+    backends. messages is an iterator, consumed while the lines are read.
+    """
+    serializer = _Serializer()
+    lines = (json.loads(line) for line in fileobj if line.strip())
+    for user_id, group in itertools.groupby(lines, key=lambda line: line['user']):
+        yield user_id, (serializer.unpack(line['msg']) for line in group)
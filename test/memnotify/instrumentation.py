@@ -0,0 +1,200 @@
+"""
+Instrumentation of the memnotify shortcuts.
+
+Callbacks registered with register() are called after each shortcut call as
+callback(operation, duration, stats), where operation is the name of the
+shortcut, duration the time it took in seconds and stats a dict with:
+
+    commands: commands sent to Redis (every command of a pipeline counts)
+    bytes_serialized: size of the messages serialized
+    bytes_deserialized: size of the messages deserialized
+    expired: number of expired messages found and removed
+
+Callbacks can also be registered by listing their dotted paths in the
+MEMNOTIFY_INSTRUMENTATION setting; classes, like the exporters of this module,
+are instantiated without arguments. Registering a callback twice has no
+effect. While no callback is registered the shortcuts only pay for an extra
+function call.
+"""
+import contextvars
+import functools
+import inspect
+import logging
+import socket
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('commands', 'bytes_serialized', 'bytes_deserialized', 'expired')
+
+_callbacks = ()
+
+# Callbacks registered by load_settings() by dotted path
+_loaded = {}
+
+# Stats of the operation running in the current context
+_current = contextvars.ContextVar('memnotify_instrumentation', default=None)
+
+
+def register(callback):
+    global _callbacks
+    if callback not in _callbacks:
+        _callbacks = _callbacks + (callback,)
+
+
+def unregister(callback):
+    global _callbacks
+    _callbacks = tuple(registered for registered in _callbacks if registered is not callback)
+
+
+def load_settings():
+    """
+    Registers the callbacks listed in MEMNOTIFY_INSTRUMENTATION that are not
+    registered yet, so it can be called more than once.
+    """
+    for path in getattr(settings, 'MEMNOTIFY_INSTRUMENTATION', ()):
+        if _loaded.get(path) in _callbacks:
+            continue
+        callback = import_string(path)
+        if inspect.isclass(callback):
+            callback = callback()
+        _loaded[path] = callback
+        register(callback)
+
+
+def record(metric, value=1):
+    """
+    Adds value to a metric of the operation running, if it is instrumented.
+    """
+    if _callbacks:
+        stats = _current.get()
+        if stats is not None:
+            stats[metric] += value
+
+
+def _emit(operation, start, stats):
+    duration = time.perf_counter() - start
+    for callback in _callbacks:
+        try:
+            callback(operation, duration, stats)
+        except Exception:
+            logger.exception('Error in memnotify instrumentation callback %r', callback)
+
+
+def instrumented(func):
+    """
+    Decorator that reports the calls of func (a function or coroutine
+    function) to the registered callbacks.
+    """
+    operation = func.__name__
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not _callbacks:
+                return await func(*args, **kwargs)
+            stats = dict.fromkeys(METRICS, 0)
+            token = _current.set(stats)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _current.reset(token)
+                _emit(operation, start, stats)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _callbacks:
+                return func(*args, **kwargs)
+            stats = dict.fromkeys(METRICS, 0)
+            token = _current.set(stats)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _current.reset(token)
+                _emit(operation, start, stats)
+    return wrapper
+
+
+def counting(func, metric, count=None):
+    """
+    Wraps func (a function or coroutine function) to add to metric on every
+    call the value returned by count(), called before func, or one if count is
+    None.
+    """
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            record(metric, 1 if count is None else count())
+            return await func(*args, **kwargs)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            record(metric, 1 if count is None else count())
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class StatsdExporter(object):
+    """
+    Sends the duration of each operation as a timer and its stats as counters
+    to a StatsD server over UDP (MEMNOTIFY_STATSD_HOST, MEMNOTIFY_STATSD_PORT),
+    named <MEMNOTIFY_STATSD_PREFIX>.<operation>.<metric>.
+    """
+    def __init__(self, host=None, port=None, prefix=None):
+        self._address = (
+            host or getattr(settings, 'MEMNOTIFY_STATSD_HOST', 'localhost'),
+            port or getattr(settings, 'MEMNOTIFY_STATSD_PORT', 8125),
+        )
+        self._prefix = prefix or getattr(settings, 'MEMNOTIFY_STATSD_PREFIX', 'memnotify')
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, operation, duration, stats):
+        name = '%s.%s' % (self._prefix, operation)
+        lines = ['%s.duration:%.3f|ms' % (name, duration * 1000)]
+        lines.extend('%s.%s:%d|c' % (name, metric, value) for metric, value in stats.items() if value)
+        try:
+            self._socket.sendto('\n'.join(lines).encode('ascii'), self._address)
+        except OSError:
+            pass # Metrics are best effort
+
+
+class PrometheusExporter(object):
+    """
+    Exports memnotify_operation_duration_seconds (a histogram) and a
+    memnotify_<metric>_total counter for each stat, labeled by operation
+    (requires the prometheus_client package). Create it only once per
+    registry.
+    """
+    def __init__(self, registry=None):
+        if prometheus_client is None:
+            raise ImproperlyConfigured('PrometheusExporter requires the prometheus_client package')
+        if registry is None:
+            registry = prometheus_client.REGISTRY
+        self._duration = prometheus_client.Histogram(
+            'memnotify_operation_duration_seconds', 'Duration of memnotify operations',
+            ['operation'], registry=registry,
+        )
+        self._counters = dict(
+            (metric, prometheus_client.Counter(
+                'memnotify_%s_total' % metric, 'Total %s of memnotify operations' % metric.replace('_', ' '),
+                ['operation'], registry=registry,
+            ))
+            for metric in METRICS
+        )
+
+    def __call__(self, operation, duration, stats):
+        self._duration.labels(operation).observe(duration)
+        for metric, value in stats.items():
+            if value:
+                self._counters[metric].labels(operation).inc(value)
@@ -0,0 +1,91 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from memnotify import benchmarks
+import memnotify
+
+
+class Command(BaseCommand):
+    help = 'Measures the throughput and latency of the memnotify backend operations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backend',
+            help='Backend to measure (default: MEMNOTIFY_BACKEND).',
+        )
+        parser.add_argument(
+            '--key-prefix', default=benchmarks.KEY_PREFIX,
+            help='Prefix of the keys used by Redis backends and of the file used by the shared memory backend, '
+                 'removed afterwards (default: %s).' % benchmarks.KEY_PREFIX,
+        )
+        parser.add_argument(
+            '--allow-global', action='store_true',
+            help='Measures global_get_messages with backends that can not be isolated, whose users see the '
+                 'global messages sent for up to 10 minutes.',
+        )
+        parser.add_argument(
+            '--operations', nargs='+', choices=benchmarks.OPERATIONS, default=benchmarks.OPERATIONS,
+            help='Operations to measure (default: all).',
+        )
+        parser.add_argument(
+            '--messages', nargs='+', type=int, default=[10, 100],
+            help='Numbers of messages stored per user (default: 10 100).',
+        )
+        parser.add_argument(
+            '--content-size', nargs='+', type=int, default=[100],
+            help='Sizes of the message contents in characters (default: 100).',
+        )
+        parser.add_argument(
+            '--concurrency', nargs='+', type=int, default=[1, 4],
+            help='Numbers of concurrent threads (default: 1 4).',
+        )
+        parser.add_argument(
+            '--iterations', type=int, default=200,
+            help='Calls of each operation per thread (default: 200).',
+        )
+        parser.add_argument(
+            '--json', action='store_true',
+            help='Writes the results as JSON.',
+        )
+
+    def handle(self, *args, **options):
+        backend = options['backend'] or getattr(settings, 'MEMNOTIFY_BACKEND', None) or memnotify._DEFAULT_BACKEND
+        notifier = benchmarks.get_isolated_backend(backend, options['key_prefix'])
+        if notifier is None:
+            if 'global_get_messages' in options['operations'] and not options['allow_global']:
+                raise CommandError('%s can not be isolated, so its users would see the global messages sent; '
+                                   'pass --allow-global or leave out global_get_messages.' % backend)
+            notifier = import_string(backend)()
+        try:
+            results = benchmarks.bench_operations(
+                notifier,
+                operations=options['operations'],
+                message_counts=options['messages'],
+                content_sizes=options['content_size'],
+                concurrency=options['concurrency'],
+                iterations=options['iterations'],
+            )
+        finally:
+            benchmarks.remove_data(notifier)
+        if options['json']:
+            self.stdout.write(json.dumps({'backend': backend, 'results': results}, indent=2))
+            return
+
+        self.stdout.write('Backend: %s' % backend)
+        self.stdout.write('%-20s %8s %8s %6s %12s %10s %10s %12s %10s' % (
+            'operation', 'messages', 'size', 'conc', 'ops/s', 'p50 ms', 'p99 ms', 'round trips', 'bytes/msg'))
+        for result in results:
+            self.stdout.write('%-20s %8d %8d %6d %12.0f %10.3f %10.3f %12s %10s' % (
+                result['operation'],
+                result['messages'],
+                result['content_size'],
+                result['concurrency'],
+                result['ops_per_sec'],
+                result['p50_ms'],
+                result['p99_ms'],
+                '-' if result['round_trips'] is None else '%.2f' % result['round_trips'],
+                '-' if result['bytes_per_msg'] is None else '%.0f' % result['bytes_per_msg'],
+            ))
@@ -0,0 +1,33 @@
+import itertools
+
+from django.core.management.base import BaseCommand, CommandError
+
+from memnotify import dumpfile
+import memnotify
+
+
+class Command(BaseCommand):
+    help = ('Writes the messages of all users and the global messages to a compressed dump. '
+            'The content of the messages must be JSON-serializable.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='-',
+            help='File to write (default: the standard output).',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of keys read in each batch (default: 1000).',
+        )
+
+    def handle(self, *args, **options):
+        records = memnotify.dump(options['batch_size'])
+        # Fail before the dump is created if the backend can not dump messages
+        try:
+            first = list(itertools.islice(records, 1))
+        except NotImplementedError as e:
+            raise CommandError(str(e))
+        with dumpfile.open_dump(options['path'], 'wb') as fileobj:
+            count = dumpfile.write_records(itertools.chain(first, records), fileobj)
+        # The dump itself may be written to the standard output
+        self.stderr.write(self.style.SUCCESS('Dumped %d messages.' % count))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from memnotify import dumpfile
+import memnotify
+
+
+class Command(BaseCommand):
+    help = 'Stores the messages of a dump written by memnotify_dump.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='-',
+            help='File to read (default: the standard input).',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of messages stored in each batch (default: 1000).',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with dumpfile.open_dump(options['path'], 'rb') as fileobj:
+                count = memnotify.load(dumpfile.read_records(fileobj), options['batch_size'])
+        except NotImplementedError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS('Loaded %d messages.' % count))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+import memnotify
+
+
+class Command(BaseCommand):
+    help = 'Removes the expired messages of all users from the memnotify backend.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of keys checked in each batch (default: 1000).',
+        )
+        parser.add_argument(
+            '--rate-limit', type=float, default=None,
+            help='Maximum number of keys checked per second (default: no limit).',
+        )
+
+    def handle(self, *args, **options):
+        stats = memnotify.reap(options['batch_size'], options['rate_limit'])
+        if stats is None:
+            self.stdout.write('The backend removes expired messages by itself, nothing to do.')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            'Checked %(keys)d keys, removed %(messages)d expired messages (%(bytes)d bytes).' % stats
+        ))
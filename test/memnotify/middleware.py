@@ -0,0 +1,75 @@
+"""Middleware that caches the notifications of the current user per request."""
+
+import memnotify
+
+
+class RequestNotifications(object):
+    """
+    Notifications of the user of a request, read from the backend at most once.
+
+    messages and num_unread are read together, with a single get_messages()
+    call, the first time either of them is used, so one time messages are
+    consumed by the request even if only num_unread is shown. Writes to the
+    user made through the memnotify shortcuts while the request is processed
+    invalidate the cache.
+    """
+    def __init__(self, request):
+        self._request = request
+        self._messages = None
+        self._flush = False
+
+    def _get_user(self):
+        user = getattr(self._request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return None
+        return user
+
+    def _load(self):
+        if self._messages is not None:
+            return self._messages
+        user = self._get_user()
+        if user is None:
+            self._messages = []
+            return self._messages
+        if self._flush:
+            # Messages buffered during the request must be sent before reading
+            memnotify.flush()
+            self._flush = False
+        notifier = memnotify._get_notifier()
+        with notifier as connection:
+            self._messages = notifier.get_messages(user)
+        return self._messages
+
+    @property
+    def messages(self):
+        return self._load()
+
+    @property
+    def num_unread(self):
+        return len(self._load())
+
+    def invalidate(self, user=None, buffered=False):
+        """
+        Discards the cached notifications if they belong to user (or always if
+        user is None). If buffered is True the write is still in the send
+        buffer, so it is flushed before reading the notifications again.
+        """
+        if user is None or user.pk == getattr(self._get_user(), 'pk', None):
+            self._messages = None
+            self._flush = self._flush or buffered
+
+
+class MemnotifyMiddleware(object):
+    """
+    Sets request.memnotify, a RequestNotifications of the current user.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.memnotify = RequestNotifications(request)
+        token = memnotify._request_notifications.set(request.memnotify)
+        try:
+            return self.get_response(request)
+        finally:
+            memnotify._request_notifications.reset(token)
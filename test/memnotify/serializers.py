@@ -0,0 +1,185 @@
+"""Serializers used by memnotify backends to store messages."""
+
+import copy
+import datetime
+import json
+import pickle
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.functional import SimpleLazyObject, empty
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Flags of the compact message format
+_ONE_TIME = 1
+_AWARE_EXPIRY = 2
+_RAW_SENDER = 4
+
+
+class _LazySender(SimpleLazyObject):
+    """
+    Sender loaded from the database when it is first used. Its pk is known
+    beforehand, so reading it (to store the message again, for example) does
+    not query the database, even if the user has been deleted.
+    """
+    def __init__(self, pk):
+        self.__dict__['_sender_pk'] = pk
+        super(_LazySender, self).__init__(lambda: get_user_model()._default_manager.get(pk=pk))
+
+    @property
+    def pk(self):
+        return self.__dict__['_sender_pk']
+
+    def __copy__(self):
+        if self._wrapped is empty:
+            return type(self)(self.pk)
+        return copy.copy(self._wrapped)
+
+    def __deepcopy__(self, memo):
+        if self._wrapped is empty:
+            result = memo[id(self)] = type(self)(self.pk)
+            return result
+        return copy.deepcopy(self._wrapped, memo)
+
+
+class BaseSerializer(object):
+    """
+    Base class for message serializers.
+
+    Subclasses must overwrite dumps() and loads().
+    """
+    def dumps(self, msg):
+        """
+        Converts a message dict into bytes.
+        """
+        raise NotImplementedError('subclasses of BaseSerializer must override dumps() method')
+
+    def loads(self, raw_msg):
+        """
+        Converts bytes created by dumps() into a message dict.
+        """
+        raise NotImplementedError('subclasses of BaseSerializer must override loads() method')
+
+
+class PickleSerializer(BaseSerializer):
+    """
+    Stores the whole message dict with pickle (the default one).
+    """
+    def dumps(self, msg):
+        return pickle.dumps(msg)
+
+    def loads(self, raw_msg):
+        return pickle.loads(raw_msg)
+
+
+class CompactSerializer(BaseSerializer):
+    """
+    Base class for serializers that store a message as a flat array of
+    content, level, created_at, expired_at, sender and flags.
+
+    Timestamps are stored as integer microseconds and senders as primary keys
+    of the user model, resolved lazily when the sender is accessed. Messages
+    stored by PickleSerializer can still be read.
+    """
+    def _encode(self, msg):
+        raise NotImplementedError('subclasses of CompactSerializer must override _encode() method')
+
+    def _decode(self, raw_msg):
+        raise NotImplementedError('subclasses of CompactSerializer must override _decode() method')
+
+    def _to_timestamp(self, date):
+        return int(date.replace(microsecond=0).timestamp()) * 1000000 + date.microsecond
+
+    def _from_timestamp(self, timestamp, tz=None):
+        return datetime.datetime.fromtimestamp(timestamp / 1000000.0, tz)
+
+    def _resolve_sender(self, pk):
+        return _LazySender(pk)
+
+    def pack(self, msg):
+        """
+        Converts a message dict into the flat array stored by dumps().
+        """
+        flags = 0
+        if 'one_time' in msg:
+            flags |= _ONE_TIME
+        expired_at = msg['expired_at']
+        if expired_at is not None:
+            if expired_at.tzinfo is not None:
+                flags |= _AWARE_EXPIRY
+            expired_at = self._to_timestamp(expired_at)
+        sender = msg['sender']
+        if sender is not None:
+            if hasattr(sender, 'pk'):
+                sender = sender.pk
+            else:
+                flags |= _RAW_SENDER
+        return [
+            msg['content'],
+            msg['level'],
+            self._to_timestamp(msg['created_at']),
+            expired_at,
+            sender,
+            flags,
+        ]
+
+    def unpack(self, data):
+        """
+        Converts an array created by pack() into a message dict.
+        """
+        content, level, created_at, expired_at, sender, flags = data
+        if expired_at is not None:
+            tz = datetime.timezone.utc if flags & _AWARE_EXPIRY else None
+            expired_at = self._from_timestamp(expired_at, tz)
+        if sender is not None and not flags & _RAW_SENDER:
+            sender = self._resolve_sender(sender)
+        msg = {
+            'content': content,
+            'level': level,
+            'created_at': self._from_timestamp(created_at),
+            'sender': sender,
+            'expired_at': expired_at,
+        }
+        if flags & _ONE_TIME:
+            msg['one_time'] = True
+        return msg
+
+    def dumps(self, msg):
+        return self._encode(self.pack(msg))
+
+    def loads(self, raw_msg):
+        if raw_msg[:1] == b'\x80':
+            return pickle.loads(raw_msg)
+        return self.unpack(self._decode(raw_msg))
+
+
+class JSONSerializer(CompactSerializer):
+    """
+    Compact serializer that uses JSON. Message contents must be JSON
+    serializable.
+    """
+    def _encode(self, data):
+        return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+    def _decode(self, raw_msg):
+        return json.loads(raw_msg)
+
+
+class MsgpackSerializer(CompactSerializer):
+    """
+    Compact serializer that uses msgpack (requires the msgpack package).
+    """
+    def __init__(self):
+        if msgpack is None:
+            raise ImproperlyConfigured('MsgpackSerializer requires the msgpack package')
+
+    def _encode(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def _decode(self, raw_msg):
+        return msgpack.unpackb(raw_msg, raw=False)
@@ -4,19 +4,35 @@ Note: Select a redis db that is not in use!
     def setUp(self):
         self.notifier = RedisBackend(redis_db=?)
 """
-from django.test import TestCase
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.test import RequestFactory, TestCase
 from django.test.utils import override_settings
 
 from django.contrib.auth.models import User
 
-from memnotify.backends import base, redis_backend, dummy
+from memnotify.backends import base, cached, locmem, redis_backend, dummy, shared_memory
+from memnotify import benchmarks, buffer, context_processors, dumpfile, instrumentation, middleware, serializers, views
 from memnotify import INFO, WARNING, ERROR
 import memnotify
 
+from asgiref.sync import async_to_sync
 from mock import Mock, patch
+from redis.crc import key_slot
 
+import asyncio
+import os
 import random
+import shutil
+import socket
+import tempfile
 import datetime
+import io
+import json
+import pickle
+import threading
+import time
+import unittest
 
 
 class MemnotifyConfigTestCase(TestCase):
@@ -29,6 +45,47 @@ class MemnotifyConfigTestCase(TestCase):
         memnotify.reload_config()
         self.assertTrue(isinstance(memnotify._notifier, dummy.DummyBackend))
 
+    @override_settings(MEMNOTIFY_BACKEND='memnotify.backends.dummy.DummyBackend')
+    def test_lazy_backend(self):
+        with patch.multiple('memnotify', _backend=None, _notifier=None):
+            notifier = memnotify._get_notifier()
+            self.assertTrue(isinstance(notifier, dummy.DummyBackend))
+            self.assertTrue(memnotify._get_notifier() is notifier)
+
+    def test_concurrent_creation(self):
+        def create():
+            time.sleep(0.05)
+            return dummy.DummyBackend()
+        backend = Mock(side_effect=create)
+        notifiers = []
+        with patch.multiple('memnotify', _backend=backend, _notifier=None):
+            threads = [threading.Thread(target=lambda: notifiers.append(memnotify._get_notifier())) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(backend.call_count, 1)
+        self.assertEqual(len(set(map(id, notifiers))), 1)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'os.fork is not available')
+    def test_reset_after_fork(self):
+        memnotify.reload_config('memnotify.backends.dummy.DummyBackend')
+        notifier = memnotify._get_notifier()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            child_notifier = memnotify._get_notifier()
+            ok = memnotify._notifier is child_notifier and child_notifier is not notifier
+            os.write(write_fd, b'1' if ok and isinstance(child_notifier, dummy.DummyBackend) else b'0')
+            os._exit(0)
+        os.close(write_fd)
+        result = os.read(read_fd, 1)
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+        self.assertEqual(result, b'1')
+        self.assertTrue(memnotify._get_notifier() is notifier)
+
 
 class MemnotifyShortcutsTestCase(TestCase):
     @override_settings(MEMNOTIFY_BACKEND='memnotify.backends.dummy.DummyBackend')
@@ -53,6 +110,16 @@ class MemnotifyShortcutsTestCase(TestCase):
             memnotify.send(user, 'Message 6', level=ERROR, expired_at=now)
             mock_notifier.send.assert_called_with(user, 'Message 6', ERROR, None, now, False)
 
+    def test_send_many(self):
+        with patch('memnotify._notifier') as mock_notifier:
+            mock_notifier.send_many = Mock()
+            users = [Mock(), Mock()]
+            memnotify.send_many(users, 'Message 1')
+            mock_notifier.send_many.assert_called_with(users, 'Message 1', INFO, None, None, False)
+            now = datetime.datetime.now()
+            memnotify.send_many(users, 'Message 2', level=ERROR, sender=users[0], expired_at=now, one_time=True)
+            mock_notifier.send_many.assert_called_with(users, 'Message 2', ERROR, users[0], now, True)
+
     def test_num_unread(self):
         with patch('memnotify._notifier') as mock_notifier:
             mock_notifier.num_unread = Mock(return_value=24)
@@ -66,7 +133,9 @@ class MemnotifyShortcutsTestCase(TestCase):
             mock_notifier.get_messages = Mock(return_value=messages)
             user = Mock()
             self.assertTrue(memnotify.get_messages(user), messages)
-            mock_notifier.get_messages.assert_called_with(user)
+            mock_notifier.get_messages.assert_called_with(user, None, None, None)
+            memnotify.get_messages(user, limit=10, cursor=5, min_level=ERROR)
+            mock_notifier.get_messages.assert_called_with(user, 10, 5, ERROR)
 
     def test_get_last_and_read(self):
         with patch('memnotify._notifier') as mock_notifier:
@@ -76,6 +145,28 @@ class MemnotifyShortcutsTestCase(TestCase):
             self.assertTrue(memnotify.get_last_and_read(user), msg)
             mock_notifier.get_last_and_read.assert_called_with(user)
 
+    def test_get_and_read(self):
+        with patch('memnotify._notifier') as mock_notifier:
+            messages = [Mock(), Mock()]
+            mock_notifier.get_and_read = Mock(return_value=messages)
+            user = Mock()
+            self.assertEqual(memnotify.get_and_read(user), messages)
+            mock_notifier.get_and_read.assert_called_with(user, None)
+            memnotify.get_and_read(user, 2)
+            mock_notifier.get_and_read.assert_called_with(user, 2)
+
+    def test_many(self):
+        with patch('memnotify._notifier') as mock_notifier:
+            mock_notifier.num_unread_many = Mock(return_value={1: 2, 2: 0})
+            mock_notifier.get_messages_many = Mock(return_value={1: [], 2: []})
+            users = [Mock(), Mock()]
+            self.assertEqual(memnotify.num_unread_many(users), {1: 2, 2: 0})
+            mock_notifier.num_unread_many.assert_called_with(users)
+            self.assertEqual(memnotify.get_messages_many(users), {1: [], 2: []})
+            mock_notifier.get_messages_many.assert_called_with(users, None)
+            memnotify.get_messages_many(users, limit=5)
+            mock_notifier.get_messages_many.assert_called_with(users, 5)
+
     def test_mark_all_as_read(self):
         with patch('memnotify._notifier') as mock_notifier:
             mock_notifier.mark_all_as_read = Mock()
@@ -103,14 +194,430 @@ class MemnotifyShortcutsTestCase(TestCase):
         with patch('memnotify._notifier') as mock_notifier:
             mock_notifier.global_num_unread = Mock(return_value=24)
             self.assertTrue(memnotify.global_num_unread(), 24)
-            mock_notifier.global_num_unread.assert_called_with()
+            mock_notifier.global_num_unread.assert_called_with(None)
+            user = Mock()
+            memnotify.global_num_unread(user)
+            mock_notifier.global_num_unread.assert_called_with(user)
 
     def test_global_get_messages(self):
         with patch('memnotify._notifier') as mock_notifier:
             messages = [Mock(), Mock(), Mock()]
             mock_notifier.global_get_messages = Mock(return_value=messages)
             self.assertTrue(memnotify.global_get_messages(), messages)
-            mock_notifier.global_get_messages.assert_called_with()
+            mock_notifier.global_get_messages.assert_called_with(None)
+            user = Mock()
+            memnotify.global_get_messages(user)
+            mock_notifier.global_get_messages.assert_called_with(user)
+
+    def test_reap(self):
+        with patch('memnotify._notifier') as mock_notifier:
+            mock_notifier.reap = Mock(return_value={'keys': 10, 'messages': 3, 'bytes': 300})
+            stdout = io.StringIO()
+            call_command('memnotify_reap', '--batch-size=5', '--rate-limit=100', stdout=stdout)
+            mock_notifier.reap.assert_called_with(5, 100)
+            self.assertIn('removed 3 expired messages (300 bytes)', stdout.getvalue())
+            mock_notifier.reap = Mock(return_value=None)
+            call_command('memnotify_reap', stdout=stdout)
+            mock_notifier.reap.assert_called_with(1000, None)
+
+    def test_dump_and_load(self):
+        now = datetime.datetime.now().replace(microsecond=0)
+        records = [
+            (None, [{'content': 'Global', 'level': INFO, 'created_at': now, 'sender': None, 'expired_at': None}]),
+            ('1', [
+                {'content': 'Test1', 'level': ERROR, 'created_at': now, 'sender': None, 'expired_at': now},
+                {'content': 'Test2', 'level': INFO, 'created_at': now, 'sender': None, 'expired_at': None, 'one_time': True},
+            ]),
+        ]
+        loaded = []
+        path = os.path.join(tempfile.mkdtemp(), 'dump.gz')
+        try:
+            with patch('memnotify._notifier') as mock_notifier:
+                mock_notifier.dump = Mock(return_value=iter(records))
+                mock_notifier.load = Mock(side_effect=lambda records, batch_size: loaded.extend((user_id, list(messages)) for user_id, messages in records) or 3)
+                stderr = io.StringIO()
+                call_command('memnotify_dump', path, '--batch-size=10', stderr=stderr)
+                mock_notifier.dump.assert_called_with(10)
+                self.assertIn('Dumped 3 messages', stderr.getvalue())
+                stdout = io.StringIO()
+                call_command('memnotify_load', path, stdout=stdout)
+                self.assertIn('Loaded 3 messages', stdout.getvalue())
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+        self.assertEqual(loaded, records)
+
+    def test_dump_not_supported(self):
+        path = os.path.join(tempfile.mkdtemp(), 'dump.gz')
+        try:
+            with patch('memnotify._notifier', locmem.LocMemBackend()):
+                with self.assertRaisesRegex(CommandError, 'LocMemBackend can not dump messages'):
+                    call_command('memnotify_dump', path)
+                self.assertFalse(os.path.exists(path))
+                dumpfile.open_dump(path, 'wb').close()
+                with self.assertRaisesRegex(CommandError, 'LocMemBackend can not load messages'):
+                    call_command('memnotify_load', path)
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    @override_settings(MEMNOTIFY_BUFFERED=True, MEMNOTIFY_BUFFER_FLUSH_INTERVAL=0)
+    def test_buffered(self):
+        notifier = dummy.DummyBackend()
+        notifier.send_batch = Mock()
+        user = Mock()
+        with patch('memnotify._notifier', notifier), patch('memnotify._buffer', None):
+            self.assertEqual(memnotify.buffer_stats(), None)
+            memnotify.send(user, 'Message 1')
+            memnotify.send_many(iter([user]), 'Message 2', ERROR)
+            self.assertTrue(memnotify.flush(5))
+            messages = [args[0][0] for args in notifier.send_batch.call_args_list]
+            self.assertEqual(sum(messages, []), [
+                ([user], 'Message 1', INFO, None, None, False),
+                ([user], 'Message 2', ERROR, None, None, False),
+            ])
+            self.assertEqual(memnotify.buffer_stats()['sent'], 2)
+            memnotify._buffer.close(5)
+        self.assertTrue(memnotify.flush())
+
+    def _async_mock(self, return_value=None):
+        async def coroutine(*args):
+            return return_value
+        return Mock(side_effect=coroutine)
+
+    async def test_async_shortcuts(self):
+        with patch('memnotify._notifier', dummy.DummyBackend()) as notifier:
+            user = Mock()
+            now = datetime.datetime.now()
+            notifier.asend = self._async_mock()
+            await memnotify.asend(user, 'Message 1', level=ERROR, expired_at=now)
+            notifier.asend.assert_called_with(user, 'Message 1', ERROR, None, now, False)
+            notifier.asend_many = self._async_mock()
+            await memnotify.asend_many([user], 'Message 2', one_time=True)
+            notifier.asend_many.assert_called_with([user], 'Message 2', INFO, None, None, True)
+            notifier.anum_unread = self._async_mock(24)
+            self.assertEqual(await memnotify.anum_unread(user), 24)
+            notifier.anum_unread.assert_called_with(user)
+            messages = [Mock(), Mock()]
+            notifier.aget_messages = self._async_mock(messages)
+            self.assertEqual(await memnotify.aget_messages(user), messages)
+            notifier.aget_messages.assert_called_with(user, None, None, None)
+            notifier.aget_last_and_read = self._async_mock(messages[1])
+            self.assertEqual(await memnotify.aget_last_and_read(user), messages[1])
+            notifier.aget_last_and_read.assert_called_with(user)
+            notifier.aget_and_read = self._async_mock(messages)
+            self.assertEqual(await memnotify.aget_and_read(user, 2), messages)
+            notifier.aget_and_read.assert_called_with(user, 2)
+            notifier.amark_all_as_read = self._async_mock()
+            await memnotify.amark_all_as_read(user)
+            notifier.amark_all_as_read.assert_called_with(user)
+            notifier.aglobal_send = self._async_mock()
+            await memnotify.aglobal_send('Message 3', sender=user)
+            notifier.aglobal_send.assert_called_with('Message 3', INFO, user, None)
+            notifier.aglobal_num_unread = self._async_mock(3)
+            self.assertEqual(await memnotify.aglobal_num_unread(), 3)
+            notifier.aglobal_get_messages = self._async_mock(messages)
+            self.assertEqual(await memnotify.aglobal_get_messages(), messages)
+
+
+class MemnotifyMiddlewareTestCase(TestCase):
+    def setUp(self):
+        self.notifier = dummy.DummyBackend()
+        self.notifier.get_messages = Mock(return_value=[Mock(), Mock()])
+        self.notifier.num_unread = Mock(return_value=5)
+        self.request = RequestFactory().get('/')
+        self.request.user = User.objects.create(username='testuser')
+
+    def _process(self, view):
+        with patch('memnotify._notifier', self.notifier):
+            return middleware.MemnotifyMiddleware(view)(self.request)
+
+    def test_read_once(self):
+        def view(request):
+            self.assertEqual(len(request.memnotify.messages), 2)
+            self.assertEqual(len(request.memnotify.messages), 2)
+            self.assertEqual(request.memnotify.num_unread, 2)
+            return 'response'
+        self.assertEqual(self._process(view), 'response')
+        self.assertEqual(self.notifier.get_messages.call_count, 1)
+        self.assertEqual(self.notifier.num_unread.call_count, 0)
+
+    def test_num_unread(self):
+        def view(request):
+            self.assertEqual(request.memnotify.num_unread, 2)
+            self.assertEqual(request.memnotify.num_unread, 2)
+            self.assertEqual(len(request.memnotify.messages), 2)
+        self._process(view)
+        self.assertEqual(self.notifier.get_messages.call_count, 1)
+        self.assertEqual(self.notifier.num_unread.call_count, 0)
+
+    def test_invalidate(self):
+        other = User.objects.create(username='otheruser')
+        def view(request):
+            request.memnotify.messages
+            memnotify.send(other, 'Message')
+            request.memnotify.messages
+            memnotify.send(request.user, 'Message')
+            request.memnotify.messages
+            memnotify.mark_all_as_read(request.user)
+            request.memnotify.messages
+        self._process(view)
+        self.assertEqual(self.notifier.get_messages.call_count, 3)
+        self.assertEqual(memnotify._request_notifications.get(), None)
+
+    @override_settings(MEMNOTIFY_BUFFERED=True, MEMNOTIFY_BUFFER_FLUSH_INTERVAL=10)
+    def test_buffered_send(self):
+        def view(request):
+            request.memnotify.messages
+            memnotify.send(request.user, 'Message')
+            self.assertEqual(self.notifier.send_batch.call_count, 0)
+            request.memnotify.messages
+            # The buffer is flushed before reading again
+            self.assertEqual(self.notifier.send_batch.call_count, 1)
+            request.memnotify.num_unread
+        self.notifier.send_batch = Mock()
+        with patch('memnotify._buffer', None):
+            self._process(view)
+        self.assertEqual(self.notifier.get_messages.call_count, 2)
+
+    def test_anonymous(self):
+        self.request.user = Mock(is_authenticated=False)
+        def view(request):
+            self.assertEqual(request.memnotify.messages, [])
+            self.assertEqual(request.memnotify.num_unread, 0)
+        self._process(view)
+        self.assertEqual(self.notifier.get_messages.call_count, 0)
+
+    def test_context_processor(self):
+        def view(request):
+            self.assertTrue(context_processors.notifications(request)['memnotify'] is request.memnotify)
+        self._process(view)
+        request = RequestFactory().get('/')
+        context = context_processors.notifications(request)
+        self.assertTrue(context['memnotify'] is request.memnotify)
+
+
+class StreamViewTestCase(TestCase):
+    async def test_stream(self):
+        async def alisten(user, timeout=None):
+            msg = {'content': 'Test', 'level': INFO, 'created_at': datetime.datetime(2020, 1, 1), 'expired_at': None}
+            yield 'message', msg
+            yield None
+            yield 'global', msg
+        notifier = dummy.DummyBackend()
+        notifier.alisten = alisten
+        request = RequestFactory().get('/memnotify/stream/')
+        with patch('memnotify._notifier', notifier), patch('memnotify.views.auth.get_user', return_value=Mock(is_authenticated=True)):
+            response = await views.stream(request)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(chunks, [
+            b'retry: 5000\n\n',
+            b'event: message\ndata: {"content": "Test", "level": 20, "created_at": "2020-01-01T00:00:00", "expired_at": null}\n\n',
+            b': keepalive\n\n',
+            b'event: global\ndata: {"content": "Test", "level": 20, "created_at": "2020-01-01T00:00:00", "expired_at": null}\n\n',
+        ])
+
+    @override_settings(MEMNOTIFY_STREAM_MAX_AGE=0)
+    async def test_max_age(self):
+        notifier = redis_backend.RedisBackend(redis_db=1)
+        user = Mock(id=random.randint(1, 999999999), is_authenticated=True)
+        request = RequestFactory().get('/memnotify/stream/')
+        with patch('memnotify._notifier', notifier), patch('memnotify.views._KEEPALIVE', 0.1), \
+                patch('memnotify.views.auth.get_user', return_value=user):
+            response = await views.stream(request)
+            chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(chunks, [b'retry: 5000\n\n', b': keepalive\n\n'])
+        subscriptions = notifier._subscriptions[asyncio.get_running_loop()]
+        self.assertEqual(subscriptions._queues, {})
+        self.assertEqual(subscriptions._task, None)
+
+    async def test_anonymous(self):
+        request = RequestFactory().get('/memnotify/stream/')
+        with patch('memnotify.views.auth.get_user', return_value=Mock(is_authenticated=False)):
+            response = await views.stream(request)
+        self.assertEqual(response.status_code, 403)
+
+
+class SendBufferTestCase(TestCase):
+    def setUp(self):
+        self.notifier = dummy.DummyBackend()
+        self.notifier.send_batch = Mock()
+        self.buffer = buffer.SendBuffer(lambda: self.notifier, max_size=10, batch_size=2, retry_delay=0)
+
+    def tearDown(self):
+        self.buffer.close(5)
+
+    def test_batches(self):
+        for i in range(5):
+            self.assertTrue(self.buffer.put(['user'], 'Message %d' % i, INFO))
+        self.assertTrue(self.buffer.flush(5))
+        batches = [args[0][0] for args in self.notifier.send_batch.call_args_list]
+        self.assertTrue(all(len(batch) <= 2 for batch in batches))
+        self.assertEqual([batch[1] for batch in sum(batches, [])], ['Message %d' % i for i in range(5)])
+        self.assertEqual(self.buffer.stats(), {'queued': 5, 'sent': 5, 'dropped': 0, 'retried': 0, 'pending': 0})
+
+    def test_backpressure(self):
+        sending = threading.Event()
+        release = threading.Event()
+        def send_batch(messages):
+            sending.set()
+            release.wait(5)
+        self.notifier.send_batch = Mock(side_effect=send_batch)
+        self.buffer.put(['user'], 'Message', INFO)
+        sending.wait(5)
+        results = [self.buffer.put(['user'], 'Message', INFO) for i in range(12)]
+        self.assertEqual(results, [True] * 10 + [False] * 2)
+        self.assertEqual(self.buffer.stats()['dropped'], 2)
+        self.assertEqual(self.buffer.stats()['pending'], 10)
+        release.set()
+        self.assertTrue(self.buffer.flush(5))
+        self.assertEqual(self.buffer.stats()['sent'], 11)
+
+    def test_retries(self):
+        self.notifier.send_batch = Mock(side_effect=[Exception('down'), None])
+        self.buffer.put(['user'], 'Message', INFO)
+        self.buffer.flush(5)
+        self.assertEqual(self.notifier.send_batch.call_count, 2)
+        self.assertEqual(self.buffer.stats()['retried'], 1)
+        self.assertEqual(self.buffer.stats()['sent'], 1)
+
+        self.notifier.send_batch = Mock(side_effect=Exception('down'))
+        with patch('memnotify.buffer.logger') as mock_logger:
+            self.buffer.put(['user'], 'Message', INFO)
+            self.buffer.flush(5)
+        self.assertEqual(self.notifier.send_batch.call_count, 4)
+        self.assertEqual(self.buffer.stats()['dropped'], 1)
+        self.assertTrue(mock_logger.exception.called)
+
+    def test_close(self):
+        self.buffer._flush_interval = 60
+        self.buffer.put(['user'], 'Message', INFO)
+        self.buffer.close(5)
+        self.assertFalse(self.buffer._thread.is_alive())
+        self.assertEqual(self.notifier.send_batch.call_count, 1)
+        self.buffer.put(['user'], 'Message', INFO)
+        self.assertTrue(self.buffer.flush(5))
+        self.assertEqual(self.buffer.stats()['sent'], 2)
+
+
+class InstrumentationTestCase(TestCase):
+    def setUp(self):
+        self.calls = []
+        self.callback = lambda operation, duration, stats: self.calls.append((operation, duration, dict(stats)))
+        self.user = User.objects.create(id=1, username='testuser')
+
+    def tearDown(self):
+        instrumentation.unregister(self.callback)
+
+    def test_disabled(self):
+        with patch('memnotify._notifier', locmem.LocMemBackend()):
+            memnotify.send(self.user, 'Message')
+            instrumentation.record('commands')
+            self.assertEqual(len(memnotify.get_messages(self.user)), 1)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(instrumentation._current.get(), None)
+
+    def test_redis(self):
+        instrumentation.register(self.callback)
+        notifier = redis_backend.RedisBackend(redis_db=1)
+        try:
+            with patch('memnotify._notifier', notifier):
+                memnotify.send(self.user, 'Message 1')
+                memnotify.send(self.user, 'Message 2', expired_at=datetime.datetime.now() - datetime.timedelta(days=1))
+                self.assertEqual(len(memnotify.get_messages(self.user)), 1)
+                memnotify.send_many([User(id=i) for i in range(2, 5)], 'Message 3')
+        finally:
+            notifier.redis.flushdb()
+        self.assertEqual([call[0] for call in self.calls], ['send', 'send', 'get_messages', 'send_many'])
+        operation, duration, stats = self.calls[0]
+        self.assertGreater(duration, 0)
+        self.assertEqual(stats['commands'], 1)
+        self.assertGreater(stats['bytes_serialized'], 0)
+        operation, duration, stats = self.calls[3]
+        # Every command of a pipeline is counted
+        self.assertEqual(stats['commands'], 3)
+        operation, duration, stats = self.calls[2]
+        # Reads and sweeps the list in a single script
+        self.assertEqual(stats['commands'], 1)
+        self.assertEqual(stats['expired'], 1)
+        self.assertGreater(stats['bytes_deserialized'], stats['bytes_serialized'])
+
+    async def test_async(self):
+        instrumentation.register(self.callback)
+        notifier = locmem.LocMemBackend()
+        with patch('memnotify._notifier', notifier):
+            await memnotify.asend(self.user, 'Message', expired_at=datetime.datetime.now() - datetime.timedelta(days=1))
+            self.assertEqual(await memnotify.anum_unread(self.user), 0)
+        self.assertEqual([call[0] for call in self.calls], ['asend', 'anum_unread'])
+        self.assertEqual(self.calls[1][2], {'commands': 0, 'bytes_serialized': 0, 'bytes_deserialized': 0, 'expired': 1})
+
+    def test_callback_error(self):
+        def callback(operation, duration, stats):
+            raise ValueError
+        instrumentation.register(callback)
+        try:
+            with patch('memnotify._notifier', dummy.DummyBackend()), patch('memnotify.instrumentation.logger') as mock_logger:
+                self.assertEqual(memnotify.num_unread(self.user), 0)
+            self.assertTrue(mock_logger.exception.called)
+        finally:
+            instrumentation.unregister(callback)
+
+    def test_statsd(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        try:
+            exporter = instrumentation.StatsdExporter('127.0.0.1', server.getsockname()[1], 'app')
+            exporter('send', 0.0015, {'commands': 1, 'bytes_serialized': 120, 'bytes_deserialized': 0, 'expired': 0})
+            packet = server.recv(1024).decode('ascii')
+        finally:
+            server.close()
+        self.assertEqual(packet.split('\n'), ['app.send.duration:1.500|ms', 'app.send.commands:1|c', 'app.send.bytes_serialized:120|c'])
+
+    @override_settings(MEMNOTIFY_INSTRUMENTATION=['memnotify.instrumentation.StatsdExporter'])
+    def test_load_settings(self):
+        callbacks = instrumentation._callbacks
+        try:
+            instrumentation.load_settings()
+            self.assertTrue(isinstance(instrumentation._callbacks[-1], instrumentation.StatsdExporter))
+            instrumentation.load_settings()
+            instrumentation.register(instrumentation._callbacks[-1])
+            self.assertEqual(len(instrumentation._callbacks), len(callbacks) + 1)
+        finally:
+            instrumentation._callbacks = callbacks
+
+    def test_prometheus_missing(self):
+        with patch('memnotify.instrumentation.prometheus_client', None):
+            self.assertRaises(ImproperlyConfigured, instrumentation.PrometheusExporter)
+
+
+class BaseBackendTestCase(TestCase):
+    async def test_async_defaults(self):
+        notifier = base.BaseMemnotifyBackend()
+        notifier.send = Mock()
+        notifier.num_unread = Mock(return_value=3)
+        user = Mock()
+        async with notifier as connection:
+            await notifier.asend(user, 'Message', INFO)
+            self.assertEqual(await notifier.anum_unread(user), 3)
+        notifier.send.assert_called_with(user, 'Message', INFO, None, None, False)
+        notifier.num_unread.assert_called_with(user)
+
+    def test_many(self):
+        notifier = base.BaseMemnotifyBackend()
+        notifier.num_unread = Mock(side_effect=lambda user: user.pk * 2)
+        notifier.get_messages = Mock(return_value=[])
+        users = [Mock(pk=1), Mock(pk=2)]
+        self.assertEqual(notifier.num_unread_many(users), {1: 2, 2: 4})
+        self.assertEqual(notifier.get_messages_many(users, limit=5), {1: [], 2: []})
+        notifier.get_messages.assert_called_with(users[1], 5)
+
+    def test_send_many(self):
+        notifier = base.BaseMemnotifyBackend()
+        notifier.send = Mock()
+        users = [Mock(), Mock()]
+        notifier.send_many(users, 'Message', INFO)
+        self.assertEqual(notifier.send.call_count, 2)
+        notifier.send.assert_called_with(users[1], 'Message', INFO, None, None, False)
 
 
 class RedisBackendConfigTestCase(TestCase):
@@ -140,6 +647,98 @@ class RedisBackendConfigTestCase(TestCase):
             notifier = redis_backend.RedisBackend()
             notifier._global_key = 'mykey'
 
+    @override_settings(MEMNOTIFY_REDIS_KEY_PREFIX='myapp')
+    def test_key_prefix(self):
+        notifier = redis_backend.RedisBackend()
+        self.assertEqual(notifier._get_key(Mock(id=1)), 'myapp:{1}')
+        for key in notifier._get_global_keys():
+            self.assertTrue(key.startswith('myapp:{GLOBAL_MSG}:'))
+        notifier = redis_backend.RedisBackend(key_prefix='other')
+        self.assertEqual(notifier._get_key(Mock(id=1)), 'other:{1}')
+
+    @override_settings(MEMNOTIFY_REDIS_CLUSTER_NODES=['10.0.0.1:7000', ('10.0.0.2', 7001)])
+    @override_settings(MEMNOTIFY_REDIS_PASSWORD='mypass')
+    def test_cluster(self):
+        with patch('memnotify.backends.redis_backend.RedisCluster') as mock_cluster:
+            notifier = redis_backend.RedisBackend()
+            self.assertTrue(notifier.open())
+            kwargs = mock_cluster.call_args[1]
+            self.assertEqual([(node.host, node.port) for node in kwargs['startup_nodes']], [('10.0.0.1', 7000), ('10.0.0.2', 7001)])
+            self.assertEqual(kwargs['password'], 'mypass')
+            self.assertEqual(mock_cluster.return_value.script_load.call_count, len(notifier.scripts))
+            self.assertTrue(notifier.redis is mock_cluster.return_value)
+
+    @override_settings(MEMNOTIFY_REDIS_SENTINELS=['10.0.0.1:26379', ('10.0.0.2', 26379)])
+    @override_settings(MEMNOTIFY_REDIS_SENTINEL_SERVICE='memnotify')
+    @override_settings(MEMNOTIFY_REDIS_DB=2)
+    def test_sentinel(self):
+        with patch('memnotify.backends.redis_backend.Sentinel') as mock_sentinel:
+            notifier = redis_backend.RedisBackend()
+            self.assertTrue(notifier.open())
+            self.assertEqual(mock_sentinel.call_args[0][0], [('10.0.0.1', 26379), ('10.0.0.2', 26379)])
+            master_for = mock_sentinel.return_value.master_for
+            self.assertEqual(master_for.call_args[0][0], 'memnotify')
+            self.assertEqual(master_for.call_args[1]['db'], 2)
+            self.assertTrue(notifier.redis is master_for.return_value)
+
+    @override_settings(MEMNOTIFY_REDIS_CLUSTER_NODES=['10.0.0.1:7000'])
+    async def test_async_cluster(self):
+        with patch('memnotify.backends.redis_backend.asyncio_cluster.RedisCluster') as mock_cluster:
+            notifier = redis_backend.RedisBackend()
+            client, scripts = notifier._get_async_client()
+            self.assertTrue(client is mock_cluster.return_value)
+            self.assertEqual(mock_cluster.call_args[1]['startup_nodes'][0].port, 7000)
+
+    @override_settings(MEMNOTIFY_REDIS_MAX_CONNECTIONS=20)
+    @override_settings(MEMNOTIFY_REDIS_SOCKET_TIMEOUT=0.5)
+    @override_settings(MEMNOTIFY_REDIS_SOCKET_CONNECT_TIMEOUT=0.1)
+    @override_settings(MEMNOTIFY_REDIS_HEALTH_CHECK_INTERVAL=30)
+    def test_connection_pool(self):
+        pool = redis_backend.RedisBackend()._get_connection_pool()
+        self.assertTrue(isinstance(pool, redis_backend.ConnectionPool))
+        self.assertEqual(pool.max_connections, 20)
+        self.assertEqual(pool.connection_kwargs['socket_timeout'], 0.5)
+        self.assertEqual(pool.connection_kwargs['socket_connect_timeout'], 0.1)
+        self.assertEqual(pool.connection_kwargs['health_check_interval'], 30)
+
+    def test_blocking_connection_pool(self):
+        notifier = redis_backend.RedisBackend(redis_max_connections=5, redis_pool_timeout=2)
+        pool = notifier._get_connection_pool()
+        self.assertTrue(isinstance(pool, redis_backend.BlockingConnectionPool))
+        self.assertEqual(pool.max_connections, 5)
+        self.assertEqual(pool.timeout, 2)
+
+    @override_settings(MEMNOTIFY_REDIS_UNIX_SOCKET_PATH='/tmp/redis.sock')
+    def test_unix_socket(self):
+        pool = redis_backend.RedisBackend()._get_connection_pool()
+        self.assertTrue(pool.connection_class is redis_backend.UnixDomainSocketConnection)
+        self.assertEqual(pool.connection_kwargs['path'], '/tmp/redis.sock')
+        self.assertTrue('host' not in pool.connection_kwargs)
+
+    def test_open_threads(self):
+        def slow_client(*args, **kwargs):
+            time.sleep(0.01)
+            return Mock()
+
+        with patch('memnotify.backends.redis_backend.Redis', side_effect=slow_client) as mock_redis:
+            notifier = redis_backend.RedisBackend()
+            threads = [threading.Thread(target=notifier.open) for i in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(mock_redis.call_count, 1)
+            self.assertFalse(notifier.open())
+
+    def test_default_serializer(self):
+        notifier = redis_backend.RedisBackend()
+        self.assertTrue(isinstance(notifier._serializer, serializers.PickleSerializer))
+
+    @override_settings(MEMNOTIFY_SERIALIZER='memnotify.serializers.JSONSerializer')
+    def test_custom_serializer(self):
+        notifier = redis_backend.RedisBackend()
+        self.assertTrue(isinstance(notifier._serializer, serializers.JSONSerializer))
+
 
 class RedisBackendTestCase(TestCase):
     def setUp(self):
@@ -192,6 +791,174 @@ class RedisBackendTestCase(TestCase):
         self.assertEqual(msg['content'], msg_content2)
         self.assertEqual(self.notifier.num_unread(self.user), 1)
 
+    def test_get_and_read(self):
+        self.assertEqual(self.notifier.get_and_read(self.user), [])
+        now = datetime.datetime.now()
+        # A message without expiration keeps the keys after sending expired ones
+        self.notifier.send(self.user, 'Test1', level=INFO)
+        self.notifier.send(self.user, 'Test2', level=INFO, expired_at=now - datetime.timedelta(days=1))
+        for i in range(3, 6):
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO)
+        self.assertEqual([msg['content'] for msg in self.notifier.get_and_read(self.user, 2)], ['Test1', 'Test3'])
+        self.assertEqual(self.notifier.get_and_read(self.user, 0), [])
+        self.notifier.send(self.user, 'Test6', level=INFO, one_time=True)
+        self.assertEqual([msg['content'] for msg in self.notifier.get_and_read(self.user)], ['Test4', 'Test5', 'Test6'])
+        self.assertEqual(self.notifier.num_unread(self.user), 0)
+        self.notifier.send(self.user, 'Test7', level=INFO)
+        self.assertEqual([msg['content'] for msg in self.notifier.get_messages(self.user)], ['Test7'])
+
+    def test_get_and_read_round_trips(self):
+        for i in range(10):
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO)
+        with patch.object(self.notifier.redis, 'evalsha', wraps=self.notifier.redis.evalsha) as mock_evalsha:
+            self.assertEqual(len(self.notifier.get_and_read(self.user, 5)), 5)
+            self.assertEqual(len(self.notifier.get_and_read(self.user)), 5)
+            self.assertEqual(mock_evalsha.call_count, 2)
+
+    def test_expired_pop_round_trips(self):
+        exp_date = datetime.datetime.now() - datetime.timedelta(days=1)
+        for i in range(4):
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO)
+            for j in range(3):
+                self.notifier.send(self.user, 'Expired', level=INFO, expired_at=exp_date)
+        with patch.object(self.notifier.redis, 'evalsha', wraps=self.notifier.redis.evalsha) as mock_evalsha:
+            self.assertEqual(self.notifier.get_last_and_read(self.user)['content'], 'Test3')
+            self.assertEqual([msg['content'] for msg in self.notifier.get_and_read(self.user, 2)], ['Test0', 'Test1'])
+            self.assertEqual(mock_evalsha.call_count, 2)
+        self.assertEqual(self.notifier.num_unread(self.user), 1)
+
+    def test_send_batch(self):
+        other_user = User.objects.create(id=self.uid + 1, username='testuser1')
+        self.notifier._pipeline_size = 2
+        self.notifier.send_batch([
+            ([self.user, other_user], 'Test1', INFO, None, None, False),
+            ([self.user], 'Test2', ERROR, None, None, True),
+        ])
+        self.assertEqual([msg['content'] for msg in self.notifier.get_messages(self.user)], ['Test1', 'Test2'])
+        self.assertEqual([msg['content'] for msg in self.notifier.get_messages(other_user)], ['Test1'])
+        self.assertEqual(self.notifier.num_unread(self.user), 1)
+
+    def test_reap(self):
+        users = [self.user] + [User.objects.create(id=self.uid + i, username='testuser%d' % i) for i in range(1, 3)]
+        exp_date = datetime.datetime.now() + datetime.timedelta(seconds=10)
+        for user in users[:2]:
+            self.notifier.send(user, 'Test1', level=INFO)
+            self.notifier.send(user, 'Test2', level=INFO, expired_at=exp_date)
+        self.notifier.send(users[2], 'Test3', level=INFO, one_time=True)
+        self.notifier.global_send('Global', INFO, expired_at=exp_date)
+        self.assertEqual(self.notifier.reap()['messages'], 0)
+        with patch('memnotify.backends.redis_backend.time.time', return_value=time.time() + 11), \
+                patch('memnotify.backends.redis_backend.time.sleep') as mock_sleep:
+            stats = self.notifier.reap(batch_size=1, rate_limit=1000)
+            self.assertEqual(stats['messages'], 3)
+            self.assertGreater(stats['bytes'], 0)
+            self.assertGreaterEqual(stats['keys'], 3)
+            self.assertTrue(mock_sleep.called)
+            self.assertEqual(self.notifier.reap()['messages'], 0)
+        for user, count in zip(users, (1, 1, 1)):
+            self.assertEqual(self.notifier.num_unread(user), count)
+
+    def test_many(self):
+        users = [self.user] + [User.objects.create(id=self.uid + i, username='testuser%d' % i) for i in range(1, 4)]
+        now = datetime.datetime.now()
+        for i, user in enumerate(users[:3]):
+            for j in range(i + 1):
+                self.notifier.send(user, 'Test%d' % j, level=INFO)
+        self.notifier.send(users[0], 'Expired', level=INFO, expired_at=now - datetime.timedelta(days=1))
+        self.notifier.send(users[1], 'Once', level=INFO, one_time=True)
+        with patch.object(self.notifier.redis, 'pipeline', wraps=self.notifier.redis.pipeline) as mock_pipeline:
+            self.assertEqual(self.notifier.num_unread_many(users), {self.uid: 1, self.uid + 1: 3, self.uid + 2: 3, self.uid + 3: 0})
+            self.assertLessEqual(mock_pipeline.call_count, 3)
+            mock_pipeline.reset_mock()
+            messages = self.notifier.get_messages_many(users)
+            self.assertLessEqual(mock_pipeline.call_count, 2)
+        self.assertEqual([msg['content'] for msg in messages[self.uid]], ['Test0'])
+        self.assertEqual([msg['content'] for msg in messages[self.uid + 1]], ['Test0', 'Test1', 'Once'])
+        self.assertEqual(messages[self.uid + 3], [])
+        self.assertEqual(self.notifier.num_unread(users[1]), 2)
+        pages = self.notifier.get_messages_many(users, limit=2)
+        self.assertEqual([msg['content'] for msg in pages[self.uid + 2]], ['Test0', 'Test1'])
+        self.assertEqual([msg['content'] for msg in self.notifier.get_messages(users[2], 2, pages[self.uid + 2].cursor)], ['Test2'])
+        self.assertEqual(pages[self.uid].cursor, None)
+
+    async def test_async_push_client(self):
+        async with self.notifier as connection:
+            client, scripts = self.notifier._get_async_client()
+            pipe = client.pipeline(transaction=False)
+            msg = self.notifier._generate_msg('Test', INFO, None, None)
+            await self.notifier._apush(self.notifier._get_key(self.user), self.notifier._codify(msg), msg, client=pipe)
+            self.assertEqual(await self.notifier.anum_unread(self.user), 0)
+            await pipe.execute()
+            self.assertEqual(await self.notifier.anum_unread(self.user), 1)
+
+    async def test_async_many(self):
+        other_user = await User.objects.acreate(id=self.uid + 1, username='testuser1')
+        async with self.notifier as connection:
+            await self.notifier.asend_many([self.user, other_user], 'Test1', INFO)
+            await self.notifier.asend(self.user, 'Test2', INFO, one_time=True)
+            self.assertEqual(await self.notifier.anum_unread_many([self.user, other_user]), {self.uid: 2, self.uid + 1: 1})
+            messages = await self.notifier.aget_messages_many([self.user, other_user])
+            self.assertEqual([msg['content'] for msg in messages[self.uid]], ['Test1', 'Test2'])
+            self.assertEqual(await self.notifier.anum_unread(self.user), 1)
+            pages = await self.notifier.aget_messages_many([self.user, other_user], limit=1)
+            self.assertEqual([msg['content'] for msg in pages[self.uid + 1]], ['Test1'])
+
+    def test_dump_and_load(self):
+        other_user = User.objects.create(id=self.uid + 1, username='testuser1')
+        now = datetime.datetime.now()
+        self.notifier.send(self.user, 'Test1', level=INFO, sender=other_user)
+        self.notifier.send(self.user, 'Expired', level=INFO, expired_at=now - datetime.timedelta(days=1))
+        self.notifier.send(self.user, 'Test2', level=ERROR, expired_at=now + datetime.timedelta(days=1), one_time=True)
+        self.notifier.send(other_user, 'Test3', level=INFO)
+        self.notifier.global_send('Global', INFO)
+        records = list(self.notifier.dump(batch_size=1))
+        self.assertEqual(records[0][0], None)
+        self.assertEqual(dict((user_id, [msg['content'] for msg in messages]) for user_id, messages in records), {
+            None: ['Global'],
+            str(self.uid): ['Test1', 'Test2'],
+            str(self.uid + 1): ['Test3'],
+        })
+        self.assertEqual(self.notifier.num_unread(self.user), 2)
+        fileobj = io.BytesIO()
+        self.assertEqual(dumpfile.write_records(records, fileobj), 4)
+        self.notifier.redis.flushdb()
+        fileobj.seek(0)
+        pubsub = self.notifier.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe('*:changes')
+        pubsub.get_message(timeout=1)
+        self.assertEqual(self.notifier.load(dumpfile.read_records(fileobj), batch_size=2), 4)
+        self.assertEqual(pubsub.get_message(timeout=0.1), None)
+        pubsub.close()
+        messages = self.notifier.get_messages(self.user)
+        self.assertEqual([msg['content'] for msg in messages], ['Test1', 'Test2'])
+        self.assertEqual(messages[0]['sender'], other_user)
+        self.assertEqual(messages[1]['level'], ERROR)
+        self.assertEqual(self.notifier.num_unread(self.user), 1)
+        self.assertEqual([msg['content'] for msg in self.notifier.get_messages(other_user)], ['Test3'])
+        self.assertEqual([msg['content'] for msg in self.notifier.global_get_messages()], ['Global'])
+
+    def test_dump_deleted_sender(self):
+        sender = User.objects.create(id=self.uid + 1, username='testuser1')
+        for i in range(5):
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO, sender=sender)
+        sender.delete()
+        records = list(self.notifier.dump())
+        fileobj = io.BytesIO()
+        with self.assertNumQueries(0):
+            self.assertEqual(dumpfile.write_records(records, fileobj), 5)
+        fileobj.seek(0)
+        user_id, messages = next(dumpfile.read_records(fileobj))
+        self.assertEqual([msg['sender'].pk for msg in messages], [self.uid + 1] * 5)
+
+    async def test_async_get_and_read(self):
+        async with self.notifier as connection:
+            for i in range(3):
+                await self.notifier.asend(self.user, 'Test%d' % i, INFO)
+            messages = await self.notifier.aget_and_read(self.user, 2)
+            self.assertEqual([msg['content'] for msg in messages], ['Test0', 'Test1'])
+            self.assertEqual(len(await self.notifier.aget_and_read(self.user)), 1)
+            self.assertEqual(await self.notifier.anum_unread(self.user), 0)
+
     def test_mark_all_as_read(self):
         # Empty inbox
         self.assertEqual(self.notifier.num_unread(self.user), 0)
@@ -209,17 +976,34 @@ class RedisBackendTestCase(TestCase):
         self.assertEqual(self.notifier.num_unread(self.user), 0)
 
     def test_expiration_date(self):
-        msg_content = 'Test'
         exp_date = datetime.datetime.now() - datetime.timedelta(days=1)
-        self.notifier.send(self.user, msg_content, level=INFO, expired_at=exp_date)
+        self.notifier.send(self.user, 'Test1', level=INFO, expired_at=exp_date)
+        self.notifier.send(self.user, 'Test2', level=INFO)
         self.assertEqual(self.notifier.num_unread(self.user), 1)
         messages = self.notifier.get_messages(self.user)
-        self.assertTrue(len(messages) == 1)
-        msg = messages[0]
-        self.assertEqual(msg['content'], msg_content)
-        self.assertEqual(msg['expired_at'], exp_date)
+        self.assertEqual([msg['content'] for msg in messages], ['Test2'])
+
+    def test_num_unread_expiration(self):
+        exp_date = datetime.datetime.now() + datetime.timedelta(seconds=1)
+        self.notifier.send(self.user, 'Test1', level=INFO, expired_at=exp_date)
+        self.notifier.send(self.user, 'Test2', level=INFO, one_time=True)
+        self.assertEqual(self.notifier.num_unread(self.user), 2)
+        with patch('memnotify.backends.redis_backend.time.time', return_value=exp_date.timestamp()):
+            self.assertEqual(self.notifier.num_unread(self.user), 1)
+            self.assertEqual(self.notifier.num_unread(self.user), 1)
+        messages = self.notifier.get_messages(self.user)
+        self.assertEqual([msg['content'] for msg in messages], ['Test2'])
         self.assertEqual(self.notifier.num_unread(self.user), 0)
-        self.assertEqual(self.notifier.get_messages(self.user), [])
+
+    def test_num_unread_round_trips(self):
+        exp_date = datetime.datetime.now() + datetime.timedelta(days=1)
+        for i in range(10):
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO, expired_at=exp_date)
+        self.notifier.num_unread(self.user)
+        pool = self.notifier.redis.connection_pool
+        with patch.object(pool, 'get_connection', wraps=pool.get_connection) as mock_get_connection:
+            self.assertEqual(self.notifier.num_unread(self.user), 10)
+            self.assertEqual(mock_get_connection.call_count, 1)
 
     def test_one_time_msg(self):
         msg_content = 'Test'
@@ -232,6 +1016,41 @@ class RedisBackendTestCase(TestCase):
         self.assertEqual(self.notifier.num_unread(self.user), 0)
         self.assertEqual(self.notifier.get_messages(self.user), [])
 
+    def test_send_many(self):
+        users = [self.user] + [User.objects.create(id=self.uid + i, username='testuser%d' % i) for i in range(1, 5)]
+        self.notifier._pipeline_size = 2
+        self.notifier.send_many(users, 'Test', level=WARNING, one_time=True)
+        for user in users:
+            self.assertEqual(self.notifier.num_unread(user), 1)
+            msg = self.notifier.get_messages(user)[0]
+            self.assertEqual(msg['content'], 'Test')
+            self.assertEqual(msg['level'], WARNING)
+            self.assertEqual(self.notifier.num_unread(user), 0)
+
+    async def test_async(self):
+        now = datetime.datetime.now()
+        async with self.notifier as connection:
+            await self.notifier.asend(self.user, 'Message 1', INFO)
+            await self.notifier.asend(self.user, 'Message 2', ERROR, expired_at=now - datetime.timedelta(days=1))
+            await self.notifier.asend(self.user, 'Message 3', WARNING, one_time=True)
+            await self.notifier.asend_many([self.user], 'Message 4', INFO)
+            self.assertEqual(await self.notifier.anum_unread(self.user), 3)
+            messages = await self.notifier.aget_messages(self.user)
+            self.assertEqual([msg['content'] for msg in messages], ['Message 1', 'Message 3', 'Message 4'])
+            self.assertEqual(await self.notifier.anum_unread(self.user), 2)
+            msg = await self.notifier.aget_last_and_read(self.user)
+            self.assertEqual(msg['content'], 'Message 4')
+            await self.notifier.amark_all_as_read(self.user)
+            self.assertEqual(await self.notifier.anum_unread(self.user), 0)
+            self.assertEqual(await self.notifier.aget_last_and_read(self.user), None)
+
+            await self.notifier.aglobal_send('Global 1', INFO)
+            self.assertEqual(await self.notifier.aglobal_num_unread(), 1)
+            messages = await self.notifier.aglobal_get_messages()
+            self.assertEqual(messages[0]['content'], 'Global 1')
+        self.assertEqual(self.notifier.num_unread(self.user), 0)
+        self.assertEqual(self.notifier.global_num_unread(), 1)
+
     def test_global_empty(self):
         self.assertEqual(self.notifier.global_num_unread(), 0)
         self.assertEqual(self.notifier.global_get_messages(), [])
@@ -263,14 +1082,913 @@ class RedisBackendTestCase(TestCase):
         self.assertEqual(self.notifier.global_num_unread(), 1)
 
     def test_global_expiration_date(self):
-        msg_content = 'Test'
         exp_date = datetime.datetime.now() - datetime.timedelta(days=1)
-        self.notifier.global_send(msg_content, level=INFO, expired_at=exp_date)
-        self.assertEqual(self.notifier.global_num_unread(), 1)
-        messages = self.notifier.global_get_messages()
-        self.assertTrue(len(messages) == 1)
-        msg = messages[0]
-        self.assertEqual(msg['content'], msg_content)
-        self.assertEqual(msg['expired_at'], exp_date)
+        self.notifier.global_send('Test', level=INFO, expired_at=exp_date)
         self.assertEqual(self.notifier.global_num_unread(), 0)
         self.assertEqual(self.notifier.global_get_messages(), [])
+
+    def test_pagination(self):
+        for i in range(7):
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO)
+        messages = self.notifier.get_messages(self.user, limit=3)
+        self.assertEqual([msg['content'] for msg in messages], ['Test0', 'Test1', 'Test2'])
+        messages = self.notifier.get_messages(self.user, limit=3, cursor=messages.cursor)
+        self.assertEqual([msg['content'] for msg in messages], ['Test3', 'Test4', 'Test5'])
+        messages = self.notifier.get_messages(self.user, limit=3, cursor=messages.cursor)
+        self.assertEqual([msg['content'] for msg in messages], ['Test6'])
+        self.assertEqual(messages.cursor, None)
+        self.assertEqual(self.notifier.num_unread(self.user), 7)
+        # The rest of the messages, without limit
+        messages = self.notifier.get_messages(self.user, limit=2)
+        messages = self.notifier.get_messages(self.user, cursor=messages.cursor)
+        self.assertEqual([msg['content'] for msg in messages], ['Test%d' % i for i in range(2, 7)])
+        self.assertEqual(messages.cursor, None)
+
+    def test_pagination_one_time_and_expired(self):
+        exp_date = datetime.datetime.now() - datetime.timedelta(days=1)
+        self.notifier.send(self.user, 'Test0', level=INFO, one_time=True)
+        self.notifier.send(self.user, 'Test1', level=INFO, expired_at=exp_date)
+        self.notifier.send(self.user, 'Test2', level=INFO, one_time=True)
+        self.notifier.send(self.user, 'Test3', level=INFO)
+        self.notifier.send(self.user, 'Test4', level=INFO)
+        messages = self.notifier.get_messages(self.user, limit=2)
+        self.assertEqual([msg['content'] for msg in messages], ['Test0', 'Test2'])
+        messages = self.notifier.get_messages(self.user, limit=2, cursor=messages.cursor)
+        self.assertEqual([msg['content'] for msg in messages], ['Test3', 'Test4'])
+        messages = self.notifier.get_messages(self.user)
+        self.assertEqual([msg['content'] for msg in messages], ['Test3', 'Test4'])
+
+    def test_min_level(self):
+        for i, level in enumerate([INFO, ERROR, INFO, WARNING, INFO, ERROR]):
+            self.notifier.send(self.user, 'Test%d' % i, level=level, one_time=True)
+        messages = self.notifier.get_messages(self.user, limit=2, min_level=ERROR)
+        self.assertEqual([msg['content'] for msg in messages], ['Test1', 'Test3'])
+        messages = self.notifier.get_messages(self.user, limit=2, cursor=messages.cursor, min_level=ERROR)
+        self.assertEqual([msg['content'] for msg in messages], ['Test5'])
+        self.assertEqual(messages.cursor, None)
+        messages = self.notifier.get_messages(self.user)
+        self.assertEqual([msg['content'] for msg in messages], ['Test0', 'Test2', 'Test4'])
+
+    def test_min_level_round_trips(self):
+        exp_date = datetime.datetime.now() - datetime.timedelta(days=1)
+        for i in range(6):
+            self.notifier.send(self.user, 'Expired%d' % i, level=ERROR, expired_at=exp_date)
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO)
+        self.notifier.send(self.user, 'Error', level=ERROR)
+        with patch.object(self.notifier.redis, 'evalsha', wraps=self.notifier.redis.evalsha) as mock_evalsha:
+            messages = self.notifier.get_messages(self.user, limit=2, min_level=ERROR)
+            self.assertEqual([msg['content'] for msg in messages], ['Error'])
+            self.assertEqual(messages.cursor, None)
+            # One script call per window, the expired messages are removed by the first one
+            self.assertEqual(mock_evalsha.call_count, 4)
+
+    async def test_async_pagination(self):
+        for i in range(5):
+            await self.notifier.asend(self.user, 'Test%d' % i, level=INFO)
+        messages = await self.notifier.aget_messages(self.user, limit=3)
+        self.assertEqual([msg['content'] for msg in messages], ['Test0', 'Test1', 'Test2'])
+        messages = await self.notifier.aget_messages(self.user, limit=3, cursor=messages.cursor, min_level=INFO)
+        self.assertEqual([msg['content'] for msg in messages], ['Test3', 'Test4'])
+        self.assertEqual(messages.cursor, None)
+        messages = await self.notifier.aget_messages(self.user, limit=2)
+        messages = await self.notifier.aget_messages(self.user, cursor=messages.cursor)
+        self.assertEqual([msg['content'] for msg in messages], ['Test2', 'Test3', 'Test4'])
+
+    def test_max_messages(self):
+        self.notifier._max_messages = 3
+        for i in range(5):
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO)
+        self.assertEqual(self.notifier.num_unread(self.user), 3)
+        messages = self.notifier.get_messages(self.user)
+        self.assertEqual([msg['content'] for msg in messages], ['Test2', 'Test3', 'Test4'])
+        self.notifier.send_many([self.user], 'Test5', level=INFO)
+        messages = self.notifier.get_messages(self.user)
+        self.assertEqual([msg['content'] for msg in messages], ['Test3', 'Test4', 'Test5'])
+
+    def _get_ttls(self):
+        return [self.notifier.redis.ttl(key) for key in self.notifier._get_all_keys(self.notifier._get_key(self.user))]
+
+    def test_key_ttl(self):
+        exp_date = datetime.datetime.now() + datetime.timedelta(seconds=100)
+        self.notifier.send(self.user, 'Test1', level=INFO, expired_at=exp_date)
+        self.assertTrue(all(90 < ttl <= 101 for ttl in self._get_ttls() if ttl != -2))
+        self.notifier.send(self.user, 'Test2', level=INFO, expired_at=exp_date - datetime.timedelta(seconds=50))
+        self.assertTrue(all(90 < ttl <= 101 for ttl in self._get_ttls() if ttl != -2))
+        self.notifier.send(self.user, 'Test3', level=INFO)
+        self.assertTrue(all(ttl in (-1, -2) for ttl in self._get_ttls()))
+        self.assertEqual(self.notifier.num_unread(self.user), 3)
+
+    def test_retention(self):
+        self.notifier._retention = 1000
+        self.notifier.send(self.user, 'Test1', level=INFO)
+        ttls = [ttl for ttl in self._get_ttls() if ttl != -2]
+        self.assertTrue(ttls)
+        self.assertTrue(all(990 < ttl <= 1000 for ttl in ttls))
+        self.notifier.send(self.user, 'Test2', level=INFO, expired_at=datetime.datetime.now() - datetime.timedelta(days=1))
+        self.assertTrue(all(990 < ttl <= 1000 for ttl in self._get_ttls() if ttl != -2))
+        self.assertEqual(self.notifier.num_unread(self.user), 1)
+
+    def test_key_namespace(self):
+        self.notifier._retention = 1000
+        self.notifier.send(self.user, 'Test1', level=INFO, one_time=True)
+        self.notifier.send(self.user, 'Test2', level=INFO, expired_at=datetime.datetime.now() + datetime.timedelta(days=1))
+        self.notifier.global_send('Global', level=INFO)
+        self.notifier.global_get_messages(self.user)
+        keys = [key.decode() for key in self.notifier.redis.keys('*')]
+        self.assertTrue(all(key.startswith('memnotify:{') for key in keys))
+        user_key = self.notifier._get_key(self.user)
+        user_slots = set(key_slot(key.encode()) for key in keys if key.startswith(user_key))
+        self.assertEqual(user_slots, set([key_slot(user_key.encode())]))
+        global_slots = set(key_slot(key.encode()) for key in keys if key.startswith('memnotify:{GLOBAL_MSG}'))
+        self.assertEqual(len(global_slots), 1)
+
+    def test_publish(self):
+        pubsub = self.notifier.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.notifier._get_channel(self.notifier._get_key(self.user)))
+        self.notifier.send(self.user, 'Test', level=INFO)
+        message = None
+        for i in range(20):
+            message = pubsub.get_message(timeout=0.1)
+            if message is not None:
+                break
+        pubsub.close()
+        self.assertEqual(self.notifier._decodify(message['data'])['content'], 'Test')
+
+    async def test_alisten(self):
+        listener = self.notifier.alisten(self.user, timeout=0.1)
+        self.assertEqual(await listener.__anext__(), None)
+        await self.notifier.asend(self.user, 'Test', level=INFO)
+        event, msg = await listener.__anext__()
+        self.assertEqual((event, msg['content']), ('message', 'Test'))
+        await self.notifier.aglobal_send('Global', level=INFO)
+        event, msg = await listener.__anext__()
+        self.assertEqual((event, msg['content']), ('global', 'Global'))
+        await listener.aclose()
+        self.assertEqual(self.notifier._get_subscriptions()._queues, {})
+
+    def test_global_read_marker(self):
+        other = User.objects.create(id=self.uid + 1, username='otheruser')
+        self.notifier.global_send('Global 1', level=INFO)
+        self.notifier.global_send('Global 2', level=INFO)
+        self.assertEqual(self.notifier.global_num_unread(self.user), 2)
+        messages = self.notifier.global_get_messages(self.user)
+        self.assertEqual([msg['content'] for msg in messages], ['Global 1', 'Global 2'])
+        self.assertEqual(self.notifier.global_num_unread(self.user), 0)
+        self.assertEqual(self.notifier.global_get_messages(self.user), [])
+        self.assertEqual(self.notifier.global_num_unread(other), 2)
+        self.assertEqual(self.notifier.global_num_unread(), 2)
+
+        exp_date = datetime.datetime.now() - datetime.timedelta(days=1)
+        self.notifier.global_send('Global 3', level=INFO)
+        self.notifier.global_send('Global 4', level=INFO, expired_at=exp_date)
+        self.assertEqual(self.notifier.global_num_unread(self.user), 1)
+        messages = self.notifier.global_get_messages(self.user)
+        self.assertEqual([msg['content'] for msg in messages], ['Global 3'])
+        self.assertEqual(self.notifier.global_num_unread(other), 3)
+        self.assertEqual(len(self.notifier.global_get_messages()), 3)
+
+    def test_publish_disabled(self):
+        notifier = self.notifier.__class__(redis_db=1, publish=False)
+        notifier.open()
+        pubsub = notifier.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe('*:changes')
+        pubsub.get_message(timeout=1)
+        notifier.send(self.user, 'Test', level=INFO)
+        notifier.global_send('Global', level=INFO)
+        async_to_sync(notifier.aglobal_send)('Global', level=INFO)
+        self.assertEqual(pubsub.get_message(timeout=0.1), None)
+        pubsub.close()
+        self.assertEqual(notifier.global_num_unread(self.user), 2)
+
+    def test_migrate_global_list(self):
+        exp_date = datetime.datetime.now() - datetime.timedelta(days=1)
+        msgs = [
+            self.notifier._generate_msg('Global 1', INFO, None, None),
+            self.notifier._generate_msg('Global 2', INFO, None, exp_date),
+        ]
+        for msg in msgs:
+            self.notifier.redis.rpush(self.notifier._global_key, pickle.dumps(msg))
+        pubsub = self.notifier.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe('*:changes')
+        pubsub.get_message(timeout=1)
+        self.assertEqual(self.notifier.migrate_global_list(), 2)
+        self.assertEqual(pubsub.get_message(timeout=0.1), None)
+        pubsub.close()
+        self.assertFalse(self.notifier.redis.exists(self.notifier._global_key))
+        # Stored with the configured serializer
+        self.assertEqual(self.notifier.redis.hvals(self.notifier._get_global_keys()[0]), [self.notifier._codify(msgs[0])])
+        messages = self.notifier.global_get_messages(self.user)
+        self.assertEqual([msg['content'] for msg in messages], ['Global 1'])
+
+    def test_migrate_legacy_keys(self):
+        other_user = User.objects.create(id=self.uid + 1, username='testuser1')
+        now = datetime.datetime.now()
+        # Messages as stored by the first versions, in lists named after the
+        # user ids
+        for user, content, expired_at, one_time in [
+            (self.user, 'Test1', None, False),
+            (self.user, 'Test2', now - datetime.timedelta(days=1), False),
+            (self.user, 'Test3', now + datetime.timedelta(days=1), True),
+            (other_user, 'Test4', None, False),
+        ]:
+            msg = {'content': content, 'level': INFO, 'created_at': now, 'sender': None, 'expired_at': expired_at}
+            if one_time:
+                msg['one_time'] = True
+            self.notifier.redis.rpush(user.id, pickle.dumps(msg))
+        self.notifier.redis.set('12345', 'not a list')
+        self.notifier.redis.rpush('123abc', 'other list')
+        self.assertEqual(self.notifier.migrate_legacy_keys(batch_size=2), 4)
+        self.assertFalse(self.notifier.redis.exists(str(self.uid), str(self.uid + 1)))
+        self.assertEqual(self.notifier.redis.llen('123abc'), 1)
+        self.assertEqual(self.notifier.num_unread(self.user), 2)
+        messages = self.notifier.get_messages(self.user)
+        self.assertEqual([msg['content'] for msg in messages], ['Test1', 'Test3'])
+        self.assertEqual(self.notifier.num_unread(self.user), 1)
+        self.assertEqual([msg['content'] for msg in self.notifier.get_messages(other_user)], ['Test4'])
+        self.notifier.redis.rpush(self.uid, pickle.dumps(msg))
+        self.assertEqual(self.notifier.migrate_legacy_keys(users=[self.user]), 1)
+        self.assertEqual(self.notifier.num_unread(self.user), 2)
+
+    def test_sweep_round_trips(self):
+        exp_date = datetime.datetime.now() - datetime.timedelta(days=1)
+        # Loads the scripts in the server before counting round trips
+        self.notifier.send(self.user, 'Test', level=INFO, expired_at=exp_date)
+        self.notifier.get_messages(self.user)
+        # A message that never expires keeps the expired ones in the server
+        self.notifier.send(self.user, 'Test', level=INFO)
+        for i in range(50):
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO, expired_at=exp_date)
+        pool = self.notifier.redis.connection_pool
+        with patch.object(pool, 'get_connection', wraps=pool.get_connection) as mock_get_connection:
+            messages = self.notifier.get_messages(self.user)
+            self.assertEqual(len(messages), 1)
+            self.assertEqual(mock_get_connection.call_count, 1)
+        self.assertEqual(self.notifier.num_unread(self.user), 1)
+        self.assertEqual(self.notifier.redis.zcard(self.notifier._get_all_keys(self.notifier._get_key(self.user))[2]), 0)
+
+    def test_tracked_messages(self):
+        self.notifier._max_messages = 2
+        exp_date = datetime.datetime.now() + datetime.timedelta(days=1)
+        keys = self.notifier._get_all_keys(self.notifier._get_key(self.user))
+        self.notifier.send(self.user, 'Test1', level=INFO, expired_at=exp_date, one_time=True)
+        self.notifier.send(self.user, 'Test2', level=INFO, one_time=True)
+        self.notifier.send(self.user, 'Test3', level=INFO, expired_at=exp_date)
+        # The messages trimmed are not tracked anymore
+        self.assertEqual(self.notifier.redis.zcard(keys[2]), 1)
+        self.assertEqual(self.notifier.redis.scard(keys[3]), 1)
+        self.assertEqual([msg['content'] for msg in self.notifier.get_messages(self.user)], ['Test2', 'Test3'])
+        self.assertEqual(self.notifier.redis.scard(keys[3]), 0)
+        with patch('memnotify.backends.redis_backend.time.time', return_value=time.time() + 2 * 86400):
+            self.assertEqual(self.notifier.get_messages(self.user), [])
+        self.assertEqual(self.notifier.redis.exists(*keys), 0)
+
+
+class RedisSortedSetBackendTestCase(RedisBackendTestCase):
+    def setUp(self):
+        self.notifier = redis_backend.RedisSortedSetBackend(redis_db=1)
+        self.notifier.open()
+        self.uid = random.randint(1, 999999999)
+        self.user = User.objects.create(id=self.uid, username='testuser')
+
+    def test_order_of_previous_versions(self):
+        for i in range(5):
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO)
+        # Sets stored before the order of the ids was kept
+        self.notifier.redis.delete(self.notifier._get_subkeys(self.notifier._get_key(self.user))[5])
+        messages = self.notifier.get_messages(self.user, limit=2)
+        self.assertEqual([msg['content'] for msg in messages], ['Test0', 'Test1'])
+        messages = self.notifier.get_messages(self.user, limit=2, cursor=messages.cursor)
+        self.assertEqual([msg['content'] for msg in messages], ['Test2', 'Test3'])
+        self.assertEqual(self.notifier.get_last_and_read(self.user)['content'], 'Test4')
+        self.assertEqual([msg['content'] for msg in self.notifier.get_and_read(self.user, 1)], ['Test0'])
+
+    def test_sweep_round_trips(self):
+        exp_date = datetime.datetime.now() - datetime.timedelta(days=1)
+        # Loads the scripts in the server before counting round trips
+        self.notifier.send(self.user, 'Test', level=INFO, expired_at=exp_date)
+        self.notifier.get_messages(self.user)
+        # A message that never expires keeps the expired ones in the server
+        self.notifier.send(self.user, 'Test', level=INFO)
+        for i in range(50):
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO, expired_at=exp_date)
+        pool = self.notifier.redis.connection_pool
+        with patch.object(pool, 'get_connection', wraps=pool.get_connection) as mock_get_connection:
+            messages = self.notifier.get_messages(self.user)
+            self.assertEqual(len(messages), 1)
+            self.assertEqual(mock_get_connection.call_count, 1)
+        self.assertEqual(self.notifier.num_unread(self.user), 1)
+
+    @unittest.skip('the sorted set layout does not use lists')
+    def test_tracked_messages(self):
+        pass
+
+    def test_message_order(self):
+        for i in range(12):
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO)
+        messages = self.notifier.get_messages(self.user)
+        self.assertEqual([msg['content'] for msg in messages], ['Test%d' % i for i in range(12)])
+
+    def test_migrate_list(self):
+        list_notifier = redis_backend.RedisBackend(redis_db=1)
+        list_notifier.open()
+        exp_date = datetime.datetime.now() - datetime.timedelta(days=1)
+        list_notifier.send(self.user, 'Test1', level=INFO)
+        list_notifier.send(self.user, 'Test2', level=INFO, one_time=True)
+        list_notifier.send(self.user, 'Test3', level=INFO, expired_at=exp_date)
+        pubsub = self.notifier.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe('*:changes')
+        pubsub.get_message(timeout=1)
+        self.assertEqual(self.notifier.migrate_list(self.user), 3)
+        self.assertEqual(self.notifier.redis.exists(*list_notifier._get_all_keys(list_notifier._get_key(self.user))[2:]), 0)
+        self.assertEqual(pubsub.get_message(timeout=0.1), None)
+        pubsub.close()
+        self.assertEqual(list_notifier.num_unread(self.user), 0)
+        self.assertEqual(self.notifier.num_unread(self.user), 2)
+        subkeys = self.notifier._get_subkeys(self.notifier._get_key(self.user))
+        self.assertEqual(self.notifier.redis.hlen(subkeys[1]), 2)
+        messages = self.notifier.get_messages(self.user)
+        self.assertEqual([msg['content'] for msg in messages], ['Test1', 'Test2'])
+        self.assertEqual(self.notifier.num_unread(self.user), 1)
+        # The migrated messages never expire, so the keys are kept forever
+        self.notifier.send(self.user, 'Test4', level=INFO, expired_at=datetime.datetime.now() + datetime.timedelta(seconds=30))
+        self.assertEqual(self.notifier.redis.ttl(subkeys[0]), -1)
+        self.assertEqual(self.notifier.redis.hkeys(subkeys[4]), [b'deadline'])
+
+
+class RedisBackendJSONSerializerTestCase(RedisBackendTestCase):
+    def setUp(self):
+        self.notifier = redis_backend.RedisBackend(redis_db=1, serializer='memnotify.serializers.JSONSerializer')
+        self.notifier.open()
+        self.uid = random.randint(1, 999999999)
+        self.user = User.objects.create(id=self.uid, username='testuser')
+
+
+@unittest.skipUnless(os.environ.get('MEMNOTIFY_TEST_REDIS_CLUSTER_NODES'), 'requires a Redis Cluster')
+class RedisClusterBackendTestCase(RedisBackendTestCase):
+    """
+    Runs the Redis backend tests against a local Redis Cluster, for example the
+    one started by utils/create-cluster in the Redis sources:
+
+        MEMNOTIFY_TEST_REDIS_CLUSTER_NODES=127.0.0.1:30001,127.0.0.1:30002 python manage.py test memnotify
+    """
+    def setUp(self):
+        nodes = os.environ['MEMNOTIFY_TEST_REDIS_CLUSTER_NODES'].split(',')
+        self.notifier = redis_backend.RedisBackend(redis_cluster_nodes=nodes)
+        self.notifier.open()
+        self.uid = random.randint(1, 999999999)
+        self.user = User.objects.create(id=self.uid, username='testuser')
+
+    @unittest.skip('cluster clients have a connection pool per node')
+    def test_num_unread_round_trips(self):
+        pass
+
+    @unittest.skip('cluster clients have a connection pool per node')
+    def test_sweep_round_trips(self):
+        pass
+
+    def test_send_many_nodes(self):
+        users = [User(id=self.uid + i) for i in range(200)]
+        self.notifier.send_many(users, 'Test', level=INFO)
+        slots = set(self.notifier.redis.keyslot(self.notifier._get_key(user)) for user in users)
+        self.assertTrue(len(slots) > 1)
+        self.assertEqual([self.notifier.num_unread(user) for user in users], [1] * len(users))
+
+
+@unittest.skipUnless(os.environ.get('MEMNOTIFY_TEST_REDIS_SENTINELS'), 'requires Redis Sentinel')
+class RedisSentinelBackendTestCase(RedisBackendTestCase):
+    """
+    Runs the Redis backend tests against the master of a local Sentinel
+    service (MEMNOTIFY_TEST_REDIS_SENTINEL_SERVICE, mymaster by default):
+
+        MEMNOTIFY_TEST_REDIS_SENTINELS=127.0.0.1:26379 python manage.py test memnotify
+    """
+    def setUp(self):
+        self.notifier = redis_backend.RedisBackend(
+            redis_db=1,
+            redis_sentinels=os.environ['MEMNOTIFY_TEST_REDIS_SENTINELS'].split(','),
+            redis_sentinel_service=os.environ.get('MEMNOTIFY_TEST_REDIS_SENTINEL_SERVICE', 'mymaster'),
+        )
+        self.notifier.open()
+        self.uid = random.randint(1, 999999999)
+        self.user = User.objects.create(id=self.uid, username='testuser')
+
+
+class LocMemBackendTestCase(TestCase):
+    def setUp(self):
+        self.notifier = locmem.LocMemBackend()
+        self.user = User.objects.create(id=1, username='testuser')
+        self.other_user = User.objects.create(id=2, username='otheruser')
+
+    def test_send_and_get(self):
+        self.assertEqual(self.notifier.get_messages(self.user), [])
+        exp_date = datetime.datetime.now() + datetime.timedelta(days=1)
+        self.notifier.send(self.user, 'Test1', level=ERROR, sender=self.other_user, expired_at=exp_date)
+        self.notifier.send(self.user, 'Test2', level=INFO)
+        self.assertEqual(self.notifier.num_unread(self.user), 2)
+        self.assertEqual(self.notifier.num_unread(self.other_user), 0)
+        messages = self.notifier.get_messages(self.user)
+        self.assertEqual([msg['content'] for msg in messages], ['Test1', 'Test2'])
+        self.assertEqual(messages[0]['level'], ERROR)
+        self.assertEqual(messages[0]['sender'], self.other_user)
+        self.assertEqual(messages[0]['expired_at'], exp_date)
+        self.assertEqual(self.notifier.num_unread(self.user), 2)
+
+    def test_get_last_and_read(self):
+        self.assertEqual(self.notifier.get_last_and_read(self.user), None)
+        self.notifier.send(self.user, 'Test1', level=INFO)
+        self.notifier.send(self.user, 'Test2', level=INFO)
+        self.assertEqual(self.notifier.get_last_and_read(self.user)['content'], 'Test2')
+        self.assertEqual(self.notifier.num_unread(self.user), 1)
+        self.notifier.mark_all_as_read(self.user)
+        self.assertEqual(self.notifier.num_unread(self.user), 0)
+        self.assertEqual(self.notifier.get_last_and_read(self.user), None)
+
+    def test_get_and_read(self):
+        self.notifier.send(self.user, 'Test1', level=INFO, expired_at=datetime.datetime.now() - datetime.timedelta(days=1))
+        for i in range(2, 5):
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO)
+        self.assertEqual([msg['content'] for msg in self.notifier.get_and_read(self.user, 2)], ['Test2', 'Test3'])
+        self.assertEqual([msg['content'] for msg in self.notifier.get_and_read(self.user)], ['Test4'])
+        self.assertEqual(self.notifier.num_unread(self.user), 0)
+
+    def test_many(self):
+        self.notifier.send_many([self.user, self.other_user], 'Test1', level=INFO)
+        self.notifier.send(self.user, 'Test2', level=INFO, one_time=True)
+        self.assertEqual(self.notifier.num_unread_many([self.user, self.other_user]), {1: 2, 2: 1})
+        messages = self.notifier.get_messages_many([self.user, self.other_user], limit=1)
+        self.assertEqual([msg['content'] for msg in messages[1]], ['Test1'])
+        self.assertEqual(messages[1].cursor, 1)
+        messages = self.notifier.get_messages_many([self.user, self.other_user])
+        self.assertEqual([msg['content'] for msg in messages[1]], ['Test1', 'Test2'])
+        self.assertEqual(self.notifier.num_unread(self.user), 1)
+
+    def test_expiration(self):
+        now = datetime.datetime.now()
+        self.notifier.send(self.user, 'Test1', level=INFO, expired_at=now - datetime.timedelta(days=1))
+        self.notifier.send(self.user, 'Test2', level=INFO, expired_at=now + datetime.timedelta(seconds=10))
+        self.notifier.send(self.user, 'Test3', level=INFO)
+        self.assertEqual(self.notifier.num_unread(self.user), 2)
+        with patch('memnotify.backends.locmem.time.time', return_value=time.time() + 11):
+            self.assertEqual(self.notifier.num_unread(self.user), 1)
+            messages = self.notifier.get_messages(self.user)
+        self.assertEqual([msg['content'] for msg in messages], ['Test3'])
+        self.assertEqual(self.notifier._expirations, [])
+
+    def test_one_time_msg(self):
+        self.notifier.send(self.user, 'Test1', level=INFO, one_time=True)
+        self.notifier.send(self.user, 'Test2', level=INFO)
+        self.assertEqual(len(self.notifier.get_messages(self.user)), 2)
+        self.assertEqual([msg['content'] for msg in self.notifier.get_messages(self.user)], ['Test2'])
+
+    def test_pagination(self):
+        for i in range(5):
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO if i % 2 else ERROR, one_time=i == 1)
+        page = self.notifier.get_messages(self.user, limit=2)
+        self.assertEqual([msg['content'] for msg in page], ['Test0', 'Test1'])
+        page = self.notifier.get_messages(self.user, limit=2, cursor=page.cursor)
+        self.assertEqual([msg['content'] for msg in page], ['Test2', 'Test3'])
+        page = self.notifier.get_messages(self.user, limit=2, cursor=page.cursor)
+        self.assertEqual([msg['content'] for msg in page], ['Test4'])
+        self.assertEqual(page.cursor, None)
+        messages = self.notifier.get_messages(self.user, min_level=ERROR)
+        self.assertEqual([msg['content'] for msg in messages], ['Test0', 'Test2', 'Test4'])
+        self.assertEqual(self.notifier.num_unread(self.user), 4)
+
+    def test_send_many(self):
+        self.notifier.send_many([self.user, self.other_user], 'Test', level=WARNING, one_time=True)
+        for user in (self.user, self.other_user):
+            self.assertEqual(self.notifier.get_messages(user)[0]['content'], 'Test')
+            self.assertEqual(self.notifier.num_unread(user), 0)
+
+    def test_global_messages(self):
+        self.notifier.global_send('Global1', INFO)
+        self.notifier.global_send('Global2', INFO, expired_at=datetime.datetime.now() - datetime.timedelta(days=1))
+        self.assertEqual(self.notifier.global_num_unread(), 1)
+        self.assertEqual(self.notifier.global_num_unread(self.user), 1)
+        self.assertEqual([msg['content'] for msg in self.notifier.global_get_messages(self.user)], ['Global1'])
+        self.assertEqual(self.notifier.global_num_unread(self.user), 0)
+        self.assertEqual(self.notifier.global_get_messages(self.user), [])
+        self.notifier.global_send('Global3', INFO)
+        self.assertEqual(self.notifier.global_num_unread(self.user), 1)
+        self.assertEqual(self.notifier.global_num_unread(self.other_user), 2)
+        self.assertEqual(len(self.notifier.global_get_messages()), 2)
+
+    def test_max_messages(self):
+        notifier = locmem.LocMemBackend(max_messages=2, max_entries=3)
+        for i in range(3):
+            notifier.send(self.user, 'Test%d' % i, level=INFO)
+        self.assertEqual([msg['content'] for msg in notifier.get_messages(self.user)], ['Test1', 'Test2'])
+        notifier.send(self.other_user, 'Other1', level=INFO)
+        notifier.send(self.other_user, 'Other2', level=INFO)
+        self.assertEqual([msg['content'] for msg in notifier.get_messages(self.user)], ['Test2'])
+        self.assertEqual(notifier.num_unread(self.other_user), 2)
+        self.assertEqual(len(notifier._messages), 3)
+        self.assertRaises(ImproperlyConfigured, locmem.LocMemBackend, max_messages=0)
+
+    def test_compaction(self):
+        notifier = locmem.LocMemBackend(max_entries=10)
+        expired_at = datetime.datetime.now() + datetime.timedelta(days=1)
+        for i in range(1000):
+            notifier.send(self.user, 'Test%d' % i, level=INFO, expired_at=expired_at)
+        self.assertEqual(len(notifier._messages), 10)
+        self.assertLessEqual(len(notifier._expirations), 2 * 10 + 16)
+        for i in range(1000):
+            notifier.global_get_messages(Mock(pk=i))
+        self.assertEqual(notifier._global_seen, {})
+        notifier.global_send('Global', INFO)
+        for i in range(1000):
+            notifier.global_get_messages(Mock(pk=i))
+        self.assertEqual(len(notifier._global_seen), 1000)
+        for i in range(20):
+            notifier.send(self.user, 'Test', level=INFO)
+        self.assertEqual(notifier._global_seen, {})
+        notifier.global_send('Global', INFO)
+        notifier.global_get_messages(self.other_user)
+        self.assertEqual(list(notifier._global_seen), [self.other_user.pk])
+        self.assertEqual(notifier.global_num_unread(self.user), 1)
+
+    def test_threads(self):
+        def send():
+            for i in range(200):
+                self.notifier.send(self.user, 'Test', level=INFO, one_time=True)
+        threads = [threading.Thread(target=send) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        read = 0
+        while any(thread.is_alive() for thread in threads):
+            read += len(self.notifier.get_messages(self.user))
+        for thread in threads:
+            thread.join()
+        read += len(self.notifier.get_messages(self.user))
+        self.assertEqual(read, 800)
+        self.assertEqual(self.notifier.num_unread(self.user), 0)
+
+    async def test_async(self):
+        async with self.notifier as connection:
+            await self.notifier.asend(self.user, 'Test1', INFO)
+            await self.notifier.asend_many([self.user], 'Test2', INFO, one_time=True)
+            await self.notifier.aglobal_send('Global', INFO)
+            self.assertEqual(await self.notifier.anum_unread(self.user), 2)
+            self.assertEqual(len(await self.notifier.aget_messages(self.user)), 2)
+            self.assertEqual((await self.notifier.aget_last_and_read(self.user))['content'], 'Test1')
+            self.assertEqual(await self.notifier.aglobal_num_unread(self.user), 1)
+            self.assertEqual(len(await self.notifier.aglobal_get_messages(self.user)), 1)
+            await self.notifier.amark_all_as_read(self.user)
+            self.assertEqual(await self.notifier.anum_unread(self.user), 0)
+
+
+class SharedMemoryBackendTestCase(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'memnotify.shm')
+        self.notifier = shared_memory.SharedMemoryBackend(path=self.path, users=16, user_slots=4, global_slots=2)
+        self.notifier.open()
+        self.user = User.objects.create(id=1, username='testuser')
+        self.other_user = User.objects.create(id=2, username='otheruser')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_send_and_get(self):
+        self.assertEqual(self.notifier.get_messages(self.user), [])
+        self.assertEqual(self.notifier.get_last_and_read(self.user), None)
+        now = datetime.datetime.now()
+        self.notifier.send(self.user, 'Test1', level=ERROR, sender=self.other_user, expired_at=now + datetime.timedelta(days=1))
+        self.notifier.send(self.user, 'Test2', level=INFO, expired_at=now - datetime.timedelta(days=1))
+        self.notifier.send(self.user, 'Test3', level=INFO, one_time=True)
+        self.notifier.send(self.user, 'Test4', level=INFO)
+        self.assertEqual(self.notifier.num_unread(self.user), 3)
+        self.assertEqual(self.notifier.num_unread(self.other_user), 0)
+        messages = self.notifier.get_messages(self.user)
+        self.assertEqual([msg['content'] for msg in messages], ['Test1', 'Test3', 'Test4'])
+        self.assertEqual(messages[0]['sender'], self.other_user)
+        self.assertEqual(messages[0]['expired_at'], now + datetime.timedelta(days=1))
+        self.assertEqual(self.notifier.num_unread(self.user), 2)
+        self.assertEqual(self.notifier.get_last_and_read(self.user)['content'], 'Test4')
+        self.notifier.mark_all_as_read(self.user)
+        self.assertEqual(self.notifier.num_unread(self.user), 0)
+
+    def test_get_and_read(self):
+        for i in range(3):
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO)
+        self.assertEqual([msg['content'] for msg in self.notifier.get_and_read(self.user, 2)], ['Test0', 'Test1'])
+        self.assertEqual([msg['content'] for msg in self.notifier.get_and_read(self.user)], ['Test2'])
+        self.assertEqual(self.notifier.get_and_read(self.user), [])
+
+    def test_pagination(self):
+        for i in range(4):
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO if i % 2 else ERROR)
+        page = self.notifier.get_messages(self.user, limit=3)
+        self.assertEqual([msg['content'] for msg in page], ['Test0', 'Test1', 'Test2'])
+        page = self.notifier.get_messages(self.user, limit=3, cursor=page.cursor)
+        self.assertEqual([msg['content'] for msg in page], ['Test3'])
+        self.assertEqual(page.cursor, None)
+        messages = self.notifier.get_messages(self.user, min_level=ERROR)
+        self.assertEqual([msg['content'] for msg in messages], ['Test0', 'Test2'])
+
+    def test_full_slots(self):
+        self.notifier.send_many([self.user, self.other_user], 'Test0', level=INFO)
+        for i in range(1, 6):
+            self.notifier.send(self.user, 'Test%d' % i, level=INFO)
+        self.assertEqual([msg['content'] for msg in self.notifier.get_messages(self.user)], ['Test2', 'Test3', 'Test4', 'Test5'])
+        self.assertEqual(self.notifier.num_unread(self.other_user), 1)
+        with self.assertRaises(ValueError):
+            self.notifier.send(self.user, 'x' * 2000, level=INFO)
+
+    def test_full_buckets(self):
+        notifier = shared_memory.SharedMemoryBackend(path=os.path.join(self.tmpdir, 'small.shm'), users=2, user_slots=2, global_slots=2)
+        third_user = User.objects.create(id=3, username='thirduser')
+        notifier.send(self.user, 'Test1', level=INFO)
+        notifier.send(self.other_user, 'Test2', level=INFO)
+        notifier.send(self.user, 'Test3', level=INFO)
+        notifier.send(third_user, 'Test4', level=INFO)
+        self.assertEqual(notifier.num_unread(self.user), 2)
+        self.assertEqual(notifier.num_unread(self.other_user), 0)
+        self.assertEqual(notifier.num_unread(third_user), 1)
+
+    def test_global_seen_full_buckets(self):
+        notifier = shared_memory.SharedMemoryBackend(path=os.path.join(self.tmpdir, 'small.shm'), users=2, user_slots=2, global_slots=2)
+        third_user = User.objects.create(id=3, username='thirduser')
+        notifier.send(self.user, 'Test1', level=INFO)
+        notifier.send(self.other_user, 'Test2', level=INFO)
+        notifier.global_send('Global1', INFO)
+        self.assertEqual(len(notifier.global_get_messages(third_user)), 1)
+        self.assertEqual(notifier.num_unread(self.user), 1)
+        self.assertEqual(notifier.num_unread(self.other_user), 1)
+        self.assertEqual(notifier.global_num_unread(third_user), 1)
+
+    def test_global_messages(self):
+        self.notifier.global_send('Global1', INFO)
+        self.notifier.global_send('Global2', INFO, expired_at=datetime.datetime.now() - datetime.timedelta(days=1))
+        self.assertEqual(self.notifier.global_num_unread(self.user), 1)
+        self.assertEqual([msg['content'] for msg in self.notifier.global_get_messages(self.user)], ['Global1'])
+        self.assertEqual(self.notifier.global_num_unread(self.user), 0)
+        self.notifier.global_send('Global3', INFO)
+        self.assertEqual(self.notifier.global_num_unread(self.user), 1)
+        self.assertEqual(self.notifier.global_num_unread(self.other_user), 2)
+        self.assertEqual(len(self.notifier.global_get_messages()), 2)
+
+    def test_layout(self):
+        with self.assertRaises(ImproperlyConfigured):
+            shared_memory.SharedMemoryBackend(path=self.path, users=32, user_slots=4, global_slots=2).open()
+
+    def test_processes(self):
+        pids = []
+        for i in range(4):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    for j in range(50):
+                        self.notifier.send(self.other_user if j % 2 else self.user, 'Test', level=INFO, one_time=True)
+                        self.notifier.get_messages(self.other_user)
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        self.assertEqual(self.notifier.num_unread(self.user), 4)
+        self.assertEqual(self.notifier.num_unread(self.other_user), 0)
+        notifier = shared_memory.SharedMemoryBackend(path=self.path, users=16, user_slots=4, global_slots=2)
+        self.assertEqual(notifier.num_unread(self.user), 4)
+        header = shared_memory._HEADER.unpack_from(notifier._map, 0)
+        self.assertEqual(header[5], 200)
+
+
+class CachedBackendTestCase(TestCase):
+    def setUp(self):
+        self.notifier = cached.CachedBackend(backend='memnotify.backends.dummy.DummyBackend', timeout=60)
+        self.backend = self.notifier.backend
+        self.messages = [{'content': 'Global', 'expired_at': None}]
+        self.backend.global_get_messages = Mock(return_value=self.messages)
+        self.backend.global_num_unread = Mock(return_value=1)
+        self.backend.global_send = Mock()
+        self.user = Mock(pk=1)
+
+    def test_read_through(self):
+        with self.notifier as connection:
+            for i in range(3):
+                self.assertEqual(self.notifier.global_get_messages(), self.messages)
+                self.assertEqual(self.notifier.global_num_unread(), 1)
+                self.assertEqual(self.notifier.global_num_unread(self.user), 1)
+        self.assertEqual(self.backend.global_get_messages.call_count, 1)
+        self.assertEqual(self.backend.global_num_unread.call_count, 2)
+        self.assertFalse(self.notifier._subscribe)
+
+    def test_global_send_invalidates(self):
+        self.notifier.global_get_messages()
+        self.notifier.global_send('Global 2', INFO)
+        self.backend.global_send.assert_called_with('Global 2', INFO, None, None)
+        self.notifier.global_get_messages()
+        self.assertEqual(self.backend.global_get_messages.call_count, 2)
+
+    def test_user_read_invalidates(self):
+        self.notifier.global_num_unread(self.user)
+        self.notifier.global_get_messages(self.user)
+        self.backend.global_get_messages.assert_called_with(self.user)
+        self.notifier.global_num_unread(self.user)
+        self.assertEqual(self.backend.global_num_unread.call_count, 2)
+
+    def test_timeout(self):
+        self.notifier.global_num_unread()
+        with patch('memnotify.backends.cached.time.time', return_value=time.time() + 61):
+            self.notifier.global_num_unread()
+        self.assertEqual(self.backend.global_num_unread.call_count, 2)
+
+    def test_message_expiration(self):
+        self.messages.append({'content': 'Global 2', 'expired_at': datetime.datetime.now() + datetime.timedelta(seconds=10)})
+        self.notifier.global_get_messages()
+        with patch('memnotify.backends.cached.time.time', return_value=time.time() + 11):
+            self.notifier.global_get_messages()
+        self.assertEqual(self.backend.global_get_messages.call_count, 2)
+
+    def test_count_expiration(self):
+        self.messages.append({'content': 'Global 2', 'expired_at': datetime.datetime.now() + datetime.timedelta(seconds=10)})
+        self.notifier.global_num_unread(self.user)
+        with patch('memnotify.backends.cached.time.time', return_value=time.time() + 11):
+            self.notifier.global_num_unread(self.user)
+        self.assertEqual(self.backend.global_num_unread.call_count, 2)
+
+    def test_discard_while_reading(self):
+        def global_num_unread(user=None):
+            # Another process marks the messages as read meanwhile
+            self.notifier._discard_user(str(user.pk))
+            return 1
+        self.backend.global_num_unread = Mock(side_effect=global_num_unread)
+        self.notifier.global_num_unread(self.user)
+        self.notifier.global_num_unread(self.user)
+        self.assertEqual(self.backend.global_num_unread.call_count, 2)
+        self.notifier._max_entries = 1
+        self.notifier._discard_user('2')
+        self.notifier._discard_user('3')
+        self.notifier.global_num_unread(self.user)
+        self.assertEqual(len(self.notifier._discarded), 1)
+
+    def test_lru(self):
+        self.notifier._max_entries = 2
+        users = [Mock(pk=i) for i in range(3)]
+        for user in users:
+            self.notifier.global_num_unread(user)
+        self.notifier.global_num_unread(users[2])
+        self.assertEqual(self.backend.global_num_unread.call_count, 3)
+        self.notifier.global_num_unread(users[0])
+        self.assertEqual(self.backend.global_num_unread.call_count, 4)
+
+    async def test_async(self):
+        async def global_num_unread(user=None):
+            return 3
+        self.backend.aglobal_num_unread = Mock(side_effect=global_num_unread)
+        async with self.notifier as connection:
+            self.assertEqual(await self.notifier.aglobal_num_unread(), 3)
+            self.assertEqual(await self.notifier.aglobal_num_unread(), 3)
+            self.assertEqual(await self.notifier.aglobal_get_messages(), self.messages)
+        self.assertEqual(self.backend.aglobal_num_unread.call_count, 1)
+
+    def test_redis_subscription(self):
+        options = {'backend': 'memnotify.backends.redis_backend.RedisBackend', 'redis_db': 1}
+        notifier = cached.CachedBackend(**options)
+        other_notifier = cached.CachedBackend(**options)
+        try:
+            with notifier as connection, other_notifier as other_connection:
+                self.assertEqual(notifier.global_num_unread(), 0)
+                other_notifier.global_send('Global', INFO)
+                for i in range(50):
+                    if notifier._get(notifier._get_user_key(None)) is None:
+                        break
+                    time.sleep(0.1)
+                self.assertEqual(notifier.global_num_unread(), 1)
+        finally:
+            notifier._subscription.stop()
+            other_notifier._subscription.stop()
+            notifier.backend.redis.flushdb()
+
+    def test_redis_seen_subscription(self):
+        options = {'backend': 'memnotify.backends.redis_backend.RedisBackend', 'redis_db': 1}
+        notifier = cached.CachedBackend(**options)
+        other_notifier = cached.CachedBackend(**options)
+        user = User.objects.create(id=1, username='testuser')
+        try:
+            with notifier as connection, other_notifier as other_connection:
+                self.assertEqual(other_notifier.global_num_unread(), 0)
+                notifier.global_send('Global', INFO)
+                for i in range(50):
+                    if other_notifier._get(other_notifier._get_user_key(None)) is None:
+                        break
+                    time.sleep(0.1)
+                self.assertEqual(other_notifier.global_num_unread(user), 1)
+                self.assertEqual(len(notifier.global_get_messages(user)), 1)
+                for i in range(50):
+                    if other_notifier._get(other_notifier._get_user_key(user)) is None:
+                        break
+                    time.sleep(0.1)
+                self.assertEqual(other_notifier.global_num_unread(user), 0)
+        finally:
+            notifier._subscription.stop()
+            other_notifier._subscription.stop()
+            notifier.backend.redis.flushdb()
+
+
+class BenchmarksTestCase(TestCase):
+    def test_command(self):
+        stdout = io.StringIO()
+        call_command('memnotify_benchmark', '--backend=memnotify.backends.locmem.LocMemBackend', '--messages', '3',
+                     '--concurrency', '1', '2', '--iterations=5', '--json', stdout=stdout)
+        output = json.loads(stdout.getvalue())
+        self.assertEqual(output['backend'], 'memnotify.backends.locmem.LocMemBackend')
+        self.assertEqual(len(output['results']), 8)
+        result = output['results'][0]
+        self.assertEqual((result['operation'], result['messages'], result['concurrency']), ('get_messages', 3, 1))
+        self.assertGreater(result['ops_per_sec'], 0)
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertEqual(result['round_trips'], None)
+
+    @override_settings(MEMNOTIFY_REDIS_DB=1)
+    def test_isolation(self):
+        notifier = redis_backend.RedisBackend()
+        notifier.open()
+        try:
+            notifier.global_send('Global', INFO)
+            pubsub = notifier.redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe('*:changes')
+            pubsub.get_message(timeout=1)
+            call_command('memnotify_benchmark', '--backend=memnotify.backends.redis_backend.RedisBackend',
+                         '--operations', 'global_get_messages', 'send', '--messages', '2',
+                         '--concurrency', '1', '--iterations=2', '--json', stdout=io.StringIO())
+            self.assertEqual(pubsub.get_message(timeout=0.1), None)
+            pubsub.close()
+            self.assertEqual([msg['content'] for msg in notifier.global_get_messages()], ['Global'])
+            self.assertEqual(list(notifier.redis.scan_iter(match='%s:*' % benchmarks.KEY_PREFIX)), [])
+        finally:
+            notifier.redis.flushdb()
+
+    def test_allow_global(self):
+        backend = '--backend=memnotify.backends.base.BaseMemnotifyBackend'
+        with self.assertRaises(CommandError):
+            call_command('memnotify_benchmark', backend, '--operations', 'global_get_messages', stdout=io.StringIO())
+
+    def test_shared_memory_isolation(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with patch('memnotify.benchmarks.tempfile.tempdir', tmpdir):
+                notifier = benchmarks.get_isolated_backend('memnotify.backends.shared_memory.SharedMemoryBackend')
+                self.assertEqual(os.path.dirname(notifier._path), tmpdir)
+                notifier.send(User(pk=1), 'Test', INFO)
+                benchmarks.remove_data(notifier)
+                self.assertEqual(os.listdir(tmpdir), [])
+                call_command('memnotify_benchmark', '--backend=memnotify.backends.shared_memory.SharedMemoryBackend',
+                             '--operations', 'global_get_messages', 'send', '--messages', '2', '--concurrency', '1',
+                             '--iterations=2', '--json', stdout=io.StringIO())
+            self.assertEqual(os.listdir(tmpdir), [])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_redis_round_trips(self):
+        notifier = redis_backend.RedisBackend(redis_db=1)
+        try:
+            results = benchmarks.bench_operations(notifier, ['num_unread', 'send'], message_counts=[2], concurrency=[1], iterations=5)
+        finally:
+            notifier.redis.flushdb()
+        self.assertEqual([result['operation'] for result in results], ['num_unread', 'send'])
+        self.assertEqual([result['round_trips'] for result in results], [1, 1])
+
+
+class SerializersTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(id=random.randint(1, 999999999), username='testuser')
+        self.msg = {
+            'content': 'Test',
+            'level': ERROR,
+            'created_at': datetime.datetime.now(),
+            'sender': self.user,
+            'expired_at': datetime.datetime.now() + datetime.timedelta(days=1),
+            'one_time': True,
+        }
+
+    def check_compact_serializer(self, serializer):
+        raw_msg = serializer.dumps(self.msg)
+        self.assertTrue(len(raw_msg) < len(pickle.dumps(self.msg)))
+        self.assertEqual(serializer.loads(raw_msg), self.msg)
+
+        msg = dict(self.msg, sender='system', expired_at=None)
+        del msg['one_time']
+        self.assertEqual(serializer.loads(serializer.dumps(msg)), msg)
+
+        aware_date = datetime.datetime(2030, 1, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc)
+        msg = dict(self.msg, expired_at=aware_date)
+        self.assertEqual(serializer.loads(serializer.dumps(msg))['expired_at'], aware_date)
+
+        self.assertEqual(serializer.loads(pickle.dumps(self.msg)), self.msg)
+
+    def test_json_serializer(self):
+        self.check_compact_serializer(serializers.JSONSerializer())
+
+    @unittest.skipIf(serializers.msgpack is None, 'msgpack is not installed')
+    def test_msgpack_serializer(self):
+        self.check_compact_serializer(serializers.MsgpackSerializer())
+
+    def test_lazy_sender(self):
+        serializer = serializers.JSONSerializer()
+        raw_msg = serializer.dumps(self.msg)
+        with self.assertNumQueries(0):
+            msg = serializer.loads(raw_msg)
+        with self.assertNumQueries(1):
+            self.assertEqual(msg['sender'].username, 'testuser')
@@ -0,0 +1,7 @@
+from django.urls import path
+from . import views
+
+app_name = 'memnotify'
+urlpatterns = [
+	path('stream/', views.stream, name='stream'),
+]
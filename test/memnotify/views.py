@@ -0,0 +1,69 @@
+"""Views for memnotify."""
+
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponseForbidden, StreamingHttpResponse
+
+import memnotify
+
+
+_KEEPALIVE = 15
+# Seconds a stream is kept open by default before the browser has to reconnect
+_MAX_AGE = 300
+
+
+def _format_event(event, msg):
+    data = {
+        'content': msg['content'],
+        'level': msg['level'],
+        'created_at': msg['created_at'],
+        'expired_at': msg['expired_at'],
+    }
+    return 'event: %s\ndata: %s\n\n' % (event, json.dumps(data, cls=DjangoJSONEncoder))
+
+
+async def _events(user):
+    """
+    Yields the events of the stream of user until its maximum age, as Django
+    does not stop the stream when the client disconnects.
+    """
+    notifier = memnotify._get_notifier()
+    deadline = time.monotonic() + getattr(settings, 'MEMNOTIFY_STREAM_MAX_AGE', _MAX_AGE)
+    yield 'retry: 5000\n\n'
+    async with notifier as connection:
+        events = notifier.alisten(user, timeout=_KEEPALIVE)
+        try:
+            async for event in events:
+                if event is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield _format_event(*event)
+                if time.monotonic() >= deadline:
+                    break
+        finally:
+            # Releases the subscriptions as soon as the stream ends
+            await events.aclose()
+
+
+async def stream(request):
+    """
+    Server-sent events stream that pushes the messages sent to the current
+    user and the global messages as they are sent.
+
+    The connection is kept open, so it must be served through ASGI (see
+    webtest/asgi.py). It is closed after MEMNOTIFY_STREAM_MAX_AGE seconds
+    (300 by default) and the browser opens a new one, so streams of clients
+    that disconnected do not keep their subscriptions forever.
+    """
+    user = await sync_to_async(auth.get_user)(request)
+    if not user.is_authenticated:
+        return HttpResponseForbidden()
+    response = StreamingHttpResponse(_events(user), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
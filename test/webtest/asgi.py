@@ -3,6 +3,11 @@ ASGI config for webtest project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The memnotify stream (/memnotify/stream/) keeps its connections open, so it
+must be served through this entry point, e.g.:
+
+    uvicorn webtest.asgi:application
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 """
@@ -18,5 +18,6 @@ from django.urls import include, path
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('memnotify/', include('memnotify.urls', namespace='memnotify')),
     path('', include('main.urls', namespace='main'))
 ]